@@ -0,0 +1,72 @@
+"""
+Checks that registered rollup engines make the same greedy choices as the reference implementation.
+
+usage: python benchmarks/check_equivalence.py [--engines NAME ...] [--files ONTOLOGY_FILE ANNOTATION_FILE ANNOTATORS]
+
+The reference implementation, a frozen copy of the original greedy loop (see rollup.models.equivalence.reference_engine),
+and each engine are run on a set of small generated ontologies of different shapes (see benchmarks/generate.py) and,
+with --files, on given input files. The first divergence of each engine from the reference is printed; the exit status is 1 if any engine
+diverges.
+"""
+__author__ = 'Aaron J Masino'
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import generate
+from rollup.models import equivalence
+
+# (name, concepts, generate.write_dataset arguments) of the generated inputs
+SHAPES = [('balanced', 600, {}),
+          ('shallow', 600, {'depth': 3, 'branching': 9.0}),
+          ('deep', 600, {'depth': 30, 'branching': 1.3}),
+          ('multi_parent', 600, {'multi_parent_rate': 0.8}),
+          ('leaf_annotations', 600, {'annotator_rate': 0.0, 'zipf_exponent': 3.0}),
+          ('heavy_tail', 600, {'annotator_rate': 0.5, 'zipf_exponent': 1.5})]
+
+# rollups of generated inputs run down to this many direct annotators
+GENERATED_ANNOTATORS = 10
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument('--engines', nargs='+', choices=sorted(equivalence.ENGINES))
+    parser.add_argument('--files', nargs=3, metavar=('ONTOLOGY_FILE', 'ANNOTATION_FILE', 'ANNOTATORS'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv[1:])
+
+    inputs = []
+    data_dir = tempfile.mkdtemp(prefix='rollup_equivalence_')
+    try:
+        for name, concepts, kwargs in SHAPES:
+            paths = generate.write_dataset(os.path.join(data_dir, name), concepts, seed=args.seed, **kwargs)
+            inputs.append((name, paths[0], paths[1], GENERATED_ANNOTATORS))
+        if args.files:
+            inputs.append((os.path.basename(args.files[0]), args.files[0], args.files[1], int(args.files[2])))
+
+        diverged = False
+        for name, ontology_filename, annotations_filename, annotators in inputs:
+            results = equivalence.check_engines(ontology_filename, annotations_filename, annotators,
+                                                engines=args.engines)
+            for engine, divergence in sorted(results.items()):
+                if divergence is None:
+                    print("{0}\t{1}\tequivalent".format(name, engine))
+                else:
+                    diverged = True
+                    print("{0}\t{1}\tdiverges at iteration {2}: {3} expected {4} got {5} ({6})"
+                          .format(name, engine, divergence.iteration, divergence.field, divergence.expected,
+                                  divergence.actual, divergence.kind))
+    finally:
+        shutil.rmtree(data_dir)
+    return 1 if diverged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
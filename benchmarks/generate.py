@@ -0,0 +1,150 @@
+"""
+Seeded generator of synthetic SNOMED-like IS_A ontologies and annotations in the FILE_ONTOLOGY / FILE_ANNOTATIONS
+text formats.
+
+usage: python benchmarks/generate.py OUTPUT_DIR CONCEPTS [OBJECTS] [SEED] [--depth N] [--branching X]
+       [--multi-parent-rate P] [--annotator-rate P] [--zipf-exponent X]
+
+Concepts are laid out in levels below a single root; the number of concepts per level grows by the branching factor
+until the requested number is reached. Every concept below the root has a parent on the level above and, with the
+multi parent rate, one or two extra parents on higher levels. Every leaf and a fraction of the other concepts
+directly annotate objects, and the number of objects a concept annotates follows a power law (Zipf) distribution.
+"""
+__author__ = 'Aaron J Masino'
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rollup.utils import output
+
+# (name, type, description) of the write_dataset arguments that shape the generated dataset, see add_shape_arguments
+SHAPE_PARAMETERS = (('depth', int, "maximum number of levels below the root (default 12)"),
+                    ('branching', float, "growth in the number of concepts from one level to the next (default 4)"),
+                    ('multi_parent_rate', float, "probability that a concept has extra parents (default 0.3)"),
+                    ('annotator_rate', float, "probability that a concept that is not a leaf annotates objects "
+                                              "(default 0.1)"),
+                    ('zipf_exponent', float, "exponent of the power law of the objects annotated by a concept "
+                                             "(default 2)"))
+
+
+def generate_ontology(concepts, depth=12, branching=4.0, multi_parent_rate=0.3, seed=0):
+    """
+    :param concepts: number of concepts
+    :param depth: maximum number of levels below the root
+    :param branching: growth in the number of concepts from one level to the next
+    :param multi_parent_rate: probability that a concept has extra parents on higher levels
+    :param seed: random seed
+    :return: (levels, parents) - int array of the level of each concept (concept 0 is the root) and list of the
+             parent concept indices of each concept
+    """
+    rng = np.random.RandomState(seed)
+    sizes = [1]
+    while sum(sizes) < concepts:
+        if len(sizes) > depth:
+            # deepest level takes the remaining concepts
+            sizes[-1] += concepts - sum(sizes)
+            break
+        sizes.append(min(int(np.ceil(sizes[-1] * branching)), concepts - sum(sizes)))
+    levels = np.repeat(np.arange(len(sizes)), sizes)
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    parents = [[]]
+    for c in range(1, concepts):
+        level = levels[c]
+        # skewed choice of the primary parent, so some concepts have many children
+        above = starts[level] - starts[level - 1]
+        primary = starts[level - 1] + int(above * rng.power(0.6))
+        ps = [min(primary, starts[level] - 1)]
+        if level > 1 and rng.rand() < multi_parent_rate:
+            for _ in range(rng.randint(1, 3)):
+                p = int(rng.randint(0, starts[level]))
+                if p not in ps and p != 0:
+                    ps.append(p)
+        parents.append(ps)
+    return levels, parents
+
+
+def generate_annotations(parents, objects, annotator_rate=0.1, zipf_exponent=2.0, seed=0):
+    """
+    :param parents: list of the parent concept indices of each concept, as returned by generate_ontology
+    :param objects: number of objects in the object pool
+    :param annotator_rate: probability that a concept that is not a leaf directly annotates objects
+    :param zipf_exponent: exponent of the Zipf distribution of the number of objects annotated by a concept
+    :param seed: random seed
+    :return: dictionary {concept index: int array of object indices}
+    """
+    rng = np.random.RandomState(seed + 1)
+    has_children = np.zeros(len(parents), dtype=bool)
+    for ps in parents:
+        has_children[ps] = True
+    annotators = np.flatnonzero(~has_children | (rng.rand(len(parents)) < annotator_rate))
+    counts = np.minimum(rng.zipf(zipf_exponent, len(annotators)), objects)
+    annotations = {}
+    for c, k in zip(annotators, counts):
+        annotations[int(c)] = np.unique(rng.randint(0, objects, k))
+    return annotations
+
+
+def write_dataset(directory, concepts, objects=None, seed=0, **kwargs):
+    """
+    Generates an ontology and annotations and writes them as ontology.txt and annotations.txt in directory
+    :param kwargs: passed to generate_ontology and generate_annotations
+    :return: (ontology file path, annotation file path)
+    """
+    if objects is None:
+        objects = concepts * 2
+    ont_args = dict((k, v) for k, v in kwargs.items() if k in ('depth', 'branching', 'multi_parent_rate'))
+    ann_args = dict((k, v) for k, v in kwargs.items() if k in ('annotator_rate', 'zipf_exponent'))
+    _, parents = generate_ontology(concepts, seed=seed, **ont_args)
+    annotations = generate_annotations(parents, objects, seed=seed, **ann_args)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    ontology_file = os.path.join(directory, 'ontology.txt')
+    annotations_file = os.path.join(directory, 'annotations.txt')
+    for path in (ontology_file, annotations_file):
+        if os.path.exists(path):
+            os.remove(path)
+    output.write_lines((output.key_values_line("C{0}".format(c), ["C{0}".format(p) for p in ps])
+                        for c, ps in enumerate(parents)), ontology_file)
+    output.write_lines(("C{0}:{1}".format(c, ",".join(["V{0}".format(o) for o in objs]))
+                        for c, objs in annotations.items()), annotations_file)
+    return ontology_file, annotations_file
+
+
+def add_shape_arguments(parser, grid=False):
+    """
+    Adds an option for each of SHAPE_PARAMETERS to an argparse parser (--depth, --branching, --multi-parent-rate,
+    --annotator-rate and --zipf-exponent), stored under the parameter name with a default of None
+    :param grid: if True each option takes a list of values
+    """
+    for name, type_, description in SHAPE_PARAMETERS:
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, type=type_, nargs='+' if grid else None,
+                            help=description)
+
+
+def shape_arguments(args):
+    """:return: dictionary of the shape parameters given in args, parsed with add_shape_arguments"""
+    return dict((name, getattr(args, name)) for name, _, _ in SHAPE_PARAMETERS if getattr(args, name) is not None)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument('output_dir')
+    parser.add_argument('concepts', type=int)
+    parser.add_argument('objects', type=int, nargs='?', help="number of objects (default twice the concepts)")
+    parser.add_argument('seed', type=int, nargs='?', default=0)
+    add_shape_arguments(parser)
+    args = parser.parse_args(argv[1:])
+    paths = write_dataset(args.output_dir, args.concepts, args.objects, args.seed, **shape_arguments(args))
+    print("Wrote {0}\n{1}".format(*paths))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Times the phases of a rollup run on synthetic ontologies (see benchmarks/generate.py) and records peak memory.
+
+usage: python benchmarks/run_benchmarks.py [--sizes N ...] [--backends compact networkx] [--output RESULTS.json]
+       [--depth N ...] [--branching X ...] [--multi-parent-rate P ...] [--annotator-rate P ...]
+       [--zipf-exponent X ...]
+       python benchmarks/run_benchmarks.py --compare BASELINE.json RESULTS.json
+
+The ontologies are generated with the generate.py defaults; the shape options each take one or more values and the
+benchmarks are run for every combination of them. For each ontology size, shape and backend a fresh process parses the annotations, builds the ontology and propagates the
+annotations, runs a fixed number of rollup iterations and writes one checkpoint of every output file, so the peak
+resident set size of each run is its own. Results are written as JSON together with the git commit they were
+measured on; --compare prints the ratio of each phase time and peak memory between two result files.
+"""
+__author__ = 'Aaron J Masino'
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+
+import generate
+import main as rollup_main
+from rollup.models import ontology
+from rollup.models import rollup
+from rollup.utils import parsing
+
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+DEFAULT_BACKENDS = ['compact']
+DEFAULT_ITERATIONS = 1000
+
+# phases in the order they run, used to lay out reports
+PHASES = ('parse', 'propagate', 'rollup', 'checkpoint')
+
+
+def peak_rss_kb():
+    """:return: peak resident set size of this process in kilobytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_phases(ontology_filename, annotations_filename, backend, iterations):
+    """
+    Runs each phase once in this process
+    :return: dictionary {phase: {'seconds': wall time, 'peak_rss_kb': peak memory of the process after the phase}}
+             with 'rollup_iterations' and 'concepts' added
+    """
+    results = {}
+
+    def record(phase, t0):
+        results[phase] = {'seconds': time.time() - t0, 'peak_rss_kb': peak_rss_kb()}
+
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        t0 = time.time()
+        direct_annotations = parsing.DirectAnnotations.from_file(annotations_filename)
+        record('parse', t0)
+
+        t0 = time.time()
+        factory = ontology.OntologyFactory()
+        if backend == 'compact':
+            ont = factory.build_compact_ontology_from_files(ontology_filename, annotations_filename,
+                                                            direct_annotations=direct_annotations)
+        else:
+            ont = factory.build_ontology_from_files(ontology_filename, annotations_filename, object_sets='bitmap',
+                                                    count_only=True, direct_annotations=direct_annotations)
+        record('propagate', t0)
+        concepts = len(ont.concepts())
+
+        t0 = time.time()
+        trajectories = {}
+        rollups, rollup_levels, best_means, best_stdevs = rollup.rollup(ont, 1, iterations, 10 ** 9,
+                                                                        trajectories=trajectories)
+        record('rollup', t0)
+
+        output_dir = tempfile.mkdtemp(prefix='rollup_benchmark_')
+        try:
+            output_files = {'FILE_ROLLUP': 'rollup_{0}.txt', 'FILE_ROLLUP_LEVELS': 'levels_{0}.txt',
+                            'FILE_BEST_MEAN_IC': 'mean_ic_{0}.txt', 'FILE_BEST_STDEV_IC': 'stdev_ic_{0}.txt',
+                            'FILE_ONTOLOGY': 'ontology_{0}.txt', 'FILE_ANNOTATIONS': 'annotations_{0}.txt',
+                            'DIR_ARRAYS': 'arrays_{0}'}
+            output_files = dict((k, os.path.join(output_dir, v)) for k, v in output_files.items())
+            t0 = time.time()
+            rollup_main.checkpoint_save(len(rollups), rollups, rollup_levels, best_means, best_stdevs, ont,
+                                        {'FILE_ANNOTATIONS': annotations_filename}, output_files,
+                                        direct_annotations, trajectories)
+            record('checkpoint', t0)
+        finally:
+            shutil.rmtree(output_dir)
+
+    results['rollup_iterations'] = len(trajectories['leaf_counts'])
+    results['concepts'] = concepts
+    return results
+
+
+def run_worker(ontology_filename, annotations_filename, backend, iterations):
+    """runs the phases in a new process and returns its results"""
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--worker', ontology_filename,
+                                   annotations_filename, backend, str(iterations)])
+    return json.loads(out.decode('utf-8').strip().split("\n")[-1])
+
+
+def environment():
+    """:return: dictionary describing the code and machine the benchmarks run on"""
+    def git(*args):
+        try:
+            return subprocess.check_output(('git',) + args, cwd=REPO_DIR,
+                                           stderr=subprocess.DEVNULL).decode('utf-8').strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return {'commit': git('rev-parse', 'HEAD'),
+            'dirty': bool(status) if status is not None else None,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processors': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def shape_name(shape):
+    """:return: name of a dictionary of generate.write_dataset shape arguments, empty for the default shape"""
+    return "_".join(["{0}{1}".format(k, shape[k]) for k in sorted(shape)])
+
+
+def shape_grid(grid):
+    """
+    :param grid: dictionary {shape parameter: list of values}
+    :return: list of shape dictionaries, one for every combination of the values
+    """
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[k] for k in keys])]
+
+
+def run_benchmarks(sizes, backends, iterations, data_dir, seed=0, shapes=None):
+    """
+    :param sizes: list of numbers of concepts
+    :param backends: list of 'compact' and/or 'networkx'
+    :param iterations: number of rollup iterations timed per run
+    :param data_dir: directory of generated datasets, a dataset already generated for a size, shape and seed is
+           reused
+    :param seed: random seed of the generated datasets
+    :param shapes: list of dictionaries of generate.write_dataset shape arguments (see generate.SHAPE_PARAMETERS),
+           by default only the generate.py default shape
+    :return: dictionary of the environment, parameters and a list of results per size, shape and backend
+    """
+    runs = []
+    for size in sizes:
+        for shape in shapes or [{}]:
+            name = shape_name(shape)
+            directory = os.path.join(data_dir, 'synthetic_{0}_{1}'.format(size, seed) + ('_' + name if name else ''))
+            ontology_filename = os.path.join(directory, 'ontology.txt')
+            annotations_filename = os.path.join(directory, 'annotations.txt')
+            if not (os.path.exists(ontology_filename) and os.path.exists(annotations_filename)):
+                t0 = time.time()
+                generate.write_dataset(directory, size, seed=seed, **shape)
+                print("Generated {0} concepts in {1:.2f}s".format(size, time.time() - t0))
+            for backend in backends:
+                result = run_worker(ontology_filename, annotations_filename, backend, iterations)
+                result.update({'size': size, 'shape': shape, 'backend': backend})
+                runs.append(result)
+                print("{0}\t{1}\t".format(size, backend) + (name + "\t" if name else "") +
+                      "\t".join(["{0} {1:.3f}s".format(p, result[p]['seconds']) for p in PHASES]) +
+                      "\tpeak {0:.1f}MB".format(result['checkpoint']['peak_rss_kb'] / 1024.0))
+    return {'environment': environment(), 'seed': seed, 'iterations': iterations, 'runs': runs}
+
+
+def _run_key(run):
+    # result files written before shapes were recorded only hold runs of the default shape
+    return run['size'], shape_name(run.get('shape', {})), run['backend']
+
+
+def compare(baseline, results):
+    """
+    :param baseline: results dictionary returned by run_benchmarks
+    :param results: results dictionary returned by run_benchmarks
+    :return: list of report lines with the ratio results / baseline of each phase time and of peak memory for the
+             runs in both
+    """
+    base_runs = dict((_run_key(r), r) for r in baseline['runs'])
+    lines = ["{0} -> {1}".format(baseline['environment']['commit'], results['environment']['commit']),
+             "size\tshape\tbackend\t" + "\t".join(PHASES) + "\tpeak_rss"]
+    for run in results['runs']:
+        base = base_runs.get(_run_key(run))
+        if base is None:
+            continue
+        ratios = [run[p]['seconds'] / max(base[p]['seconds'], 1e-9) for p in PHASES]
+        ratios.append(run['checkpoint']['peak_rss_kb'] / float(max(base['checkpoint']['peak_rss_kb'], 1)))
+        size, shape, backend = _run_key(run)
+        lines.append("{0}\t{1}\t{2}\t".format(size, shape or 'default', backend) +
+                     "\t".join(["{0:.2f}x".format(r) for r in ratios]))
+    return lines
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    if len(argv) > 1 and argv[1] == '--worker':
+        print(json.dumps(run_phases(argv[2], argv[3], argv[4], int(argv[5]))))
+        return 0
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--backends', nargs='+', default=DEFAULT_BACKENDS, choices=['compact', 'networkx'])
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'rollup_benchmarks'))
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULTS'))
+    generate.add_shape_arguments(parser, grid=True)
+    args = parser.parse_args(argv[1:])
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            results = json.load(f)
+        print("\n".join(compare(baseline, results)))
+        return 0
+
+    results = run_benchmarks(args.sizes, args.backends, args.iterations, args.data_dir, args.seed,
+                             shape_grid(generate.shape_arguments(args)))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results written to {0}".format(args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Compares rollups of ontologies built with HyperLogLog sketch counts against the rollup with exact counts.
+
+usage: python benchmarks/sketch_accuracy.py ONTOLOGY_FILE ANNOTATION_FILE TOTAL_ANNOTATORS [ERROR ...]
+
+For each relative error the script prints the build time, the error of the estimated annotated object counts, the
+first iteration whose greedy choice differs from the exact rollup, the fraction of concepts rolled to the same
+concepts, and the divergence of the Psi trajectory (see rollup.models.rollup.psi_divergence).
+"""
+__author__ = 'Aaron J Masino'
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rollup.models import ontology
+from rollup.models import rollup
+
+
+def build_and_rollup(ontology_filename, annotations_filename, total_annotators, sketch_error=None):
+    """
+    :return: (ontology counts before rollup, rollups, trajectories, rolled leaf sequence, build seconds)
+    """
+    t0 = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ont = ontology.OntologyFactory().build_compact_ontology_from_files(ontology_filename, annotations_filename,
+                                                                           sketch_error=sketch_error)
+    build_time = time.time() - t0
+    counts = np.array(ont.object_counts)
+    trajectories = {}
+    # rollup only needs append from an iteration log, a list records the sequence of rolled leaves
+    sequence = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        rollups, _, _, _ = rollup.rollup(ont, total_annotators, max_iters=10 ** 9, print_freq=10 ** 9,
+                                         iteration_log=sequence, trajectories=trajectories)
+    return counts, rollups, trajectories, [record.leaf for record in sequence], build_time
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    if len(argv) < 4:
+        print(__doc__)
+        return 1
+    ontology_filename, annotations_filename, total_annotators = argv[1], argv[2], int(argv[3])
+    errors = [float(e) for e in argv[4:]] or [0.05, 0.02, 0.01, 0.005]
+
+    exact_counts, exact_rollups, exact_trajectories, exact_sequence, exact_time = \
+        build_and_rollup(ontology_filename, annotations_filename, total_annotators)
+    print("exact\tbuild {0:.2f}s\titerations {1}".format(exact_time, len(exact_sequence)))
+    annotated = exact_counts > 0
+    for error in errors:
+        counts, rollups, trajectories, sequence, build_time = \
+            build_and_rollup(ontology_filename, annotations_filename, total_annotators, error)
+        count_errors = np.abs(counts[annotated] / exact_counts[annotated].astype(float) - 1)
+        first_change = next((i + 1 for i, (a, b) in enumerate(zip(sequence, exact_sequence)) if a != b),
+                            None if len(sequence) == len(exact_sequence) else min(len(sequence),
+                                                                                   len(exact_sequence)) + 1)
+        same = sum([1 for k, v in exact_rollups.items() if sorted(rollups.get(k, [])) == sorted(v)])
+        divergence = rollup.psi_divergence(trajectories, exact_trajectories)
+        print("error {0}\tbuild {1:.2f}s\tcount error mean {2:.4f} max {3:.4f}\tfirst changed iteration {4}"
+              "\tsame rollup {5:.3f}\tPsi divergence max {6:.4f} mean {7:.4f}"
+              .format(error, build_time, count_errors.mean(), count_errors.max(), first_change,
+                      same / float(len(exact_rollups)), divergence['max'], divergence['mean']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
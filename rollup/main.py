@@ -1,10 +1,18 @@
 __author__ = 'Aaron J Masino'
 
+import os
 import sys
+from rollup.models import closure
+from rollup.models import compact
 from rollup.models import rollup
 from rollup.models import ontology
+from rollup.models import overlay
+from rollup.utils import checkpoint
 from rollup.utils import config_helper
+from rollup.utils import iteration_log
+from rollup.utils import metrics
 from rollup.utils import collections
+from rollup.utils import parsing
 from functools import partial
 
 
@@ -15,9 +23,11 @@ def main(argv=None):
 
     if len(argv) < 2:
         print("Configuration file path must be provided.\nExiting now.")
+        print("Usage: python main.py PATH/TO/CONFIG/FILE [--resume]")
 
     else:
         config_path = argv[1]
+        resume = '--resume' in argv[2:]
         print("Running with config: {0}".format(config_path))
         config = config_helper.loadConfig(config_path)
         input_files = config_helper.ConfigSectionMap(config, "Input_Files")
@@ -26,38 +36,198 @@ def main(argv=None):
         print("Creating ontology from:\n{0}\n{1}".format(input_files['FILE_ONTOLOGY'],
                                                          input_files['FILE_ANNOTATIONS']))
 
+        rollup_options = config_helper.ConfigSectionMap(config, "Rollup_Options")
         ont_factory = ontology.OntologyFactory()
+        parse_processes = int(rollup_options.get('PARSE_PROCESSES', 1))
+        # the original annotations are captured once, in compact form, when rolled annotations are to be stored
+        direct_annotations = None
+        if 'FILE_ANNOTATIONS' in output_files:
+            direct_annotations = parsing.DirectAnnotations.from_file(input_files['FILE_ANNOTATIONS'],
+                                                                     processes=parse_processes)
+
+        # with SKETCH_ERROR annotated object counts are estimated with HyperLogLog sketches
+        sketch_error = float(rollup_options['SKETCH_ERROR']) if 'SKETCH_ERROR' in rollup_options else None
+        validate = None
+        if config.has_section("Warm_Start"):
+            warm_options = config_helper.ConfigSectionMap(config, "Warm_Start")
+            if direct_annotations is not None:
+                # rolled annotations are written from the earlier run's annotations together with the delta
+                delta = parsing.DirectAnnotations.from_file(warm_options['FILE_ANNOTATIONS_DELTA'],
+                                                            processes=parse_processes)
+                direct_annotations = direct_annotations.merged(delta)
+            ont = ont_factory.warm_start_compact_ontology(warm_options['SNAPSHOT_DIR'],
+                                                          warm_options['FILE_ANNOTATIONS_DELTA'],
+                                                          warm_options.get('PREVIOUS_ANNOTATIONS'),
+                                                          parse_processes)
+            if 'UPDATED_SNAPSHOT_DIR' in warm_options:
+                ont.save(warm_options['UPDATED_SNAPSHOT_DIR'])
+            validate = iteration_log.read_iteration_log(warm_options['ITERATION_LOG'], ont.concepts())
+        elif config.has_section("Ontology_Cache"):
+            cache_options = config_helper.ConfigSectionMap(config, "Ontology_Cache")
+            ont = ont_factory.load_or_build_compact_ontology(input_files['FILE_ONTOLOGY'],
+                                                             input_files['FILE_ANNOTATIONS'],
+                                                             cache_options['CACHE_DIR'],
+                                                             cache_options.get('FORCE_REBUILD', 'false').lower()
+                                                             == 'true',
+                                                             parse_processes, direct_annotations)
+        elif rollup_options.get('ONTOLOGY_BACKEND', 'networkx').lower() == 'compact':
+            ont = ont_factory.build_compact_ontology_from_files(input_files['FILE_ONTOLOGY'],
+                                                                input_files['FILE_ANNOTATIONS'],
+                                                                parse_processes, direct_annotations, sketch_error)
+        else:
+            ont = ont_factory.build_ontology_from_files(input_files['FILE_ONTOLOGY'], input_files['FILE_ANNOTATIONS'],
+                                                        object_sets=rollup_options.get('OBJECT_SETS', 'list').lower()
+                                                        if sketch_error is None else 'sketch',
+                                                        count_only=rollup_options.get('COUNT_ONLY', 'false').lower()
+                                                        == 'true',
+                                                        parse_processes=parse_processes,
+                                                        direct_annotations=direct_annotations,
+                                                        sketch_error=sketch_error)
+
+        run_rollup(ont, rollup_options, input_files, output_files, direct_annotations, resume, validate)
 
-        ont = ont_factory.build_ontology_from_files(input_files['FILE_ONTOLOGY'], input_files['FILE_ANNOTATIONS'])
+        print("Rollup.main() completed.")
 
-        print("Starting rollup ...")
-        rollup_options = config_helper.ConfigSectionMap(config, "Rollup_Options")
-        checkpoints = None
-        checkpoint_hook = None
-        if "CHECK_POINTS" in rollup_options:
-            checkpoints = config_helper.getListInt(config, "Rollup_Options", "CHECK_POINTS")
-            checkpoint_hook = partial(checkpoint_save,
-                                      ont=ont,
-                                      input_files=input_files,
-                                      output_files=output_files)
 
+def run_rollup(ont, rollup_options, input_files, output_files, direct_annotations=None, resume=False, validate=None):
+    """
+    Runs the rollup of an ontology with the options of a configuration and stores its checkpoint and final output
+    :param ont: ontology built from input_files. A CompactOntology is not changed, the rollup records its changes in an
+           overlay; any other ontology (the networkx backend) is rolled up in place
+    :param rollup_options: Rollup_Options section of the configuration
+    :param input_files: Input_Files section of the configuration
+    :param output_files: Output_Files section of the configuration
+    :param direct_annotations: optional rollup.utils.parsing.DirectAnnotations of the input annotation file, used to
+           write rolled annotations
+    :param resume: if True the iterations in FILE_ITERATION_LOG are replayed before the rollup continues
+    :param validate: optional iteration log of an earlier rollup to compare the greedy choices with
+    """
+    if isinstance(ont, compact.CompactOntology):
+        ont = overlay.OntologyOverlay(ont)
+
+    # rollup levels are computed from a closure index of the original graph
+    closure_index = None
+    if rollup_options.get('CLOSURE_INDEX', 'false').lower() == 'true':
+        closure_index = closure.ClosureIndex.from_ontology(ont)
+        ont.set_closure_index(closure_index)
+
+    # every iteration is logged so that an interrupted run can be resumed by replaying the log
+    replay = None
+    log_writer = None
+    if 'FILE_ITERATION_LOG' in output_files:
+        log_path = output_files['FILE_ITERATION_LOG']
+        concepts = ont.concepts()
+        if resume and os.path.exists(log_path):
+            replay = iteration_log.read_iteration_log(log_path, concepts)
+            print("Resuming from {0} logged iterations in {1}".format(len(replay), log_path))
+        log_writer = iteration_log.IterationLogWriter(log_path, concepts, resume=replay is not None)
+    elif resume:
+        print("WARNING: --resume requires FILE_ITERATION_LOG in Output_Files, starting a new rollup")
+
+    # per iteration metrics are written as JSON lines and the first iterations optionally profiled
+    metrics_sink = None
+    if 'FILE_METRICS' in output_files:
+        metrics_sink = metrics.JsonlMetricsSink(output_files['FILE_METRICS'])
+    profiler = None
+    if int(rollup_options.get('PROFILE_ITERATIONS', 0)) > 0:
+        profiler = metrics.IterationProfiler(int(rollup_options['PROFILE_ITERATIONS']),
+                                             output_files.get('FILE_PROFILE'))
+
+    batch_size = rollup_options.get('BATCH_SIZE', '1').lower()
+    batch_size = batch_size if batch_size == 'auto' else int(batch_size)
+
+    print("Starting rollup ...")
+    checkpoints = None
+    checkpoint_hook = None
+    trajectories = {}
+    save = partial(checkpoint_save,
+                   input_files=input_files,
+                   output_files=output_files,
+                   original_annotations=direct_annotations)
+    writer = None
+    # the ontology only needs to be snapshot for a background writer if it is written
+    snapshot_ontology = 'FILE_ONTOLOGY' in output_files
+    if rollup_options.get('ASYNC_CHECKPOINTS', 'true').lower() == 'true':
+        # checkpoints are written by a background thread while the rollup continues
+        writer = checkpoint.CheckpointWriter(save, int(rollup_options.get('CHECKPOINT_QUEUE_SIZE', 2)))
+    if "CHECK_POINTS" in rollup_options:
+        checkpoints = [int(x.strip()) for x in rollup_options['CHECK_POINTS'].split(',')]
+        checkpoint_hook = partial(submit_checkpoint, ont=ont, save=save, writer=writer,
+                                  trajectories=trajectories, snapshot_ontology=snapshot_ontology)
+        if log_writer is not None:
+            checkpoint_hook = partial(log_checkpoint, checkpoint_hook, writer, log_writer)
+
+    try:
         rollups, rollup_levels, best_means, best_stdevs = rollup.rollup(ont,
                       int(rollup_options['TOTAL_ANNOTATORS_AFTER_ROLLUP']),
                       int(rollup_options['MAXIMUM_ITERATIONS']),
                       int(rollup_options['PRINT_STATUS_FREQ']),
-                      checkpoints, checkpoint_hook)
+                      checkpoints, checkpoint_hook,
+                      log_writer, replay, trajectories,
+                      batch_size, int(rollup_options.get('BATCH_MIN_ANNOTATORS', 0)),
+                      validate, closure_index, metrics_sink, profiler)
 
         print("Storing output ...")
-        checkpoint_save(int(rollup_options['TOTAL_ANNOTATORS_AFTER_ROLLUP']),
-                        rollups, rollup_levels, best_means, best_stdevs,
-                        ont, input_files, output_files)
+        submit_checkpoint(int(rollup_options['TOTAL_ANNOTATORS_AFTER_ROLLUP']),
+                          rollups, rollup_levels, best_means, best_stdevs,
+                          ont, save, writer, trajectories, snapshot_ontology)
+
+        if 'GREEDY_REFERENCE_ARRAYS' in rollup_options:
+            # report how far the Psi trajectory is from a pure greedy run stored with DIR_ARRAYS
+            reference = rollup.load_rollup_arrays(rollup_options['GREEDY_REFERENCE_ARRAYS'])
+            divergence = rollup.psi_divergence(trajectories, reference)
+            print("Psi divergence from greedy reference over {0} annotator counts:\nMax:\t{1} (at D = {2})"
+                  "\nMean:\t{3}\nFinal Psi difference:\t{4}".format(divergence['counts'], divergence['max'],
+                                                                divergence['argmax'], divergence['mean'],
+                                                                divergence['final']))
+    finally:
+        if log_writer is not None:
+            log_writer.close()
+        if metrics_sink is not None:
+            metrics_sink.close()
+        if writer is not None:
+            # flush all pending checkpoint writes before exiting
+            writer.close()
+
+    if profiler is not None and profiler.stats is not None and 'FILE_PROFILE' not in output_files:
+        profiler.stats.sort_stats('cumulative').print_stats(25)
+
+
+def submit_checkpoint(annotator_count,
+                      rollups, rollup_levels, best_means, best_stdevs,
+                      ont, save, writer=None, trajectories=None, snapshot_ontology=True):
+    """
+    Stores checkpoint output with save, on the background writer if one is given. Snapshots of the ontology and
+    trajectories are taken first because the rollup continues to mutate them; the ontology is only snapshot if
+    snapshot_ontology is True, i.e. if save writes it, and is otherwise not passed to the writer.
+    """
+    if trajectories is not None:
+        trajectories = dict((name, list(values)) for name, values in trajectories.items())
+    if writer is None:
+        save(annotator_count, rollups, rollup_levels, best_means, best_stdevs, ont, trajectories=trajectories)
+    else:
+        writer.submit(annotator_count, rollups, rollup_levels, best_means, best_stdevs,
+                      ont.serialization_snapshot() if snapshot_ontology else None, trajectories=trajectories)
 
-        print("Rollup.main() completed.")
+
+def log_checkpoint(submit, writer, log_writer, annotator_count, *args):
+    """
+    Checkpoint hook for a logged rollup. The iteration that reached the checkpoint is flushed to the iteration log
+    only after the checkpoint is written, so that a resumed run never replays past a checkpoint that is missing or
+    incomplete.
+    :param submit: checkpoint hook that stores the checkpoint, i.e. submit_checkpoint with its options bound
+    :param writer: the background CheckpointWriter used by submit, or None if checkpoints are written directly
+    :param log_writer: rollup.utils.iteration_log.IterationLogWriter of the rollup
+    """
+    submit(annotator_count, *args)
+    if writer is not None:
+        writer.flush()
+    log_writer.flush()
 
 
 def checkpoint_save(annotator_count,
                     rollups, rollup_levels, best_means, best_stdevs,
-                    ont, input_files, output_files):
+                    ont, input_files, output_files, original_annotations=None, trajectories=None):
     print("Storing output for checkpoint {0}".format(annotator_count))
     if 'FILE_ROLLUP' in output_files:
         rollup.serialize_rollups(rollups, output_files['FILE_ROLLUP'].format(annotator_count))
@@ -70,17 +240,14 @@ def checkpoint_save(annotator_count,
     if 'FILE_ONTOLOGY' in output_files:
         ont.serialize_nodes(output_files['FILE_ONTOLOGY'].format(annotator_count))
     if 'FILE_ANNOTATIONS' in output_files:
-        # need to reload original annotations because the ontology has been mutated in rollup
-        original_annotations = {}
-        with open(input_files['FILE_ANNOTATIONS'], 'r') as f:
-            for line in f.readlines():
-                data = line.split(":")
-                cid = data[0].strip()
-                if len(data) > 1:
-                    objects = [x.strip() for x in data[1].split(",")]
-                    original_annotations[cid] = objects
-        rolled_annotations = rollup.map_annotations_with_rollup(rollups, original_annotations)
-        collections.serialize_dict_of_lists(rolled_annotations, output_files['FILE_ANNOTATIONS'].format(annotator_count))
+        # the ontology has been mutated in rollup, rolled annotations are mapped from the original annotations
+        if original_annotations is None:
+            original_annotations = parsing.DirectAnnotations.from_file(input_files['FILE_ANNOTATIONS'])
+        rollup.serialize_rolled_annotations(rollups, original_annotations,
+                                            output_files['FILE_ANNOTATIONS'].format(annotator_count))
+    if 'DIR_ARRAYS' in output_files:
+        rollup.save_rollup_arrays(output_files['DIR_ARRAYS'].format(annotator_count), rollups, rollup_levels,
+                                  trajectories)
 
 if __name__ == '__main__':
     sys.exit(main())
\ No newline at end of file
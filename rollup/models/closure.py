@@ -0,0 +1,122 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+from rollup.models import compact
+
+
+class ClosureIndex:
+    """
+    Transitive closure of an ontology DAG with the longest path length between every concept and each of its
+    ancestors.
+
+    The ancestors of each concept are stored as a sorted CSR row of concept indices with a parallel row of longest
+    path lengths (in IS_A edges), and the descendants of each concept as the transposed CSR rows, so membership
+    queries are a binary search, O(log n), and closures are returned without traversing the graph.
+
+    Rollups only remove leaves, and a leaf is never on a path between two other concepts, so the closure of the
+    concepts that remain is unchanged: an index built before a rollup stays valid throughout it, answering queries
+    about removed concepts as they were in the original graph. Callers wanting only current concepts filter the
+    results (see Ontotology.descendant_concepts).
+    """
+    def __init__(self, concept_ids, parent_offsets, parent_indices):
+        """
+        :param concept_ids: list of concept ids, position in the list is the concept's index
+        :param parent_offsets: CSR offsets of each concept's parents
+        :param parent_indices: CSR parent concept indices
+        """
+        self.concept_ids = concept_ids
+        self.concept_index = {cid: i for i, cid in enumerate(concept_ids)}
+        n = len(concept_ids)
+        rows = [None] * n
+        lengths = [None] * n
+        # parents are visited before their children, so each concept's ancestors are built from its parents' rows
+        for i in compact.topological_order(parent_offsets, parent_indices, n)[::-1]:
+            parents = parent_indices[parent_offsets[i]:parent_offsets[i + 1]]
+            if not len(parents):
+                rows[i] = np.zeros(0, dtype=np.int32)
+                lengths[i] = np.zeros(0, dtype=np.int32)
+                continue
+            ancestors = np.concatenate([parents] + [rows[p] for p in parents])
+            depths = np.concatenate([np.ones(len(parents), dtype=np.int32)] + [lengths[p] + 1 for p in parents])
+            # keep the longest path to each ancestor
+            order = np.lexsort((-depths, ancestors))
+            ancestors = ancestors[order]
+            first = np.ones(len(ancestors), dtype=bool)
+            first[1:] = ancestors[1:] != ancestors[:-1]
+            rows[i] = ancestors[first].astype(np.int32)
+            lengths[i] = depths[order][first].astype(np.int32)
+        self.ancestor_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in rows], out=self.ancestor_offsets[1:])
+        self.ancestor_indices = np.concatenate(rows) if n else np.zeros(0, dtype=np.int32)
+        self.ancestor_lengths = np.concatenate(lengths) if n else np.zeros(0, dtype=np.int32)
+        # transposed rows are filled in concept order, so they are sorted too
+        self.descendant_offsets, self.descendant_indices = compact._transpose_csr(self.ancestor_offsets,
+                                                                                  self.ancestor_indices, n)
+
+    @classmethod
+    def from_ontology(cls, ontology):
+        """
+        :param ontology: rollup.models.ontology.Ontotology or rollup.models.compact.CompactOntology
+        :return: ClosureIndex of the ontology's current concepts
+        """
+        concept_ids = ontology.concepts()
+        index = {cid: i for i, cid in enumerate(concept_ids)}
+        parent_lists = [[index[p] for p in ontology.parent_concepts(cid)] for cid in concept_ids]
+        offsets = np.zeros(len(concept_ids) + 1, dtype=np.int64)
+        np.cumsum([len(pl) for pl in parent_lists], out=offsets[1:])
+        indices = np.array([p for pl in parent_lists for p in pl], dtype=np.int32)
+        return cls(concept_ids, offsets, indices)
+
+    def _ancestor_row(self, i):
+        return slice(self.ancestor_offsets[i], self.ancestor_offsets[i + 1])
+
+    def _find(self, descendant, ancestor):
+        """:return: position of ancestor in the ancestor row of descendant, or -1"""
+        row = self._ancestor_row(descendant)
+        indices = self.ancestor_indices[row]
+        pos = int(np.searchsorted(indices, ancestor))
+        if pos < len(indices) and indices[pos] == ancestor:
+            return row.start + pos
+        return -1
+
+    def is_ancestor(self, ancestor_id, concept_id):
+        """returns True if ancestor_id is a (proper) ancestor of concept_id"""
+        return self._find(self.concept_index[concept_id], self.concept_index[ancestor_id]) >= 0
+
+    def is_descendant(self, descendant_id, concept_id):
+        """returns True if descendant_id is a (proper) descendant of concept_id"""
+        return self.is_ancestor(concept_id, descendant_id)
+
+    def longest_path(self, concept_id, ancestor_id):
+        """
+        returns: number of edges in the longest path from concept_id to ancestor_id, 0 if they are the same concept
+                 and None if ancestor_id is not an ancestor of concept_id
+        """
+        if concept_id == ancestor_id:
+            return 0
+        pos = self._find(self.concept_index[concept_id], self.concept_index[ancestor_id])
+        return int(self.ancestor_lengths[pos]) if pos >= 0 else None
+
+    def depth(self, concept_id):
+        """returns: number of edges in the longest path from concept_id to a root concept"""
+        lengths = self.ancestor_lengths[self._ancestor_row(self.concept_index[concept_id])]
+        return int(lengths.max()) if len(lengths) else 0
+
+    def ancestors(self, concept_id):
+        """returns: list of the concept ids of all ancestors of the concept"""
+        i = self.concept_index[concept_id]
+        return [self.concept_ids[a] for a in self.ancestor_indices[self._ancestor_row(i)]]
+
+    def descendants(self, concept_id):
+        """returns: list of the concept ids of all descendants of the concept"""
+        i = self.concept_index[concept_id]
+        rows = self.descendant_indices[self.descendant_offsets[i]:self.descendant_offsets[i + 1]]
+        return [self.concept_ids[d] for d in rows]
+
+    def rollup_levels(self, rollups):
+        """
+        :param rollups: rollup dictionary returned by rollup.models.rollup.rollup
+        :return: dictionary {concept_id: highest number of edges in the original graph between the concept and the
+                 concepts it was rolled to}, 0 for concepts that were not rolled up
+        """
+        return dict((k, max([self.longest_path(k, t) for t in targets])) for k, targets in rollups.items())
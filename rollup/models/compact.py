@@ -0,0 +1,398 @@
+__author__ = 'Aaron J Masino'
+
+import copy
+import json
+import numpy as np
+import os
+from math import log, sqrt
+from rollup.utils import output
+
+
+class CompactOntology:
+    """
+    Memory compact alternative to rollup.models.ontology.Ontotology for an ontology represented as a DAG with only
+    IS_A relationships.
+
+    Concept ids are interned to dense int32 indices in the order concepts were added. Parent and child edges are
+    stored as CSR arrays (offsets into a flat array of indices) and the direct annotator flags and number of
+    annotated objects (including objects inherited through descendants) are held in NumPy arrays, so no per concept
+    Python objects are kept besides the concept id strings themselves. The methods mirror Ontotology and accept and
+    return concept ids, so the two classes can be used interchangeably by rollup.models.rollup and rollup.main.
+
+    Removing a concept only marks it as removed. Only leaves are ever removed, so the parents of every remaining
+    concept are themselves still present and the parent CSR arrays never change; children are filtered through the
+    removed mask and a per concept count of remaining children.
+    """
+    def __init__(self, concept_ids, parent_offsets, parent_indices, object_counts, is_direct_annotator,
+                 total_annotated_objects, child_offsets=None, child_indices=None):
+        """
+        :param concept_ids: list of concept ids, position in the list is the concept's index
+        :param parent_offsets: int64 array of length len(concept_ids) + 1, the parents of concept i are
+               parent_indices[parent_offsets[i]:parent_offsets[i+1]]
+        :param parent_indices: int32 array of parent concept indices
+        :param object_counts: number of unique objects annotated by each concept directly or through descendants
+        :param is_direct_annotator: bool array, True for concepts that directly annotate an object
+        :param total_annotated_objects: number of unique objects annotated by at least one concept
+        :param child_offsets: optional CSR offsets of each concept's children, derived from the parents if omitted
+        :param child_indices: optional CSR child concept indices
+        """
+        self.concept_ids = concept_ids
+        self.concept_index = {cid: i for i, cid in enumerate(concept_ids)}
+        self.parent_offsets = np.asarray(parent_offsets, dtype=np.int64)
+        self.parent_indices = np.asarray(parent_indices, dtype=np.int32)
+        if child_offsets is None:
+            child_offsets, child_indices = _transpose_csr(self.parent_offsets, self.parent_indices, len(concept_ids))
+        self.child_offsets = np.asarray(child_offsets, dtype=np.int64)
+        self.child_indices = np.asarray(child_indices, dtype=np.int32)
+        self.object_counts = np.asarray(object_counts, dtype=np.int64)
+        self.direct = np.array(is_direct_annotator, dtype=bool)
+        self.removed = np.zeros(len(concept_ids), dtype=bool)
+        self.parent_counts = np.diff(self.parent_offsets).astype(np.int32)
+        self.child_counts = np.diff(self.child_offsets).astype(np.int32)
+        self._total_annotated_objects = total_annotated_objects
+        self._leaf_frontier = None
+        self._closure = None
+
+    @classmethod
+    def from_ontology(cls, ontology):
+        """
+        :param ontology: rollup.models.ontology.Ontotology (or CompactOntology), which is not modified
+        :return: CompactOntology of the ontology's current concepts, in the same concept and parent order
+        """
+        concept_ids = ontology.concepts()
+        index = {cid: i for i, cid in enumerate(concept_ids)}
+        parent_lists = [[index[p] for p in ontology.parent_concepts(cid)] for cid in concept_ids]
+        offsets = np.zeros(len(concept_ids) + 1, dtype=np.int64)
+        np.cumsum([len(pl) for pl in parent_lists], out=offsets[1:])
+        indices = np.array([p for pl in parent_lists for p in pl], dtype=np.int32)
+        return cls(concept_ids, offsets, indices,
+                   [ontology.annotated_object_count(cid) for cid in concept_ids],
+                   [ontology.is_direct_annotator(cid) for cid in concept_ids],
+                   ontology.total_annotated_objects())
+
+    def _parents(self, i):
+        return self.parent_indices[self.parent_offsets[i]:self.parent_offsets[i + 1]]
+
+    def _children(self, i):
+        children = self.child_indices[self.child_offsets[i]:self.child_offsets[i + 1]]
+        return children[~self.removed[children]]
+
+    def concepts(self):
+        """Returns all concept ids in the ontology in a stable order (the order concepts were added)"""
+        return [self.concept_ids[i] for i in np.flatnonzero(~self.removed)]
+
+    def leaf_nodes(self):
+        """Returns all nodes that have at least 1 parent concept and no child concepts"""
+        leaves = ~self.removed & (self.parent_counts != 0) & (self.child_counts == 0)
+        return [self.concept_ids[i] for i in np.flatnonzero(leaves)]
+
+    def leaf_frontier(self):
+        """Returns the set of current leaf nodes, maintained by remove_concept after it is first built"""
+        if self._leaf_frontier is None:
+            self._leaf_frontier = set(self.leaf_nodes())
+        return self._leaf_frontier
+
+    def remove_concept(self, concept_id):
+        """
+        Removes a leaf concept from the ontology, updating the leaf frontier if one has been built
+        :param concept_id: id of a leaf concept
+        :return: list of the concept's parents that became leaves because concept_id was their last child
+        """
+        i = self.concept_index[concept_id]
+        self.removed[i] = True
+        self.direct[i] = False
+        exposed = []
+        for p in self._parents(i):
+            self.child_counts[p] -= 1
+            if self.child_counts[p] == 0 and self.parent_counts[p] != 0:
+                exposed.append(self.concept_ids[p])
+        if self._leaf_frontier is not None:
+            self._leaf_frontier.discard(concept_id)
+            self._leaf_frontier.update(exposed)
+        return exposed
+
+    def root_nodes(self):
+        """Returns all nodes that have no parent concepts as a list."""
+        return [self.concept_ids[i] for i in np.flatnonzero(~self.removed & (self.parent_counts == 0))]
+
+    def total_annotated_objects(self):
+        """returns: total number of unique object annotated by at least one concept"""
+        return self._total_annotated_objects
+
+    def annotators(self):
+        """
+        returns: list of concepts that directly annotate an object
+                [this does NOT include annotations inherited through descendants]
+        """
+        return [self.concept_ids[i] for i in np.flatnonzero(self.direct & ~self.removed)]
+
+    def total_annotators(self):
+        """returns: number of concepts that directly annotate an object"""
+        return int(np.count_nonzero(self.direct & ~self.removed))
+
+    def descendant_concepts(self, concept_id):
+        """returns: set of concept ids of all current descendants of the concept, from the closure index if one is
+        set"""
+        if self._closure is not None:
+            return set(c for c in self._closure.descendants(concept_id) if not self.removed[self.concept_index[c]])
+        seen = set()
+        stack = [self.concept_index[concept_id]]
+        while stack:
+            for c in self._children(stack.pop()):
+                if c not in seen:
+                    seen.add(c)
+                    stack.append(c)
+        return set(self.concept_ids[i] for i in seen)
+
+    def set_closure_index(self, closure_index):
+        """
+        :param closure_index: rollup.models.closure.ClosureIndex of this ontology (or of it before leaves were
+               removed), used to answer descendant queries without traversing the graph
+        """
+        self._closure = closure_index
+
+    def parent_concepts(self, concept_id):
+        return [self.concept_ids[p] for p in self._parents(self.concept_index[concept_id])]
+
+    def child_concepts(self, concept_id):
+        return [self.concept_ids[c] for c in self._children(self.concept_index[concept_id])]
+
+    def is_direct_annotator(self, concept_id):
+        """returns True if the concept directly annotates an object"""
+        return bool(self.direct[self.concept_index[concept_id]])
+
+    def set_direct_annotator(self, concept_id, is_direct_annotator=True):
+        """marks the concept as (not) directly annotating an object, e.g. when descendants are rolled up into it"""
+        self.direct[self.concept_index[concept_id]] = is_direct_annotator
+
+    def annotated_object_count(self, concept_id):
+        """returns: number of unique objects annotated by the concept directly or through its descendants"""
+        return int(self.object_counts[self.concept_index[concept_id]])
+
+    def information_content(self, concept_id, N):
+        """
+        :param concept_id: id of ontology concept
+        :param N: total number of annotated objects
+        :return: information content for the concept
+        """
+        n = self.object_counts[self.concept_index[concept_id]]
+        if n == 0:
+            # this node and its descendants do does not annotate anything
+            return float("inf")
+        else:
+            return log(N / float(n))
+
+    def total_information_content(self, N, direct_annotators_only=False):
+        """
+        :param N: total number of annotated objects
+        :param direct_annotators_only: if True only count information content for direct annotators
+        :return: sum of information content of all concepts
+        """
+        mask = ~self.removed
+        if direct_annotators_only:
+            mask &= self.direct
+        return sum([self.information_content(self.concept_ids[i], N) for i in np.flatnonzero(mask)])
+
+    def annotators_information_content(self, N):
+        """
+        :param N: total number of annotated objects
+        :return: dictionary {concept_id : information content} for all concepts that directly annotate an object
+        """
+        ic_dict = {}
+        for a in self.annotators():
+            ic_dict[a] = self.information_content(a, N)
+        return ic_dict
+
+    def _annotation_counts(self, direct_annotators_only):
+        mask = ~self.removed
+        if direct_annotators_only:
+            mask &= self.direct
+        return self.object_counts[mask]
+
+    def mean_annotations_per_concept(self, direct_annotators_only = True):
+        counts = self._annotation_counts(direct_annotators_only)
+        return float(counts.sum()) / len(counts)
+
+    def stdev_annotations_per_concept(self, direct_annotators_only = True, ddof = 0):
+        """
+        :param direct_annotators_only:
+        :param ddof: denominator for stdev calculation is N - ddof. If you're interpretation is
+        that the collection of concepts is the entire population, ddof = 0.
+        :return:
+        """
+        counts = self._annotation_counts(direct_annotators_only)
+        m = self.mean_annotations_per_concept(direct_annotators_only)
+        return sqrt(((counts - m) ** 2).sum() / float(len(counts) - ddof))
+
+    def save(self, directory):
+        """
+        Stores the ontology as it was built (removed concepts and rollup promotions are not recorded) as one .npy
+        file per array in directory, so load can memory map it without parsing
+        """
+        if self.removed.any():
+            raise ValueError("Only an ontology that has not been rolled up can be saved")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        ids = np.frombuffer("\n".join(self.concept_ids).encode("utf-8"), dtype=np.uint8)
+        arrays = {'concept_ids': ids,
+                  'parent_offsets': self.parent_offsets,
+                  'parent_indices': self.parent_indices,
+                  'child_offsets': self.child_offsets,
+                  'child_indices': self.child_indices,
+                  'object_counts': self.object_counts,
+                  'is_direct_annotator': self.direct}
+        for name, a in arrays.items():
+            np.save(os.path.join(directory, name + '.npy'), a)
+        with open(os.path.join(directory, 'ontology.json'), 'w') as f:
+            json.dump({'total_annotated_objects': int(self._total_annotated_objects)}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        :param directory: directory written by save
+        :param mmap_mode: passed to numpy.load, the edge and count arrays are memory mapped by default. Arrays mutated
+               by a rollup are always copied into memory
+        :return: CompactOntology
+        """
+        def arr(name):
+            return np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, 'ontology.json'), 'r') as f:
+            meta = json.load(f)
+        ids = arr('concept_ids')
+        concept_ids = ids.tobytes().decode("utf-8").split("\n") if len(ids) else []
+        return cls(concept_ids, arr('parent_offsets'), arr('parent_indices'), arr('object_counts'),
+                   arr('is_direct_annotator'), meta['total_annotated_objects'],
+                   arr('child_offsets'), arr('child_indices'))
+
+    def add_annotations(self, delta, previous=None):
+        """
+        Adds annotations to an ontology that has not been rolled up, e.g. new objects appended to the annotation file
+        since the ontology was built. Only the annotated object counts of the annotating concepts and their ancestors
+        are updated; the result is the ontology built from the union of the original and delta annotations.
+        :param delta: rollup.utils.parsing.DirectAnnotations of the new annotations
+        :param previous: optional rollup.utils.parsing.DirectAnnotations of the annotations the ontology was built
+               from. It is only needed if delta annotates objects that were already annotated; without it every
+               object in delta is counted as a new object
+        :return: set of the concept ids whose annotated object count changed
+        """
+        if self.removed.any():
+            raise ValueError("Annotations can only be added to an ontology that has not been rolled up")
+        unknown = [cid for cid in delta.concept_ids if cid not in self.concept_index]
+        if unknown:
+            raise ValueError("Delta annotations use {0} concepts that are not in the ontology, e.g. {1}"
+                             .format(len(unknown), unknown[0]))
+        # (object, ancestor) pairs are encoded as object * n + ancestor, objects are indices into delta.object_ids
+        n = len(self.concept_ids)
+        new_pairs = self._object_concept_pairs(delta, np.arange(len(delta.object_ids), dtype=np.int64))
+        if previous is not None:
+            index = dict((o, i) for i, o in enumerate(delta.object_ids))
+            remap = np.array([index.get(o, -1) for o in previous.object_ids], dtype=np.int64)
+            old_pairs = self._object_concept_pairs(previous, remap)
+        else:
+            old_pairs = np.zeros(0, dtype=np.int64)
+        before = self._ancestor_pairs(old_pairs)
+        after = self._ancestor_pairs(np.concatenate([old_pairs, new_pairs]))
+        added = np.setdiff1d(after, before, assume_unique=True)
+
+        # counts may be memory mapped from a snapshot
+        self.object_counts = np.array(self.object_counts)
+        self.object_counts += np.bincount(added % n, minlength=n)
+        self._total_annotated_objects += len(np.setdiff1d(np.unique(after // n), np.unique(before // n),
+                                                          assume_unique=True))
+        for cid in delta.concept_ids:
+            self.direct[self.concept_index[cid]] = True
+        return set(self.concept_ids[i] for i in np.unique(added % n))
+
+    def _object_concept_pairs(self, annotations, remap):
+        """:return: unique encoded (object, concept) pairs of annotations, objects mapped with remap, -1 dropped"""
+        n = len(self.concept_ids)
+        pairs = []
+        for cid, indices in annotations:
+            objects = remap[indices]
+            objects = objects[objects >= 0]
+            if len(objects):
+                pairs.append(objects * n + self.concept_index[cid])
+        return np.unique(np.concatenate(pairs)) if pairs else np.zeros(0, dtype=np.int64)
+
+    def _ancestor_pairs(self, pairs):
+        """:return: unique encoded (object, ancestor) pairs for (object, concept) pairs, concepts are ancestors of
+                    themselves"""
+        n = len(self.concept_ids)
+        if not len(pairs):
+            return pairs
+        concepts, inverse = np.unique(pairs % n, return_inverse=True)
+        closures = [self._ancestors(c) for c in concepts]
+        lengths = np.array([len(a) for a in closures], dtype=np.int64)
+        starts = np.zeros(len(closures), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        flat = np.concatenate(closures)
+        # gather the closure of each pair's concept
+        counts = lengths[inverse]
+        first = np.repeat(starts[inverse], counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        objects = np.repeat(pairs // n, counts)
+        return np.unique(objects * n + flat[first + offsets])
+
+    def _ancestors(self, i):
+        """:return: int64 array of concept i and all of its ancestors"""
+        seen = {i}
+        stack = [i]
+        while stack:
+            for p in self._parents(stack.pop()):
+                if p not in seen:
+                    seen.add(int(p))
+                    stack.append(int(p))
+        return np.array(sorted(seen), dtype=np.int64)
+
+    def serialization_snapshot(self):
+        """
+        Returns a copy whose serialize_nodes method writes the ontology as it is now, unaffected by later changes
+        (e.g. by a rollup), so that checkpoint output can be written in the background. Only the arrays a rollup
+        mutates are copied, the concept ids and edges are shared
+        """
+        snapshot = copy.copy(self)
+        snapshot.removed = self.removed.copy()
+        snapshot.direct = self.direct.copy()
+        snapshot.child_counts = self.child_counts.copy()
+        snapshot._leaf_frontier = None
+        return snapshot
+
+    def serialize_nodes(self, file_path):
+        output.write_lines((output.key_values_line(node, self.parent_concepts(node)) for node in self.concepts()),
+                           file_path)
+
+
+def _transpose_csr(offsets, indices, n):
+    """
+    :return: (offsets, indices) of the transposed adjacency, e.g. children from parents. Entries within each row
+             keep the order of the rows they came from
+    """
+    rows = np.repeat(np.arange(n, dtype=np.int32), np.diff(offsets))
+    order = np.argsort(indices, kind='mergesort')
+    t_indices = rows[order]
+    t_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=n), out=t_offsets[1:])
+    return t_offsets, t_indices.astype(np.int32)
+
+
+def topological_order(offsets, indices, n):
+    """
+    :param offsets: CSR offsets of each concept's parents
+    :param indices: CSR parent indices
+    :param n: number of concepts
+    :return: int array of concept indices ordered so that every concept comes after all of its children
+    """
+    child_offsets, child_indices = _transpose_csr(offsets, indices, n)
+    remaining = np.diff(child_offsets)
+    order = list(np.flatnonzero(remaining == 0))
+    pos = 0
+    while pos < len(order):
+        i = order[pos]
+        pos += 1
+        for p in indices[offsets[i]:offsets[i + 1]]:
+            remaining[p] -= 1
+            if remaining[p] == 0:
+                order.append(p)
+    if len(order) != n:
+        raise ValueError("Ontology contains a cycle")
+    return np.array(order, dtype=np.int32)
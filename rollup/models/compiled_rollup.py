@@ -0,0 +1,124 @@
+__author__ = 'Aaron J Masino'
+
+import gzip
+import numpy as np
+from rollup.models import rollup
+
+# ways to handle concepts that are not in the rollup, see CompiledRollup.apply
+UNKNOWN_POLICIES = ('keep', 'drop', 'error')
+
+
+class CompiledRollup:
+    """
+    Rollup dictionary compiled to arrays for remapping large numbers of annotation rows at once.
+
+    Source concept ids are held in a sorted NumPy string array and the targets of source i are
+    target_ids[targets[offsets[i]:offsets[i+1]]], so a batch of concept ids is mapped with a single binary search
+    and gather rather than a dictionary lookup and list merge per row.
+
+    A rollup includes every concept that annotated an object in the data it was computed from (concepts that were
+    not rolled up map to themselves, see rollup.models.rollup.rollup), so a concept that is not in it was not part
+    of the ontology segment the rollup represents. apply keeps such concepts unchanged by default.
+    """
+    def __init__(self, rollups):
+        """
+        :param rollups: rollup dictionary {concept_id: list of concepts it is rolled to}, as returned by
+               rollup.models.rollup.rollup or read from a FILE_ROLLUP output with read_rollups
+        """
+        sources = list(rollups)
+        order = np.argsort(np.array(sources), kind='mergesort')
+        target_index = {}
+        target_ids = []
+        offsets = np.zeros(len(sources) + 1, dtype=np.int64)
+        targets = []
+        for n, i in enumerate(order):
+            for t in rollups[sources[i]]:
+                j = target_index.get(t)
+                if j is None:
+                    j = target_index[t] = len(target_ids)
+                    target_ids.append(t)
+                targets.append(j)
+            offsets[n + 1] = len(targets)
+        self.source_ids = np.array(sources)[order] if sources else np.zeros(0, dtype=str)
+        self.offsets = offsets
+        self.targets = np.array(targets, dtype=np.int32)
+        self.target_ids = np.array(target_ids) if target_ids else np.zeros(0, dtype=str)
+
+    @classmethod
+    def from_file(cls, file_path):
+        """:return: CompiledRollup of a FILE_ROLLUP output, which may be gzip compressed"""
+        return cls(read_rollups(file_path))
+
+    @classmethod
+    def from_arrays(cls, directory):
+        """:return: CompiledRollup of a DIR_ARRAYS output, see rollup.models.rollup.save_rollup_arrays"""
+        arrays = rollup.load_rollup_arrays(directory)
+        ids = arrays['concept_ids']
+        offsets = arrays['rollup_offsets']
+        indices = arrays['rollup_indices']
+        return cls(dict((ids[i], [ids[j] for j in indices[offsets[i]:offsets[i + 1]]])
+                        for i in range(len(offsets) - 1)))
+
+    def __len__(self):
+        return len(self.source_ids)
+
+    def __contains__(self, concept_id):
+        pos = int(np.searchsorted(self.source_ids, concept_id))
+        return pos < len(self.source_ids) and self.source_ids[pos] == concept_id
+
+    def apply(self, concept_ids, unknown='keep'):
+        """
+        Maps annotation rows to the concepts they are rolled to. A row whose concept is rolled to k concepts becomes
+        k rows, so other columns of the rows (e.g. visit ids) are aligned with the result by numpy.repeat(column,
+        repeats)
+        :param concept_ids: array of concept ids, one per annotation row
+        :param unknown: how rows whose concept is not in the rollup are handled: 'keep' maps the concept to itself,
+               'drop' removes the row (repeat count 0) and 'error' raises a KeyError
+        :return: (targets, repeats) - array of target concept ids for all rows in row order and int64 array of the
+                 number of targets of each row
+        """
+        if unknown not in UNKNOWN_POLICIES:
+            raise ValueError("Unknown policy for concepts not in the rollup: {0}".format(unknown))
+        concept_ids = np.asarray(concept_ids).astype(str)
+        if not len(self.source_ids):
+            # no concept is in an empty rollup, every row is handled by the unknown policy
+            if unknown == 'error' and len(concept_ids):
+                raise KeyError("Concept not in rollup: {0}".format(concept_ids[0]))
+            repeats = np.full(len(concept_ids), 1 if unknown == 'keep' else 0, dtype=np.int64)
+            return np.repeat(concept_ids, repeats), repeats
+        pos = np.searchsorted(self.source_ids, concept_ids)
+        found = pos < len(self.source_ids)
+        found[found] = self.source_ids[pos[found]] == concept_ids[found]
+        if unknown == 'error' and not found.all():
+            raise KeyError("Concept not in rollup: {0}".format(concept_ids[~found][0]))
+        pos[~found] = 0
+
+        starts = self.offsets[pos]
+        repeats = self.offsets[pos + 1] - starts
+        repeats[~found] = 1 if unknown == 'keep' else 0
+        # position of each output row within the targets of its input row
+        first = np.cumsum(repeats) - repeats
+        within = np.arange(repeats.sum()) - np.repeat(first, repeats)
+        rows = np.repeat(np.arange(len(concept_ids)), repeats)
+        targets = np.empty(len(rows), dtype=np.promote_types(self.target_ids.dtype, concept_ids.dtype))
+        known = found[rows]
+        targets[known] = self.target_ids[self.targets[starts[rows[known]] + within[known]]]
+        targets[~known] = concept_ids[rows[~known]]
+        return targets, repeats
+
+
+def read_rollups(file_path):
+    """
+    :param file_path: FILE_ROLLUP output (see rollup.models.rollup.serialize_rollups), gzip compressed if it ends
+           with .gz
+    :return: rollup dictionary {concept_id: list of concepts it is rolled to}
+    """
+    rollups = {}
+    with (gzip.open(file_path, 'rt', encoding='utf-8') if file_path.endswith('.gz') else open(file_path, 'r')) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            data = line.split(":")
+            rollups[data[0]] = data[1].split(",") if len(data) > 1 else []
+    return rollups
@@ -0,0 +1,251 @@
+__author__ = 'Aaron J Masino'
+
+import contextlib
+import io
+import numpy as np
+from collections import namedtuple
+from functools import partial
+
+from rollup.models import closure
+from rollup.models import ontology
+from rollup.models import overlay
+from rollup.models import rollup
+from rollup.models.scoring import PSI_TOLERANCE
+
+# the sequence of iterations of a rollup and its result. leaves are the concept ids rolled at each iteration,
+# trajectories is the dictionary filled by rollup.rollup (lambdas and psis start with the initial value), rollups
+# and rollup_levels are as returned by rollup.rollup
+RollupTrace = namedtuple('RollupTrace', ['leaves', 'trajectories', 'rollups', 'rollup_levels'])
+
+# first difference between an engine's trace and the reference trace. iteration is 0 for the initial state and for
+# differences in the final rollups, field names what differs and kind is 'tie' for a leaf mismatch between two
+# leaves whose Psi agree to within PSI_TOLERANCE (the engine broke a tie differently), otherwise 'value'
+Divergence = namedtuple('Divergence', ['iteration', 'field', 'expected', 'actual', 'kind'])
+
+# how a trace is compared with the reference:
+#   rtol, atol - Lambda and Psi a and b agree if |a - b| <= atol + rtol * |b|. Engines may sum IC values in a
+#                different order, so floats are never compared exactly
+#   compare_levels - False for engines documented to compute rollup_levels differently (see rollup.rollup closure)
+# engines that make other greedy choices by design (batch_size > 1) are not checked here, see rollup.psi_divergence
+ComparisonRules = namedtuple('ComparisonRules', ['rtol', 'atol', 'compare_levels'])
+
+EXACT_RULES = ComparisonRules(rtol=1e-9, atol=PSI_TOLERANCE, compare_levels=True)
+
+# registered engines, {name: (engine, ComparisonRules)}. An engine is a callable
+# engine(ontology_filename, annotations_filename, desired_annotators, max_iters) returning a RollupTrace
+ENGINES = {}
+
+
+def register_engine(name, engine, rules=EXACT_RULES):
+    """
+    Registers a rollup engine to be validated against the reference implementation (see check_engines).
+
+    Equivalence rules, which every engine registered with EXACT_RULES must satisfy:
+      - at each iteration the leaf rolled is the one with the minimum Psi after rolling it; leaves whose Psi are
+        within PSI_TOLERANCE of the minimum are tied, and a tie goes to the leaf that comes first in the concept
+        order of the ontology file (the order of Ontotology.concepts(), which every backend shares)
+      - D after each iteration is equal, Lambda and Psi agree to within the rules' tolerances
+      - the final rollups map each concept to the same set of concepts (order within a list does not matter)
+        and rollup_levels are equal
+    :param name: name reported for the engine
+    :param engine: callable, see ENGINES
+    :param rules: ComparisonRules
+    """
+    ENGINES[name] = (engine, rules)
+
+
+def trace_rollup(ont, desired_annotators, max_iters, **rollup_args):
+    """
+    Runs rollup.rollup on ont without printing and records its iterations
+    :param rollup_args: further keyword arguments of rollup.rollup
+    :return: RollupTrace
+    """
+    concepts = ont.concepts()
+    trajectories = {}
+    # rollup only needs append from an iteration log, a list records the sequence of rolled leaves
+    records = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        rollups, rollup_levels, _, _ = rollup.rollup(ont, desired_annotators, max_iters, print_freq=10 ** 9,
+                                                     iteration_log=records, trajectories=trajectories,
+                                                     **rollup_args)
+    return RollupTrace([concepts[r.leaf] for r in records], trajectories, rollups, rollup_levels)
+
+
+def reference_engine(ontology_filename, annotations_filename, desired_annotators, max_iters):
+    """
+    The oracle: a frozen copy of the original greedy loop of rollup.rollup, run on a networkx ontology with object id
+    lists. Each iteration rescans leaf_nodes and, for every leaf, recomputes the stdev of the IC of all direct
+    annotators from scratch, so it shares no running sums, candidate tables or leaf frontier with the engines it
+    validates. The only change to the original loop is the tie rule the engines follow: of the leaves whose Psi is
+    within PSI_TOLERANCE of the minimum, the first in concept order is rolled (leaf_nodes lists leaves in that order)
+    :return: RollupTrace
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        ont = ontology.OntologyFactory().build_ontology_from_files(ontology_filename, annotations_filename)
+    graph = ont.graph
+    N = ont.total_annotated_objects()
+    D = ont.total_annotators()
+    annotator_ICs = ont.annotators_information_content(N)
+    Gamma = np.sum([x for x in annotator_ICs.values()])
+    Lambda = Gamma / float(D)
+    Psi = _ic_stdev(annotator_ICs.values(), Lambda, D)
+
+    trajectories = {'lambdas': [Lambda], 'psis': [Psi], 'gammas': [Gamma], 'leaf_counts': [],
+                    'annotator_counts': []}
+    leaves_rolled = []
+    rollups = {}
+    rollup_levels = {}
+    iterations = 0
+    while D > desired_annotators and iterations < max_iters:
+        iterations += 1
+        leaves = ont.leaf_nodes()
+        # (Psi, Gamma, D) of rolling each leaf, in leaf order
+        scores = []
+        for leaf in leaves:
+            tmp_Gamma = Gamma
+            parents = ont.parent_concepts(leaf)
+            leaf_ic = ont.information_content(leaf, N)
+            added = []
+            for p in parents:
+                if not graph.node[p][ont.is_direct_annotator_key]:
+                    pic = ont.information_content(p, N)
+                    annotator_ICs[p] = pic
+                    tmp_Gamma += pic
+                    added.append(p)
+            del annotator_ICs[leaf]
+            tmp_Gamma -= leaf_ic
+            tmp_D = len(annotator_ICs)
+            tmp_Lambda = tmp_Gamma / float(tmp_D)
+            scores.append((_ic_stdev(annotator_ICs.values(), tmp_Lambda, tmp_D), tmp_Gamma, tmp_D))
+            annotator_ICs[leaf] = leaf_ic
+            for p in added:
+                del annotator_ICs[p]
+        if not scores:
+            break
+        best_Psi = min([psi for psi, _, _ in scores])
+        i = [psi <= best_Psi + PSI_TOLERANCE for psi, _, _ in scores].index(True)
+        leaf_to_roll = leaves[i]
+        Psi, Gamma, D = scores[i]
+
+        leaf_parents = ont.parent_concepts(leaf_to_roll)
+        for p in leaf_parents:
+            if not graph.node[p][ont.is_direct_annotator_key]:
+                graph.node[p][ont.is_direct_annotator_key] = True
+                annotator_ICs[p] = ont.information_content(p, N)
+        graph.remove_node(leaf_to_roll)
+        del annotator_ICs[leaf_to_roll]
+
+        Lambda = Gamma / float(D)
+        leaves_rolled.append(leaf_to_roll)
+        trajectories['lambdas'].append(Lambda)
+        trajectories['psis'].append(Psi)
+        trajectories['gammas'].append(Gamma)
+        trajectories['leaf_counts'].append(len(leaves))
+        trajectories['annotator_counts'].append(D)
+
+        prev_corrected_levels = []
+        for k, obj_list in rollups.items():
+            if leaf_to_roll in obj_list:
+                if k not in prev_corrected_levels:
+                    rollup_levels[k] += 1
+                    prev_corrected_levels.append(k)
+                obj_list.remove(leaf_to_roll)
+                for p in leaf_parents:
+                    if p not in obj_list:
+                        obj_list.append(p)
+        rollups[leaf_to_roll] = leaf_parents
+        rollup_levels[leaf_to_roll] = 1
+
+    for a in ont.annotators():
+        if a not in rollups:
+            rollups[a] = [a]
+            rollup_levels[a] = 0
+    return RollupTrace(leaves_rolled, trajectories, rollups, rollup_levels)
+
+
+def _ic_stdev(ic_vals, mean_ic, total_annotators):
+    return np.sqrt(np.sum([(x - mean_ic) ** 2 for x in ic_vals]) / float(total_annotators))
+
+
+def _rollup_engine(ontology_filename, annotations_filename, desired_annotators, max_iters, backend='compact',
+                   closure_levels=False, use_overlay=False, **rollup_args):
+    """engine running rollup.rollup on the given backend, or an overlay of it, with further rollup arguments"""
+    factory = ontology.OntologyFactory()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if backend == 'compact':
+            ont = factory.build_compact_ontology_from_files(ontology_filename, annotations_filename)
+        else:
+            ont = factory.build_ontology_from_files(ontology_filename, annotations_filename, object_sets=backend,
+                                                    count_only=True)
+    if use_overlay:
+        ont = overlay.OntologyOverlay(ont)
+    if closure_levels:
+        rollup_args['closure'] = closure.ClosureIndex.from_ontology(ont)
+    return trace_rollup(ont, desired_annotators, max_iters, **rollup_args)
+
+
+def _close(a, b, rules):
+    return abs(a - b) <= rules.atol + rules.rtol * abs(b)
+
+
+def first_divergence(reference, trace, rules=EXACT_RULES):
+    """
+    Compares a trace with the reference trace of the same inputs step by step: the initial Lambda and Psi, then
+    the leaf, D, Lambda and Psi of each iteration, the number of iterations and finally rollups and rollup_levels
+    :param reference: RollupTrace of the reference implementation
+    :param trace: RollupTrace of the engine
+    :param rules: ComparisonRules
+    :return: the first Divergence, or None if the traces are equivalent
+    """
+    ref_t = reference.trajectories
+    t = trace.trajectories
+    for name in ('lambdas', 'psis'):
+        if not _close(t[name][0], ref_t[name][0], rules):
+            return Divergence(0, name[:-1], ref_t[name][0], t[name][0], 'value')
+    for i, (ref_leaf, leaf) in enumerate(zip(reference.leaves, trace.leaves)):
+        if ref_leaf != leaf:
+            kind = 'tie' if abs(t['psis'][i + 1] - ref_t['psis'][i + 1]) <= PSI_TOLERANCE else 'value'
+            return Divergence(i + 1, 'leaf', ref_leaf, leaf, kind)
+        if ref_t['annotator_counts'][i] != t['annotator_counts'][i]:
+            return Divergence(i + 1, 'annotator_count', ref_t['annotator_counts'][i], t['annotator_counts'][i],
+                              'value')
+        for name in ('lambdas', 'psis'):
+            if not _close(t[name][i + 1], ref_t[name][i + 1], rules):
+                return Divergence(i + 1, name[:-1], ref_t[name][i + 1], t[name][i + 1], 'value')
+    if len(reference.leaves) != len(trace.leaves):
+        i = min(len(reference.leaves), len(trace.leaves))
+        return Divergence(i + 1, 'iterations', len(reference.leaves), len(trace.leaves), 'value')
+
+    for k in sorted(set(reference.rollups) | set(trace.rollups)):
+        expected = sorted(reference.rollups.get(k, []))
+        actual = sorted(trace.rollups.get(k, []))
+        if expected != actual:
+            return Divergence(0, 'rollups[{0}]'.format(k), expected, actual, 'value')
+    if rules.compare_levels:
+        for k in sorted(reference.rollup_levels):
+            if reference.rollup_levels[k] != trace.rollup_levels.get(k):
+                return Divergence(0, 'rollup_levels[{0}]'.format(k), reference.rollup_levels[k],
+                                  trace.rollup_levels.get(k), 'value')
+    return None
+
+
+def check_engines(ontology_filename, annotations_filename, desired_annotators, max_iters=50000, engines=None):
+    """
+    Runs the reference implementation and the registered engines on the same inputs
+    :param engines: names of the registered engines to check, all if None
+    :return: dictionary {engine name: first Divergence from the reference, or None}
+    """
+    reference = reference_engine(ontology_filename, annotations_filename, desired_annotators, max_iters)
+    results = {}
+    for name in (engines if engines is not None else sorted(ENGINES)):
+        engine, rules = ENGINES[name]
+        trace = engine(ontology_filename, annotations_filename, desired_annotators, max_iters)
+        results[name] = first_divergence(reference, trace, rules)
+    return results
+
+
+register_engine('compact', _rollup_engine)
+register_engine('networkx_bitmap', partial(_rollup_engine, backend='bitmap'))
+register_engine('overlay', partial(_rollup_engine, use_overlay=True))
+register_engine('closure_levels', partial(_rollup_engine, closure_levels=True),
+                EXACT_RULES._replace(compare_levels=False))
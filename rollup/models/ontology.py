@@ -1,22 +1,76 @@
 __author__ = 'Aaron J Masino'
 
+import hashlib
+import json
 import networkx as nx
+import numpy as np
+import os
+import shutil
+import tempfile
+from functools import partial
+from rollup.models import compact
 from rollup.utils import collections
+from rollup.utils import output
+from rollup.utils import parsing
+from rollup.utils.bitmap import ObjectBitmap
+from rollup.utils.sketch import DEFAULT_SKETCH_ERROR, HyperLogLog, precision_for_error
 from math import log, sqrt
 
+ANNOTATED_OBJECT_COUNT_KEY = 'annotated_object_count'
+# version of the binary ontology snapshot layout written by OntologyFactory.load_or_build_compact_ontology
+SNAPSHOT_FORMAT = 1
+
+
 class Ontotology:
     """Ontology class for ontology represented as a DAG with only IS_A relationships"""
     def __init__(self, netx_concept_graph,
                  annotated_objects_key = 'object_list',
-                 is_direct_annotator_key = 'is_direct_annotator'):
+                 is_direct_annotator_key = 'is_direct_annotator',
+                 annotated_object_count_key = ANNOTATED_OBJECT_COUNT_KEY,
+                 total_annotated_objects = None):
+        """
+        :param annotated_object_count_key: key associated with node attribute that contains the number of objects
+               annotated by the node. Count only ontologies store this instead of the annotated objects
+        :param total_annotated_objects: number of unique objects annotated by at least one concept, required for count
+               only ontologies since it can not be derived from the counts
+        """
         self.graph = netx_concept_graph
         self.annotated_objects_key = annotated_objects_key
         self.is_direct_annotator_key = is_direct_annotator_key
+        self.annotated_object_count_key = annotated_object_count_key
+        self._total_annotated_objects = total_annotated_objects
+        self._leaf_frontier = None
+        self._closure = None
+
+    def concepts(self):
+        """Returns all concept ids in the ontology in a stable order (the order concepts were added to the graph)"""
+        return list(self.graph.nodes())
 
     def leaf_nodes(self):
         """Returns all nodes that have at least 1 parent concept and no child concepts"""
         return [n for n in self.graph.nodes() if self.graph.out_degree(n) != 0 and self.graph.in_degree(n) == 0]
 
+    def leaf_frontier(self):
+        """Returns the set of current leaf nodes. The set is built by a single scan of the graph on first use and is
+        then maintained by remove_concept, so it must not be used after nodes are removed from the graph directly"""
+        if self._leaf_frontier is None:
+            self._leaf_frontier = set(self.leaf_nodes())
+        return self._leaf_frontier
+
+    def remove_concept(self, concept_id):
+        """
+        Removes a leaf concept from the ontology, updating the leaf frontier if one has been built
+        :param concept_id: id of a leaf concept
+        :return: list of the concept's parents that became leaves because concept_id was their last child
+        """
+        parents = self.parent_concepts(concept_id)
+        self.graph.remove_node(concept_id)
+        exposed = [p for p in parents if self.graph.in_degree(p) == 0 and self.graph.out_degree(p) != 0]
+        if self._leaf_frontier is not None:
+            self._leaf_frontier.discard(concept_id)
+            self._leaf_frontier.update(exposed)
+        return exposed
+
     def root_nodes(self):
         """Returns all nodes that have no parent concepts as a list."""
         return [n for n in self.graph.nodes() if self.graph.out_degree(n) == 0]
@@ -26,6 +80,8 @@ class Ontotology:
         either directly or indirectly through true path rule inheritance
 
         returns: total number of unique object annotated by at least one concept"""
+        if self._total_annotated_objects is not None:
+            return self._total_annotated_objects
         l = []
         for rid in self.root_nodes():
             rn = self.graph.node[rid]
@@ -57,15 +113,45 @@ class Ontotology:
 
     def descendant_concepts(self, concept_id):
         """wrapper method to avoid confusion due to design of is_a relationship which
-        runs in opposite direction from ancestor relation direction used in networkX"""
+        runs in opposite direction from ancestor relation direction used in networkX. Answered from the closure
+        index if one is set"""
+        if self._closure is not None:
+            return set(c for c in self._closure.descendants(concept_id) if self.graph.has_node(c))
         return nx.ancestors(self.graph, concept_id)
 
+    def set_closure_index(self, closure_index):
+        """
+        :param closure_index: rollup.models.closure.ClosureIndex of this ontology (or of it before leaves were
+               removed), used to answer descendant queries without traversing the graph
+        """
+        self._closure = closure_index
+
     def parent_concepts(self, concept_id):
         """wrapper method to avoid confusion due to design of is_a relationship which
         runs in opposite direction from ancestor relation direction used in networkX"""
         parent_nodes = self.graph[concept_id]
         return list(parent_nodes.keys())
 
+    def child_concepts(self, concept_id):
+        """wrapper method to avoid confusion due to design of is_a relationship which
+        runs in opposite direction from ancestor relation direction used in networkX"""
+        return list(self.graph.predecessors(concept_id))
+
+    def is_direct_annotator(self, concept_id):
+        """returns True if the concept directly annotates an object"""
+        return self.graph.node[concept_id][self.is_direct_annotator_key]
+
+    def set_direct_annotator(self, concept_id, is_direct_annotator=True):
+        """marks the concept as (not) directly annotating an object, e.g. when descendants are rolled up into it"""
+        self.graph.node[concept_id][self.is_direct_annotator_key] = is_direct_annotator
+
+    def annotated_object_count(self, concept_id):
+        """returns: number of unique objects annotated by the concept directly or through its descendants"""
+        n = self.graph.node[concept_id]
+        if self.annotated_object_count_key in n:
+            return n[self.annotated_object_count_key]
+        return len(n[self.annotated_objects_key])
+
     def information_content(self, concept_id, N):
         """
 
@@ -75,7 +161,7 @@ class Ontotology:
                by the node either directly or indirectly through true path rule inheritance
         :return: information content for the concept
         """
-        n = len(self.graph.node[concept_id][self.annotated_objects_key])
+        n = self.annotated_object_count(concept_id)
         if n == 0:
             # this node and its descendants do does not annotate anything
             return float("inf")
@@ -121,11 +207,11 @@ class Ontotology:
         if direct_annotators_only:
             for cid in self.annotators():
                 d += 1
-                s += len(self.graph.node[cid][self.annotated_objects_key])
+                s += self.annotated_object_count(cid)
         else:
             for cid in self.graph.nodes():
                 d += 1
-                s += len(self.graph.node[cid][self.annotated_objects_key])
+                s += self.annotated_object_count(cid)
         return s / float(d)
 
     def stdev_annotations_per_concept(self, direct_annotators_only = True, ddof = 0):
@@ -142,29 +228,34 @@ class Ontotology:
         if direct_annotators_only:
             for cid in self.annotators():
                 d += 1
-                s += (len(self.graph.node[cid][self.annotated_objects_key])-m)**2
+                s += (self.annotated_object_count(cid)-m)**2
         else:
             for cid in self.graph.nodes():
                 d += 1
-                s += (len(self.graph.node[cid][self.annotated_objects_key])-m)**2
+                s += (self.annotated_object_count(cid)-m)**2
         return sqrt(s / float(d-ddof))
 
     def serialize_nodes(self, file_path):
-        first_line = True
-        with open(file_path, 'a+') as f:
-            for node in self.graph.nodes():
-                parents = self.parent_concepts(node)
-                line = "{0}".format(node)
-                if parents:
-                    line = "{0}:{1}".format(line, parents[0])
-                if len(parents) > 1:
-                    for p in parents[1:]:
-                        line = "{0},{1}".format(line, p)
-                if first_line:
-                    first_line = False
-                else:
-                    line = "\n{0}".format(line)
-                f.write(line)
+        _serialize_node_parents([(node, self.parent_concepts(node)) for node in self.graph.nodes()], file_path)
+
+    def serialization_snapshot(self):
+        """
+        Returns an object whose serialize_nodes method writes the ontology as it is now, unaffected by later changes
+        (e.g. by a rollup), so that checkpoint output can be written in the background
+        """
+        return _NodeParentsSnapshot([(node, self.parent_concepts(node)) for node in self.graph.nodes()])
+
+
+class _NodeParentsSnapshot:
+    def __init__(self, node_parents):
+        self.node_parents = node_parents
+
+    def serialize_nodes(self, file_path):
+        _serialize_node_parents(self.node_parents, file_path)
+
+
+def _serialize_node_parents(node_parents, file_path):
+    output.write_lines((output.key_values_line(node, parents) for node, parents in node_parents), file_path)
 
 
 class OntologyFactory:
@@ -178,73 +269,311 @@ class OntologyFactory:
     def build_ontology_from_files(self, ontology_filename,
                                   annotations_filename,
                                   annotated_objects_key='object_list',
-                                  is_direct_annotator_key='is_direct_annotator'
+                                  is_direct_annotator_key='is_direct_annotator',
+                                  object_sets='list',
+                                  count_only=False,
+                                  parse_processes=1,
+                                  direct_annotations=None,
+                                  sketch_error=None
                                   ):
+        """
+        :param object_sets: 'list' to store the annotated objects of each concept as a list of object ids, or
+               'bitmap' to intern object ids to integer indices and store them as rollup.utils.bitmap.ObjectBitmap,
+               which takes far less memory and merges with word-wise ORs during propagation, or 'sketch' to store
+               a rollup.utils.sketch.HyperLogLog per concept, which estimates the number of annotated objects in
+               fixed memory. Sketches only hold counts, so 'sketch' implies count_only
+        :param count_only: if True the annotated object sets are released after propagation and only the number of
+               objects annotated by each concept (and by the ontology as a whole) is kept, which is all information
+               content requires
+        :param parse_processes: number of processes used to parse the annotation file, see
+               rollup.utils.parsing.iter_annotations
+        :param direct_annotations: optional rollup.utils.parsing.DirectAnnotations already read from
+               annotations_filename, used instead of parsing the file again
+        :param sketch_error: with object_sets 'sketch', the relative standard error of the estimated counts,
+               rollup.utils.sketch.DEFAULT_SKETCH_ERROR if None
+        :return: Ontotology
+        """
+        if object_sets == 'bitmap':
+            make_set = ObjectBitmap.from_indices
+        elif object_sets == 'sketch':
+            precision = precision_for_error(sketch_error or DEFAULT_SKETCH_ERROR)
+            make_set = partial(HyperLogLog.from_indices, precision=precision)
+            count_only = True
+        elif object_sets == 'list':
+            make_set = set
+        else:
+            raise ValueError("Unknown object_sets: {0}".format(object_sets))
+
         graph = nx.DiGraph()
         edge_dict = {}
 
         # read in ontology file and add nodes and edges
         print("Adding nodes to ontology ...")
-        with open(ontology_filename, 'r') as f:
-            for line in f.readlines():
-                data = line.split(":")
-                cid = data[0].strip()
-                if len(data)>1:
-                    edge_dict[cid] = [x.strip() for x in data[1].split(",")]
-                graph.add_node(cid)
-                n = graph.node[cid]
-                n[annotated_objects_key] = []
-                n[is_direct_annotator_key] = False
-                n[self.children_key] = []
-                n[self.complete_object_list_key] = False
+        for cid, parents in _read_concept_lines(ontology_filename):
+            if parents is not None:
+                edge_dict[cid] = parents
+            graph.add_node(cid)
+            n = graph.node[cid]
+            n[annotated_objects_key] = []
+            n[is_direct_annotator_key] = False
+            n[self.children_key] = []
+            n[self.complete_object_list_key] = False
 
         print("Adding IS_A concept relations ...")
         for child, parent_list in edge_dict.items():
             for parent in parent_list:
+                # a parent named twice on a line is a single edge, propagation counts children once per edge
+                if graph.has_edge(child, parent):
+                    continue
                 graph.add_edge(child, parent, relation="IS_A")
                 graph.node[parent][self.children_key].append(child)
 
         # read in annotation files and update annotated object list and is object annotator attributes
         print("Building concept annotation lists ...")
-        with open(annotations_filename, 'r') as f:
-            for line in f.readlines():
-                data = line.split(":")
-                cid = data[0].strip()
-                if len(data)>1:
-                    objects = [x.strip() for x in data[1].split(",")]
-                    n = graph.node[cid]
-                    n[annotated_objects_key] = objects
-                    n[is_direct_annotator_key] = True
-
-        # update all non-leaves with annotated objects inherited from descendants
-        ## set leaf nodes as completed
-        for node in graph.node():
-            if graph.out_degree(n) != 0 and graph.in_degree(n) == 0:
-                node[self.complete_object_list_key] = True
-
-        ## update the non-leaf nodes
-        # for computational efficiency this needs to start at the leaves and work up through ancestors of each leaf
-        # adding the leaf visits to the ancestors
-        nodes_to_update = []
-        for n in graph.nodes():
-            if not graph.node[n][self.complete_object_list_key]:
-                nodes_to_update.append(n)
-        nodes_to_update = set(nodes_to_update)
-        while nodes_to_update:
-            for p in nodes_to_update:
-                update_p = True
-                pn = graph.node[p]
-                p_children = pn[self.children_key]
-                for c in p_children:
-                    update_p = update_p and graph.node[c][self.complete_object_list_key]
-                if update_p:
-                    obj_list = pn[annotated_objects_key]
-                    for c in p_children:
-                        c_obj_list = graph.node[c][annotated_objects_key]
-                        obj_list = collections.merge_lists(obj_list, c_obj_list)
-                    pn[annotated_objects_key] = obj_list
-                    pn[self.complete_object_list_key] = True
-                    nodes_to_update.remove(p)
-                    break
-
-        return Ontotology(graph)
+        if direct_annotations is None:
+            interner = parsing.Interner()
+            annotations = parsing.iter_annotations(annotations_filename, interner, processes=parse_processes)
+            object_ids = interner.ids
+        else:
+            annotations = direct_annotations
+            object_ids = direct_annotations.object_ids
+        for cid, indices in annotations:
+            n = graph.node[cid]
+            n[annotated_objects_key] = indices if object_sets != 'list' else [object_ids[i] for i in indices]
+            n[is_direct_annotator_key] = True
+        del annotations, object_ids
+
+        # update all concepts with the annotated objects inherited from descendants (true path rule). IS_A edges
+        # run from child to parent, so a topological order reaches each concept after all of its children and every
+        # object set is built exactly once. A child's set is released once all of its parents have consumed it.
+        print("Propagating annotations to ancestors ...")
+        pending_sets = {}
+        pending_parents = {}
+        annotated = make_set([])
+        for cid in nx.topological_sort(graph):
+            n = graph.node[cid]
+            objects = make_set(n[annotated_objects_key])
+            for c in n[self.children_key]:
+                objects |= pending_sets[c]
+                pending_parents[c] -= 1
+                if pending_parents[c] == 0:
+                    del pending_sets[c]
+            if count_only:
+                n[ANNOTATED_OBJECT_COUNT_KEY] = len(objects)
+                del n[annotated_objects_key]
+            else:
+                n[annotated_objects_key] = objects if object_sets == 'bitmap' else list(objects)
+            n[self.complete_object_list_key] = True
+            parent_count = graph.out_degree(cid)
+            if parent_count:
+                pending_sets[cid] = objects
+                pending_parents[cid] = parent_count
+            elif count_only:
+                annotated |= objects
+
+        if count_only:
+            return Ontotology(graph, annotated_objects_key, is_direct_annotator_key,
+                              total_annotated_objects=len(annotated))
+        return Ontotology(graph, annotated_objects_key, is_direct_annotator_key)
+
+    def build_compact_ontology_from_files(self, ontology_filename, annotations_filename, parse_processes=1,
+                                          direct_annotations=None, sketch_error=None):
+        """
+        Builds a rollup.models.compact.CompactOntology from the same input files as build_ontology_from_files.
+        Concepts are interned in the same order the networkx graph would add them, so both representations
+        enumerate concepts identically.
+        :param parse_processes: number of processes used to parse the annotation file
+        :param direct_annotations: optional rollup.utils.parsing.DirectAnnotations already read from
+               annotations_filename, used instead of parsing the file again
+        :param sketch_error: if given, the annotated objects of each concept are propagated as
+               rollup.utils.sketch.HyperLogLog sketches with this relative standard error instead of exact bitmaps,
+               and annotated object counts and the total number of annotated objects are estimates
+        """
+        if sketch_error is None:
+            make_set = ObjectBitmap.from_indices
+        else:
+            make_set = partial(HyperLogLog.from_indices, precision=precision_for_error(sketch_error))
+        concept_ids = []
+        concept_index = {}
+        edge_dict = {}
+
+        def intern(cid):
+            i = concept_index.get(cid)
+            if i is None:
+                i = concept_index[cid] = len(concept_ids)
+                concept_ids.append(cid)
+            return i
+
+        print("Adding nodes to ontology ...")
+        for cid, parents in _read_concept_lines(ontology_filename):
+            if parents is not None:
+                edge_dict[cid] = parents
+            intern(cid)
+
+        print("Adding IS_A concept relations ...")
+        parent_lists = {}
+        for child, parent_list in edge_dict.items():
+            pl = parent_lists.setdefault(concept_index[child], [])
+            for parent in parent_list:
+                p = intern(parent)
+                if p not in pl:
+                    pl.append(p)
+        n = len(concept_ids)
+        parent_offsets = np.zeros(n + 1, dtype=np.int64)
+        for i, pl in parent_lists.items():
+            parent_offsets[i + 1] = len(pl)
+        np.cumsum(parent_offsets, out=parent_offsets)
+        parent_indices = np.zeros(parent_offsets[-1], dtype=np.int32)
+        for i, pl in parent_lists.items():
+            parent_indices[parent_offsets[i]:parent_offsets[i + 1]] = pl
+        del parent_lists, edge_dict
+
+        # object ids are interned to ints so the object sets built during propagation are compact bitmaps
+        print("Building concept annotation lists ...")
+        direct_objects = {}
+        is_direct_annotator = np.zeros(n, dtype=bool)
+        if direct_annotations is None:
+            direct_annotations = parsing.iter_annotations(annotations_filename, processes=parse_processes)
+        for cid, indices in direct_annotations:
+            i = concept_index[cid]
+            direct_objects[i] = make_set(indices)
+            is_direct_annotator[i] = True
+
+        print("Propagating annotations to ancestors ...")
+        child_offsets, child_indices = compact._transpose_csr(parent_offsets, parent_indices, n)
+        object_counts = np.zeros(n, dtype=np.int64)
+        pending_sets = {}
+        pending_parents = np.diff(parent_offsets)
+        annotated = make_set([])
+        for i in compact.topological_order(parent_offsets, parent_indices, n):
+            objects = direct_objects.pop(i, None)
+            if objects is None:
+                objects = make_set([])
+            for c in child_indices[child_offsets[i]:child_offsets[i + 1]]:
+                objects |= pending_sets[c]
+                pending_parents[c] -= 1
+                if pending_parents[c] == 0:
+                    del pending_sets[c]
+            object_counts[i] = len(objects)
+            if pending_parents[i]:
+                pending_sets[i] = objects
+            else:
+                annotated |= objects
+
+        return compact.CompactOntology(concept_ids, parent_offsets, parent_indices, object_counts,
+                                       is_direct_annotator, len(annotated))
+
+    def load_or_build_compact_ontology(self, ontology_filename, annotations_filename, cache_dir,
+                                       force_rebuild=False, parse_processes=1, direct_annotations=None):
+        """
+        Returns the CompactOntology for the input files from a binary snapshot in cache_dir, building it with
+        build_compact_ontology_from_files and storing the snapshot if there is no snapshot for the current inputs.
+
+        A snapshot is current when each input file has the size and content hash recorded when it was built. The
+        hash is only recomputed when a file's modification time has changed, so loading a current snapshot does not
+        read the inputs.
+        :param cache_dir: directory holding snapshots, one sub directory per pair of input file paths
+        :param force_rebuild: if True always build the ontology from the input files and replace the snapshot
+        :param parse_processes: number of processes used to parse the annotation file when building
+        :param direct_annotations: optional rollup.utils.parsing.DirectAnnotations used when building
+        :return: CompactOntology
+        """
+        inputs = [os.path.abspath(ontology_filename), os.path.abspath(annotations_filename)]
+        key = hashlib.sha1("\n".join(inputs).encode("utf-8")).hexdigest()[:16]
+        snapshot_dir = os.path.join(cache_dir, "ontology-{0}".format(key))
+        manifest_path = os.path.join(snapshot_dir, "manifest.json")
+        if not force_rebuild and _snapshot_is_current(manifest_path, inputs):
+            print("Loading ontology snapshot from {0}".format(snapshot_dir))
+            return compact.CompactOntology.load(snapshot_dir)
+
+        # fingerprint before building so inputs modified during the build invalidate the snapshot
+        fingerprints = [_file_fingerprint(path) for path in inputs]
+        ont = self.build_compact_ontology_from_files(ontology_filename, annotations_filename, parse_processes,
+                                                     direct_annotations)
+        print("Storing ontology snapshot in {0}".format(snapshot_dir))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write to a temporary directory first so an interrupted write never leaves a snapshot that looks current
+        tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+        ont.save(tmp_dir)
+        with open(os.path.join(tmp_dir, "manifest.json"), 'w') as f:
+            json.dump({'format': SNAPSHOT_FORMAT, 'inputs': fingerprints}, f, indent=1)
+        if os.path.isdir(snapshot_dir):
+            shutil.rmtree(snapshot_dir)
+        os.rename(tmp_dir, snapshot_dir)
+        return ont
+
+    def warm_start_compact_ontology(self, snapshot_dir, delta_filename, previous_annotations_filename=None,
+                                    parse_processes=1):
+        """
+        Loads the CompactOntology of an earlier run from a snapshot (see CompactOntology.save and
+        load_or_build_compact_ontology) and adds the annotations in a delta annotation file, updating only the
+        counts of the annotating concepts and their ancestors
+        :param snapshot_dir: directory of the snapshot of the ontology before the delta annotations
+        :param delta_filename: annotation file with the new annotations
+        :param previous_annotations_filename: optional annotation file the snapshot was built from, needed if the
+               delta annotates objects that were already annotated (see CompactOntology.add_annotations)
+        :param parse_processes: number of processes used to parse the annotation files
+        :return: CompactOntology
+        """
+        print("Loading ontology snapshot from {0}".format(snapshot_dir))
+        ont = compact.CompactOntology.load(snapshot_dir)
+        print("Adding delta annotations from {0}".format(delta_filename))
+        delta = parsing.DirectAnnotations.from_file(delta_filename, processes=parse_processes)
+        previous = None
+        if previous_annotations_filename is not None:
+            previous = parsing.DirectAnnotations.from_file(previous_annotations_filename, processes=parse_processes)
+        changed = ont.add_annotations(delta, previous)
+        print("Annotated object counts changed for {0} concepts".format(len(changed)))
+        return ont
+
+
+def _file_fingerprint(path):
+    st = os.stat(path)
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return {'path': path, 'size': st.st_size, 'mtime': st.st_mtime, 'sha1': sha1.hexdigest()}
+
+
+def _snapshot_is_current(manifest_path, inputs):
+    if not os.path.isfile(manifest_path):
+        return False
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != SNAPSHOT_FORMAT or [fp['path'] for fp in manifest['inputs']] != inputs:
+        return False
+    touched = False
+    for fp in manifest['inputs']:
+        if not os.path.isfile(fp['path']):
+            return False
+        st = os.stat(fp['path'])
+        if st.st_size != fp['size']:
+            return False
+        if st.st_mtime != fp['mtime']:
+            current = _file_fingerprint(fp['path'])
+            if current['sha1'] != fp['sha1']:
+                return False
+            fp['mtime'] = current['mtime']
+            touched = True
+    if touched:
+        # contents are unchanged, record the new modification times so the next load skips hashing
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+    return True
+
+
+def _read_concept_lines(filename):
+    """
+    reads a file with rows of the form concept_id: value_1, value_2, ... (the ontology and annotation file format)
+    :return: generator of (concept_id, list of values) tuples, the list is None for rows without a ':'
+    """
+    with open(filename, 'r') as f:
+        for line in f:
+            data = line.split(":")
+            cid = data[0].strip()
+            if len(data) > 1:
+                yield cid, [x.strip() for x in data[1].split(",")]
+            else:
+                yield cid, None
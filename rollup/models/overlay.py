@@ -0,0 +1,257 @@
+__author__ = 'Aaron J Masino'
+
+import copy
+import numpy as np
+from math import sqrt
+from rollup.models import compact
+from rollup.utils import output
+
+_WORD_BITS = 64
+
+
+class OntologyOverlay:
+    """
+    Mutable view of an immutable base ontology, so a rollup (which removes leaves and promotes their parents to
+    direct annotators) leaves the base untouched.
+
+    The changes are held in two bitmaps of one bit per base concept, packed into uint64 words: removed concepts and
+    concepts promoted to direct annotators, plus a sparse count of the removed children of each concept a removal
+    has touched. Everything else (concept ids, edges, annotated object counts) is read from the base, so any number
+    of overlays (e.g. concurrent or repeated rollups, or forked processes sharing the base copy-on-write) share one
+    base, and the base can be queried in its original state after a rollup. reset clears the overlay in O(V/64).
+
+    The methods mirror rollup.models.compact.CompactOntology and accept and return concept ids, so an overlay can
+    be passed to rollup.models.rollup.rollup and rollup.main in place of an ontology.
+    """
+    def __init__(self, base):
+        """
+        :param base: rollup.models.compact.CompactOntology that has not been rolled up, or an
+               rollup.models.ontology.Ontotology, which is converted once (see CompactOntology.from_ontology). To
+               share a networkx ontology between overlays convert it first and pass the CompactOntology
+        """
+        if not isinstance(base, compact.CompactOntology):
+            base = compact.CompactOntology.from_ontology(base)
+        if base.removed.any():
+            raise ValueError("The base of an overlay must not have been rolled up")
+        self.base = base
+        self.concept_ids = base.concept_ids
+        self.concept_index = base.concept_index
+        self._base_child_counts = np.diff(base.child_offsets).astype(np.int32)
+        words = (len(base.concept_ids) + _WORD_BITS - 1) // _WORD_BITS
+        self.removed_bits = np.zeros(words, dtype=np.uint64)
+        self.promoted_bits = np.zeros(words, dtype=np.uint64)
+        self._removed_children = {}
+        self._leaf_frontier = None
+        self._closure = None
+
+    def reset(self):
+        """discards all changes, returning the overlay to the state of the base"""
+        self.removed_bits.fill(0)
+        self.promoted_bits.fill(0)
+        self._removed_children = {}
+        self._leaf_frontier = None
+
+    def _mask(self, bits):
+        """:return: bool array with the bit of each concept"""
+        # unpackbits yields the bits of each byte from the most significant (numpy < 1.17 has no bitorder), the
+        # bits of each byte of the little endian words are reversed to put concept i at position i
+        return np.unpackbits(bits.astype('<u8').view(np.uint8)).reshape(-1, 8)[:, ::-1].ravel()\
+            [:len(self.concept_ids)].astype(bool)
+
+    @staticmethod
+    def _test(bits, i):
+        return ((int(bits[i >> 6]) >> (i & 63)) & 1) == 1
+
+    @staticmethod
+    def _set(bits, i):
+        bits[i >> 6] |= np.uint64(1 << (i & 63))
+
+    @staticmethod
+    def _clear(bits, i):
+        bits[i >> 6] &= np.uint64(~(1 << (i & 63)) & 0xffffffffffffffff)
+
+    def _removed(self):
+        return self._mask(self.removed_bits)
+
+    def _direct(self):
+        return (self.base.direct | self._mask(self.promoted_bits)) & ~self._removed()
+
+    def _child_counts(self):
+        counts = self._base_child_counts.copy()
+        for p, n in self._removed_children.items():
+            counts[p] -= n
+        return counts
+
+    def _children(self, i):
+        children = self.base.child_indices[self.base.child_offsets[i]:self.base.child_offsets[i + 1]]
+        if not self._removed_children.get(i):
+            return children
+        removed = (self.removed_bits[children >> 6] >> (children & 63).astype(np.uint64)) & np.uint64(1)
+        return children[removed == 0]
+
+    def concepts(self):
+        """Returns all concept ids in the ontology in a stable order (the order of the base)"""
+        return [self.concept_ids[i] for i in np.flatnonzero(~self._removed())]
+
+    def leaf_nodes(self):
+        """Returns all nodes that have at least 1 parent concept and no child concepts"""
+        leaves = ~self._removed() & (self.base.parent_counts != 0) & (self._child_counts() == 0)
+        return [self.concept_ids[i] for i in np.flatnonzero(leaves)]
+
+    def leaf_frontier(self):
+        """Returns the set of current leaf nodes, maintained by remove_concept after it is first built"""
+        if self._leaf_frontier is None:
+            self._leaf_frontier = set(self.leaf_nodes())
+        return self._leaf_frontier
+
+    def remove_concept(self, concept_id):
+        """
+        Removes a leaf concept from the overlay, updating the leaf frontier if one has been built
+        :param concept_id: id of a leaf concept
+        :return: list of the concept's parents that became leaves because concept_id was their last child
+        """
+        i = self.concept_index[concept_id]
+        self._set(self.removed_bits, i)
+        self._clear(self.promoted_bits, i)
+        exposed = []
+        for p in self.base._parents(i):
+            p = int(p)
+            n = self._removed_children.get(p, 0) + 1
+            self._removed_children[p] = n
+            if n == self._base_child_counts[p] and self.base.parent_counts[p] != 0:
+                exposed.append(self.concept_ids[p])
+        if self._leaf_frontier is not None:
+            self._leaf_frontier.discard(concept_id)
+            self._leaf_frontier.update(exposed)
+        return exposed
+
+    def root_nodes(self):
+        """Returns all nodes that have no parent concepts as a list."""
+        return [self.concept_ids[i] for i in np.flatnonzero(~self._removed() & (self.base.parent_counts == 0))]
+
+    def total_annotated_objects(self):
+        """returns: total number of unique object annotated by at least one concept"""
+        return self.base.total_annotated_objects()
+
+    def annotators(self):
+        """
+        returns: list of concepts that directly annotate an object
+                [this does NOT include annotations inherited through descendants]
+        """
+        return [self.concept_ids[i] for i in np.flatnonzero(self._direct())]
+
+    def total_annotators(self):
+        """returns: number of concepts that directly annotate an object"""
+        return int(np.count_nonzero(self._direct()))
+
+    def descendant_concepts(self, concept_id):
+        """returns: set of concept ids of all current descendants of the concept, from the closure index if one is
+        set"""
+        if self._closure is not None:
+            return set(c for c in self._closure.descendants(concept_id)
+                       if not self._test(self.removed_bits, self.concept_index[c]))
+        seen = set()
+        stack = [self.concept_index[concept_id]]
+        while stack:
+            for c in self._children(stack.pop()):
+                if c not in seen:
+                    seen.add(c)
+                    stack.append(c)
+        return set(self.concept_ids[i] for i in seen)
+
+    def set_closure_index(self, closure_index):
+        """
+        :param closure_index: rollup.models.closure.ClosureIndex of the base, used to answer descendant queries
+               without traversing the graph. It is held by the overlay, the base is not changed
+        """
+        self._closure = closure_index
+
+    def parent_concepts(self, concept_id):
+        # only leaves are removed, so the parents of a remaining concept are never removed
+        return self.base.parent_concepts(concept_id)
+
+    def child_concepts(self, concept_id):
+        return [self.concept_ids[c] for c in self._children(self.concept_index[concept_id])]
+
+    def is_direct_annotator(self, concept_id):
+        """returns True if the concept directly annotates an object"""
+        i = self.concept_index[concept_id]
+        if self._test(self.removed_bits, i):
+            return False
+        return bool(self.base.direct[i]) or self._test(self.promoted_bits, i)
+
+    def set_direct_annotator(self, concept_id, is_direct_annotator=True):
+        """marks the concept as (not) directly annotating an object, e.g. when descendants are rolled up into it"""
+        i = self.concept_index[concept_id]
+        if is_direct_annotator:
+            if not self.base.direct[i]:
+                self._set(self.promoted_bits, i)
+        elif self.base.direct[i]:
+            raise ValueError("Concept {0} directly annotates objects in the base ontology".format(concept_id))
+        else:
+            self._clear(self.promoted_bits, i)
+
+    def annotated_object_count(self, concept_id):
+        """returns: number of unique objects annotated by the concept directly or through its descendants"""
+        return self.base.annotated_object_count(concept_id)
+
+    def information_content(self, concept_id, N):
+        """
+        :param concept_id: id of ontology concept
+        :param N: total number of annotated objects
+        :return: information content for the concept
+        """
+        return self.base.information_content(concept_id, N)
+
+    def total_information_content(self, N, direct_annotators_only=False):
+        """
+        :param N: total number of annotated objects
+        :param direct_annotators_only: if True only count information content for direct annotators
+        :return: sum of information content of all concepts
+        """
+        mask = self._direct() if direct_annotators_only else ~self._removed()
+        return sum([self.information_content(self.concept_ids[i], N) for i in np.flatnonzero(mask)])
+
+    def annotators_information_content(self, N):
+        """
+        :param N: total number of annotated objects
+        :return: dictionary {concept_id : information content} for all concepts that directly annotate an object
+        """
+        ic_dict = {}
+        for a in self.annotators():
+            ic_dict[a] = self.information_content(a, N)
+        return ic_dict
+
+    def _annotation_counts(self, direct_annotators_only):
+        mask = self._direct() if direct_annotators_only else ~self._removed()
+        return self.base.object_counts[mask]
+
+    def mean_annotations_per_concept(self, direct_annotators_only = True):
+        counts = self._annotation_counts(direct_annotators_only)
+        return float(counts.sum()) / len(counts)
+
+    def stdev_annotations_per_concept(self, direct_annotators_only = True, ddof = 0):
+        """
+        :param direct_annotators_only:
+        :param ddof: denominator for stdev calculation is N - ddof
+        :return:
+        """
+        counts = self._annotation_counts(direct_annotators_only)
+        m = self.mean_annotations_per_concept(direct_annotators_only)
+        return sqrt(((counts - m) ** 2).sum() / float(len(counts) - ddof))
+
+    def serialization_snapshot(self):
+        """
+        Returns a copy whose serialize_nodes method writes the ontology as it is now, unaffected by later changes
+        (e.g. by a rollup). Only the bitmaps and removed child counts are copied, the base is shared
+        """
+        snapshot = copy.copy(self)
+        snapshot.removed_bits = self.removed_bits.copy()
+        snapshot.promoted_bits = self.promoted_bits.copy()
+        snapshot._removed_children = dict(self._removed_children)
+        snapshot._leaf_frontier = None
+        return snapshot
+
+    def serialize_nodes(self, file_path):
+        output.write_lines((output.key_values_line(node, self.parent_concepts(node)) for node in self.concepts()),
+                           file_path)
@@ -1,8 +1,21 @@
 __author__ = 'Aaron J Masino'
 
+import json
 import numpy as np
+import os
 import time
 from rollup.utils import collections
+from rollup.utils import output
+from rollup.utils import parsing
+from rollup.utils.iteration_log import IterationRecord
+from rollup.utils.metrics import IterationMetrics
+from rollup.models.scoring import ICStatistics, CandidateTable
+
+# number of iterations between recomputing the running IC statistics from scratch
+_RESYNC_FREQ = 1000
+
+# with batch_size 'auto', the fraction of the annotators above the batch floor rolled by one batch
+AUTO_BATCH_FRACTION = 0.05
 
 
 def rollup(ontology,
@@ -10,15 +23,26 @@ def rollup(ontology,
            max_iters = 50000,
            print_freq = 500,
            checkpoints = None,
-           checkpoint_hook = None
+           checkpoint_hook = None,
+           iteration_log = None,
+           replay = None,
+           trajectories = None,
+           batch_size = 1,
+           batch_min_annotators = 0,
+           validate = None,
+           closure = None,
+           metrics = None,
+           profiler = None
            ):
     """
     Performs a rollup on ontology using a greedy search on current leaves in the ontology
     by selecting the leaf whose elimination will yield the minimum standard deviation of
     the average information content of all concepts that directly annotate an object
 
-    WARNING: THIS WILL MUTATE THE INPUT ONTOLOGY GRAPH BY REMOVING LEAF NODES THAT ARE ROLLED UP,
+    WARNING: THIS WILL MUTATE THE ONTOLOGY IT IS GIVEN BY REMOVING LEAF NODES THAT ARE ROLLED UP,
     AND ADDING ANNOTATIONS TO THE CONCEPTS TO WHICH DESCENDANT CONCEPTS ARE ROLLED TO
+    When that is a rollup.models.overlay.OntologyOverlay (as rollup.main passes for a CompactOntology) the overlay is
+    mutated and its base ontology is left unchanged; the overlay can be reset for another rollup of the same base
 
     :param ontology: an instance of rollup.ontology.Ontology
     :param desired_annotators: the number of direct annotators after rollup
@@ -26,6 +50,40 @@ def rollup(ontology,
     :param print_freq: frequency in iterations to print status
     :param checkpoints: list of integers of number of annotators at which checkpoint_hook should be called
     :param checkpoint_hook: callable that accepts position args: annotator_count, rollups, rollup_levels, best_lambdas, best_psis
+                            the arguments are snapshots that are not modified by the rollup after the call, so the
+                            hook may hand them to a background writer (see rollup.utils.checkpoint.CheckpointWriter)
+    :param iteration_log: optional rollup.utils.iteration_log.IterationLogWriter, a record of each iteration is
+                          appended to it
+    :param replay: optional list of rollup.utils.iteration_log.IterationRecord logged by an earlier run on the same
+                   ontology. The recorded iterations are applied without scoring any candidates and the rollup
+                   continues from the state they leave, exactly as the earlier run would have. Checkpoints reached
+                   during the replay are not repeated. Only supported with a batch_size of 1, since the log does not
+                   record which leaves of the batch in progress were still to be rolled
+    :param trajectories: optional dictionary that is filled with the per iteration lists 'lambdas', 'psis' and
+                         'gammas' (which start with the initial value) and 'leaf_counts' and 'annotator_counts'
+                         (one value per iteration). The lists are updated in place as the rollup runs
+    :param batch_size: number of leaves selected from a single scoring of the candidates, or 'auto' to select
+                       AUTO_BATCH_FRACTION of the annotators above the batch floor. Leaves in a batch have pairwise
+                       disjoint parents, so rolling one does not change the delta another would apply to the IC
+                       statistics, but it does change the statistics that delta is applied to and so the Psi the other
+                       would yield; only the first is the greedy choice. Every leaf is still one iteration. The default
+                       of 1 is the pure greedy search. A rollup with batches can not be resumed (see replay)
+    :param batch_min_annotators: batches are only selected while there are more than this many direct annotators,
+                                 below it the search is pure greedy. See psi_divergence to compare the trajectory
+                                 with a pure greedy run
+    :param validate: optional list of rollup.utils.iteration_log.IterationRecord of an earlier rollup of the same
+                     ontology before its annotations changed (see CompactOntology.add_annotations). Each greedy
+                     choice is compared with the recorded one and the first iteration whose choice changes is
+                     reported; the rollup itself is not affected
+    :param closure: optional rollup.models.closure.ClosureIndex of the ontology before rollup. If given rollup_levels
+                    are computed from the longest paths in the original graph when they are returned (and at
+                    checkpoints) instead of being counted as concepts are rolled. The count is the number of times a
+                    concept's rollup moved up, which differs from the longest path when a concept was rolled into
+                    several concepts that share ancestors or that are connected to their ancestors by longer paths
+    :param metrics: optional sink with an append method, e.g. rollup.utils.metrics.JsonlMetricsSink, RingBufferSink
+                    or CallbackSink, that receives a rollup.utils.metrics.IterationMetrics for each iteration. Timers
+                    are only read when a sink is given
+    :param profiler: optional rollup.utils.metrics.IterationProfiler that profiles the first iterations
     :return: (rollup, rollup_levels, best_lambdas, best_psis)
             rollup - dictionary - keys are concepts in the original graph, values are the concepts to which the
                                    given concept represented by the key is rolled up to. For concepts that do not
@@ -34,12 +92,18 @@ def rollup(ontology,
                                          of edges in the original graph between the concept and the concepts it was
                                          rolled to
             best_lambdas - list of mean direct annotator IC over all algorithm iterations
-            best_psis - list of stdev of direct annotator IC over all algorithm iterations
+            best_psis - list of stdev of direct annotator IC over all algorithm iterations. Candidates are scored
+                        from running sums (see rollup.models.scoring.ICStatistics) so these values agree with
+                        ic_stdev over all direct annotators to within scoring.PSI_TOLERANCE
     """
+    if replay and batch_size != 1:
+        raise ValueError("An iteration log can not be replayed by a rollup with batch_size {0}, resuming is only "
+                         "supported for the pure greedy search".format(batch_size))
     N = ontology.total_annotated_objects()
     D = ontology.total_annotators()
     annotator_ICs = ontology.annotators_information_content(N)
-    Gamma = np.sum([x for x in annotator_ICs.values()])
+    stats = ICStatistics(annotator_ICs.values())
+    Gamma = stats.Gamma
     Lambda = Gamma / float(D)
     Psi = ic_stdev(annotator_ICs.values(), Lambda, D)
 
@@ -56,84 +120,129 @@ def rollup(ontology,
     iterations = 0
     rollups = {}
     rollup_levels = {}
-
+    # reverse index of rollups - {current concept: set of rolled concepts whose rollup list contains it}
+    rolled_into = {}
+    if trajectories is not None:
+        trajectories.update(lambdas=best_lambdas, psis=best_psis, gammas=best_gammas,
+                            leaf_counts=leaf_counts, annotator_counts=annotator_counts)
+
+    concepts = ontology.concepts()
+    slots = {cid: i for i, cid in enumerate(concepts)}
+
+    # replay the iterations of an earlier run, the recorded statistics are restored so the run continues exactly
+    for record in replay or ():
+        leaf_to_roll = concepts[record.leaf]
+        leaf_parents = ontology.parent_concepts(leaf_to_roll)
+        for s in record.promoted:
+            p = concepts[s]
+            ontology.set_direct_annotator(p)
+            annotator_ICs[p] = ontology.information_content(p, N)
+        ontology.remove_concept(leaf_to_roll)
+        del annotator_ICs[leaf_to_roll]
+        _record_rollup(rollups, None if closure else rollup_levels, rolled_into, leaf_to_roll, leaf_parents)
+        iterations += 1
+        best_gammas.append(record.gamma)
+        best_lambdas.append(record.gamma / float(record.d))
+        best_psis.append(record.psi)
+        leaf_counts.append(record.leaf_count)
+        annotator_counts.append(record.d)
+    if replay:
+        stats.Gamma, stats.SumSq, stats.D = replay[-1].gamma, replay[-1].sumsq, replay[-1].d
+        D = stats.D
+        Gamma = stats.Gamma
+        Lambda = best_lambdas[-1]
+        Psi = best_psis[-1]
+        print("Replayed {0} iterations, D (annotators):\t{1}".format(iterations, D))
+
+    # candidate table holds the delta each current leaf would apply to the IC statistics if rolled, rows are
+    # only recomputed when a leaf's delta changes
+    candidates = CandidateTable(stats, len(concepts))
+    leaves = ontology.leaf_frontier()
+    for leaf in leaves:
+        candidates.update(slots[leaf], _leaf_delta(ontology, leaf, annotator_ICs, stats, N))
+
+    # number of leading iterations that agree with the sequence being validated
+    validated = 0
+    diverged = validate is None
+
+    # slots of the leaves of the current batch that are still to be rolled
+    batch = []
+    batch_floor = max(desired_annotators, batch_min_annotators)
+
+    if profiler is not None:
+        profiler.start()
     t0 = time.time()
+    t_first = time.perf_counter()
     while D > desired_annotators and iterations < max_iters:
-        leaf_to_roll = None
-        best_Gamma = 0.0
-        best_Psi = float("inf")
-        best_D = D
-        leaves = ontology.leaf_nodes()
-        if not leaves:
+        if metrics is not None:
+            t_start = time.perf_counter()
+        leaf_count = len(leaves)
+        if not leaf_count:
             print("WARNING: NO LEAVES FOUND IN GRAPH")
         iterations += 1
-        parent_is_object_annotator = {}
-        leaf_count = 0
-        for leaf in leaves:
-            leaf_count += 1
-            tmp_Gamma = Gamma
-            parents = ontology.parent_concepts(leaf)
-
-            # store leaf attributes to restore later
-            leaf_ic = ontology.information_content(leaf, N)
-
-            for p in parents:
-                p_node = ontology.graph.node[p]
-                # need to store parent's current is_visit_annotator
-                parent_is_object_annotator[p] = p_node[ontology.is_direct_annotator_key]
-                if not p_node[ontology.is_direct_annotator_key]:
-                    # temporarily add parent to list of annotators for rollup and add ic to Gamma
-                    pic = ontology.information_content(p, N)
-                    annotator_ICs[p] = pic
-                    tmp_Gamma += pic
-
-            # temporarily remove leaf from annotator_ICs for stdev computation
-            del annotator_ICs[leaf]
-
-            tmp_Gamma -= leaf_ic
-            tmp_D = len(annotator_ICs)
-            tmp_Lambda = tmp_Gamma / float(tmp_D)
-            tmp_Psi = ic_stdev(annotator_ICs.values(), tmp_Lambda, tmp_D)
-            if (tmp_Lambda < 0):
-                print("WARNING: NEGATIVE TMP_LAMBDA")
-
-            # store current best values
-            if tmp_Psi < best_Psi:
-                best_Psi = tmp_Psi
-                best_Gamma = tmp_Gamma
-                leaf_to_roll = leaf
-                best_D = tmp_D
-
-            # restore leaf and parents to current state
-            annotator_ICs[leaf] = leaf_ic
-
-            for p in parents:
-                if not parent_is_object_annotator[p]:
-                    del annotator_ICs[p]
-
-                    # END for leaf in leaves
-
-        # make sure there is a leaf to roll
-        if leaf_to_roll == None:
-            print("WARNING: LEAF_TO_ROLL IS NONE")
-            break
+        if batch and D > batch_floor:
+            slot = batch.pop(0)
+            _, best_Lambda, best_Psi, _ = stats.score(*candidates.delta(slot))
+        else:
+            best = candidates.best()
+
+            # make sure there is a leaf to roll
+            if best is None:
+                print("WARNING: LEAF_TO_ROLL IS NONE")
+                break
+            slot, best_Lambda, best_Psi = best
+            k = _batch_size(batch_size, D, batch_floor)
+            batch = _select_batch(ontology, concepts, candidates, slot, k) if k > 1 else []
+        if not diverged:
+            if iterations <= len(validate) and validate[iterations - 1].leaf == slot:
+                validated += 1
+            else:
+                diverged = True
+                print("Prior rollup sequence changes at iteration {0}, {1} iterations validated"
+                      .format(iterations, validated))
+        if best_Lambda < 0:
+            print("WARNING: NEGATIVE TMP_LAMBDA")
+        if metrics is not None:
+            t_selected = time.perf_counter()
+        leaf_to_roll = concepts[slot]
+        best_delta = candidates.delta(slot)
 
         # update leaf_to_roll parents
         leaf_parents = ontology.parent_concepts(leaf_to_roll)
+        promoted = []
         for p in leaf_parents:
-            p_node = ontology.graph.node[p]
-            parent_is_object_annotator = p_node[ontology.is_direct_annotator_key]
-            if not parent_is_object_annotator:
-                p_node[ontology.is_direct_annotator_key] = True
+            if not ontology.is_direct_annotator(p):
+                ontology.set_direct_annotator(p)
                 annotator_ICs[p] = ontology.information_content(p, N)
+                promoted.append(p)
 
-        # roll up leaf_to_roll - remove it from graph and annotator list
-        ontology.graph.remove_node(leaf_to_roll)
+        # roll up leaf_to_roll - remove it from graph, leaf frontier, annotator list and candidate table
+        exposed_leaves = ontology.remove_concept(leaf_to_roll)
         del annotator_ICs[leaf_to_roll]
+        candidates.remove(slot)
+        if metrics is not None:
+            t_mutated = time.perf_counter()
+
+        # only leaves sharing a newly promoted parent and parents left without children have a changed delta
+        rescored = len(exposed_leaves)
+        for p in promoted:
+            for c in ontology.child_concepts(p):
+                if slots[c] in candidates:
+                    candidates.update(slots[c], _leaf_delta(ontology, c, annotator_ICs, stats, N))
+                    rescored += 1
+        for p in exposed_leaves:
+            candidates.update(slots[p], _leaf_delta(ontology, p, annotator_ICs, stats, N))
+        if metrics is not None:
+            t_rescored = time.perf_counter()
 
         # update Gamma, N, D
-        D = best_D
-        Gamma = best_Gamma
+        stats.apply(*best_delta)
+        if iterations % _RESYNC_FREQ == 0:
+            stats.resync(annotator_ICs.values())
+        if metrics is not None:
+            t_applied = time.perf_counter()
+        D = stats.D
+        Gamma = stats.Gamma
         best_gammas.append(Gamma)
         Lambda = Gamma / float(D)
         best_lambdas.append(Lambda)
@@ -141,49 +250,58 @@ def rollup(ontology,
         best_psis.append(Psi)
         leaf_counts.append(leaf_count)
         annotator_counts.append(D)
+        if iteration_log is not None:
+            iteration_log.append(IterationRecord(slot, [slots[p] for p in promoted], leaf_count,
+                                                 stats.Gamma, stats.SumSq, Psi, D))
         if iterations % print_freq == 0:
             print("Iteration:\t{0}\nD (annotators):\t{1}\nLambda:\t{2}\nPsi:\t{3}\nLeaf count:\t{4}"
                   .format(iterations, D, Lambda, Psi, leaf_count))
 
-        # store roll up as dict{rolled_child:parents}. Requires a check to determine if leaf_to_roll is in
-        # any of the values of the dict in which case the key will have to be assigned to new parent
-        prev_corrected_levels = []
-        for k, obj_list in rollups.items():
-            if leaf_to_roll in obj_list:
-                if k not in prev_corrected_levels:
-                    rollup_levels[k] += 1
-                    prev_corrected_levels.append(k)
-                obj_list.remove(leaf_to_roll)
-                for p in leaf_parents:
-                    if p not in obj_list:
-                        obj_list.append(p)
-
-        rollups[leaf_to_roll] = leaf_parents
-        rollup_levels[leaf_to_roll] = 1
+        if metrics is not None:
+            t_mapping = time.perf_counter()
+        _record_rollup(rollups, None if closure else rollup_levels, rolled_into, leaf_to_roll, leaf_parents)
+        if metrics is not None:
+            t_mapped = time.perf_counter()
         t1 = time.time()
         tdelta = t1 - t0
         if iterations % print_freq == 0:
             print("Reduction of D to {0} to {1} seconds".format(D, tdelta))
 
-        if D in checkpoints:
-            tmp_rollups = rollups.copy()
+        if checkpoints and D in checkpoints:
+            # the hook receives copies that later iterations do not modify, so it may process them asynchronously
+            tmp_rollups = dict((k, list(v)) for k, v in rollups.items())
             tmp_rollup_levels = rollup_levels.copy()
-            rolled_cids = list(tmp_rollups.keys())
             for a in ontology.annotators():
-                if a not in rolled_cids:
+                if a not in tmp_rollups:
                     tmp_rollups[a] = [a]
                     tmp_rollup_levels[a] = 0
-            checkpoint_hook(D, tmp_rollups, tmp_rollup_levels, best_lambdas, best_psis)
-
+            if closure is not None:
+                tmp_rollup_levels = closure.rollup_levels(tmp_rollups)
+            checkpoint_hook(D, tmp_rollups, tmp_rollup_levels, list(best_lambdas), list(best_psis))
+
+        if metrics is not None:
+            t_end = time.perf_counter()
+            metrics.append(IterationMetrics(iterations, D, Lambda, Psi, leaf_count, rescored,
+                                            (t_selected - t_start) + (t_rescored - t_mutated),
+                                            (t_mutated - t_selected) + (t_applied - t_rescored),
+                                            t_mapped - t_mapping, t_end - t_mapped, t_end - t_first))
+        if profiler is not None:
+            profiler.iteration_done(iterations)
+
+    if profiler is not None:
+        profiler.stop()
+    if not diverged:
+        print("Prior rollup sequence unchanged, {0} iterations validated".format(validated))
 
     # need to add concepts that were annotators in the original data and were NOT rolled up to the rollup dictionary
     # this will be needed to differentiate these concepts from concepts that appear in new data that were not part of
     # the ontology segment represented by the dataset used to rollup concepts
-    rolled_cids = list(rollups.keys())
     for a in ontology.annotators():
-        if a not in rolled_cids:
+        if a not in rollups:
             rollups[a] = [a]
             rollup_levels[a] = 0
+    if closure is not None:
+        rollup_levels = closure.rollup_levels(rollups)
 
     tf = time.time()
     tdelta = tf - t0
@@ -191,6 +309,69 @@ def rollup(ontology,
 
     return (rollups, rollup_levels, best_lambdas, best_psis)
 
+
+def _batch_size(batch_size, D, batch_floor):
+    """:return: number of leaves to select for a batch, a batch never takes D below batch_floor"""
+    if batch_size == 'auto':
+        k = int((D - batch_floor) * AUTO_BATCH_FRACTION)
+    else:
+        k = batch_size
+    # rolling a leaf lowers D by at most one
+    return max(1, min(k, D - batch_floor))
+
+
+def _select_batch(ontology, concepts, candidates, best_slot, k):
+    """
+    :return: slots of up to k - 1 leaves, in order of their score, whose parents are disjoint from each other and from
+             the parents of the leaf in best_slot
+    """
+    used = set(ontology.parent_concepts(concepts[best_slot]))
+    batch = []
+    for slot in candidates.ranked():
+        if len(batch) == k - 1:
+            break
+        if slot == best_slot:
+            continue
+        parents = ontology.parent_concepts(concepts[slot])
+        if used.isdisjoint(parents):
+            batch.append(int(slot))
+            used.update(parents)
+    return batch
+
+
+def _record_rollup(rollups, rollup_levels, rolled_into, leaf_to_roll, leaf_parents):
+    """
+    store roll up as dict{rolled_child:parents}. Concepts previously rolled into leaf_to_roll are found with the
+    reverse index rolled_into and re-pointed to its parents. rollup_levels are not maintained if it is None
+    """
+    for k in rolled_into.pop(leaf_to_roll, ()):
+        if rollup_levels is not None:
+            rollup_levels[k] += 1
+        obj_list = rollups[k]
+        obj_list.remove(leaf_to_roll)
+        for p in leaf_parents:
+            if p not in obj_list:
+                obj_list.append(p)
+            rolled_into.setdefault(p, set()).add(k)
+
+    rollups[leaf_to_roll] = leaf_parents
+    if rollup_levels is not None:
+        rollup_levels[leaf_to_roll] = 1
+    for p in leaf_parents:
+        rolled_into.setdefault(p, set()).add(leaf_to_roll)
+
+
+def _leaf_delta(ontology, leaf, annotator_ICs, stats, N):
+    """
+    rolling a leaf removes its IC from the annotators and adds the IC of every parent that is not already a direct
+    annotator, so the candidate can be scored from that local change alone
+    :return: (delta_Gamma, delta_SumSq, delta_D) for rolling leaf
+    """
+    promoted_ics = [ontology.information_content(p, N) for p in ontology.parent_concepts(leaf)
+                    if not ontology.is_direct_annotator(p)]
+    return stats.delta([annotator_ICs[leaf]], promoted_ics)
+
+
 def serialize_rollups(rollups, file_path):
     """
     stores rollup to file
@@ -198,18 +379,34 @@ def serialize_rollups(rollups, file_path):
     :param file_path: location to store data
     :return: None
     """
-    with open(file_path, 'a+') as f:
-        first_line = True
-        for k, obj_list in rollups.items():
-            if not first_line:
-                line = "\n{0}:".format(k)
-            else:
-                line = "{0}:".format(k)
-                first_line = False
-            for v in obj_list:
-                line = "{0}{1},".format(line, v)
-            line = line[0:-1]
-            f.write(line)
+    output.write_lines((output.key_values_line(k, obj_list) for k, obj_list in rollups.items()), file_path)
+
+
+def psi_divergence(trajectories, reference_trajectories):
+    """
+    Compares the Psi trajectory of a rollup, e.g. one run with a batch_size, with that of a reference rollup of the
+    same ontology, e.g. the pure greedy search. Trajectories are aligned by the number of direct annotators, using
+    the Psi of the first iteration that reached each count
+    :param trajectories: trajectories dictionary filled by the rollup method (or loaded with load_rollup_arrays)
+    :param reference_trajectories: trajectories of the reference rollup
+    :return: dictionary with the 'max' and 'mean' absolute difference in Psi over the annotator counts reached by
+             both rollups, the number of such 'counts', the annotator count 'argmax' at which the difference is
+             largest and the difference in 'final' Psi (positive if the rollup ends with a higher Psi)
+    """
+    def psi_by_count(t):
+        psis = {}
+        for d, psi in zip(t['annotator_counts'], t['psis'][1:]):
+            psis.setdefault(int(d), float(psi))
+        return psis
+    psis = psi_by_count(trajectories)
+    ref_psis = psi_by_count(reference_trajectories)
+    diffs = dict((d, abs(psi - ref_psis[d])) for d, psi in psis.items() if d in ref_psis)
+    argmax = max(diffs, key=diffs.get) if diffs else None
+    return {'max': diffs[argmax] if diffs else 0.0,
+            'mean': sum(diffs.values()) / len(diffs) if diffs else 0.0,
+            'counts': len(diffs),
+            'argmax': argmax,
+            'final': float(trajectories['psis'][-1]) - float(reference_trajectories['psis'][-1])}
 
 
 def ic_stdev(ic_vals, mean_ic, total_annotators):
@@ -223,18 +420,76 @@ def serialzie_rollup_levels(rollup_levels, file_path):
     :param file_path: location to store data
     :return: None
     """
-    with open(file_path, 'a+') as f:
-        first_line = True
-        for k, v in rollup_levels.items():
-            if first_line:
-                line = "{0},{1}".format(k, v)
-                first_line = False
-            else:
-                line = "\n{0},{1}".format(k, v)
-            f.write(line)
+    output.write_lines(("{0},{1}".format(k, v) for k, v in rollup_levels.items()), file_path)
+
+
+def save_rollup_arrays(directory, rollups, rollup_levels, trajectories=None):
+    """
+    stores a rollup as .npy files in directory, which load_rollup_arrays memory maps without parsing.
+
+    The rollup dictionary is stored as CSR arrays: concept_ids holds the concept ids (the rollup keys in order,
+    followed by any rolled-to concept that is not a key) and the concepts key i is rolled to are
+    rollup_indices[rollup_offsets[i]:rollup_offsets[i+1]], indices into concept_ids. rollup_levels holds the level of
+    each key.
+    :param directory: location to store data, created if needed
+    :param rollups: rollup dictionary returned by rollup method
+    :param rollup_levels: rollup_levels dict returned by rollup method
+    :param trajectories: optional dictionary {name: list of numbers} (see the rollup method), each stored as name.npy
+    :return: None
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    index = dict((cid, i) for i, cid in enumerate(rollups))
+    concept_ids = list(rollups)
+    offsets = np.zeros(len(rollups) + 1, dtype=np.int64)
+    indices = []
+    for i, targets in enumerate(rollups.values()):
+        for t in targets:
+            j = index.get(t)
+            if j is None:
+                j = index[t] = len(concept_ids)
+                concept_ids.append(t)
+            indices.append(j)
+        offsets[i + 1] = len(indices)
+    arrays = {'concept_ids': np.frombuffer("\n".join(concept_ids).encode("utf-8"), dtype=np.uint8),
+              'rollup_offsets': offsets,
+              'rollup_indices': np.array(indices, dtype=np.int32),
+              'rollup_levels': np.array([rollup_levels[k] for k in rollups], dtype=np.int32)}
+    if trajectories:
+        for name, values in trajectories.items():
+            arrays[name] = np.array(values)
+    for name, a in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), a)
+    with open(os.path.join(directory, 'arrays.json'), 'w') as f:
+        json.dump({'arrays': sorted(arrays), 'rollup_count': len(rollups)}, f)
+
+
+def load_rollup_arrays(directory, mmap_mode='r'):
+    """
+    :param directory: directory written by save_rollup_arrays
+    :param mmap_mode: passed to numpy.load, arrays are memory mapped by default
+    :return: dictionary {name: array} of the stored arrays, except 'concept_ids' which is decoded to a list of
+             concept ids
+    """
+    with open(os.path.join(directory, 'arrays.json'), 'r') as f:
+        meta = json.load(f)
+    arrays = dict((name, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode))
+                  for name in meta['arrays'])
+    ids = arrays['concept_ids']
+    arrays['concept_ids'] = ids.tobytes().decode("utf-8").split("\n") if len(ids) else []
+    return arrays
 
 
 def map_annotations_with_rollup(rollups, unrolled_annotation_dict):
+    """
+    :param rollups: rollup dictionary returned by rollup method
+    :param unrolled_annotation_dict: dictionary {concept_id: list of annotated objects} of the original annotations,
+           or a rollup.utils.parsing.DirectAnnotations capture of them
+    :return: dictionary {concept_id: list of annotated objects} of the annotations after rollup
+    """
+    if isinstance(unrolled_annotation_dict, parsing.DirectAnnotations):
+        return dict((rid, unrolled_annotation_dict.objects(indices))
+                    for rid, indices in iter_rolled_annotations(rollups, unrolled_annotation_dict))
     rolled_annotations_dict = {}
     for cid, obj_list in unrolled_annotation_dict.items():
         rids = rollups[cid]
@@ -245,3 +500,39 @@ def map_annotations_with_rollup(rollups, unrolled_annotation_dict):
                 rolled_annotations_dict[rid] = obj_list
     return rolled_annotations_dict
 
+
+def iter_rolled_annotations(rollups, annotations):
+    """
+    Generates the annotations after rollup one concept at a time from a capture of the original annotations
+    :param rollups: rollup dictionary returned by rollup method
+    :param annotations: rollup.utils.parsing.DirectAnnotations of the original annotations
+    :return: generator of (concept_id, int32 array of object indices into annotations.object_ids), concepts in the
+             same order as map_annotations_with_rollup
+    """
+    # as in a dict built from the file, a concept annotated on several rows keeps its first position and last row
+    rows = {}
+    for i, cid in enumerate(annotations.concept_ids):
+        rows[cid] = i
+    sources = {}
+    for cid, i in rows.items():
+        for rid in rollups[cid]:
+            sources.setdefault(rid, []).append(i)
+    for rid, source_rows in sources.items():
+        if len(source_rows) == 1:
+            yield rid, annotations.row(source_rows[0])
+        else:
+            yield rid, np.unique(np.concatenate([annotations.row(i) for i in source_rows]))
+
+
+def serialize_rolled_annotations(rollups, annotations, file_path):
+    """
+    stores the annotations after rollup to file, in the format of the input annotation file, writing each concept's
+    objects as they are produced rather than building the complete rolled annotations first
+    :param rollups: rollup dictionary returned by rollup method
+    :param annotations: rollup.utils.parsing.DirectAnnotations of the original annotations
+    :param file_path: location to store data
+    :return: None
+    """
+    object_ids = annotations.object_ids
+    output.write_lines(("{0}:{1}".format(rid, ",".join([object_ids[i] for i in indices]))
+                        for rid, indices in iter_rolled_annotations(rollups, annotations)), file_path)
@@ -0,0 +1,141 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+from math import sqrt
+
+# Largest absolute difference allowed between a Psi computed from the running sums and the same Psi computed
+# directly with rollup.ic_stdev over all annotator ICs. IC values are log ratios (typically < 25), so this bound
+# leaves several orders of magnitude of headroom over the rounding error accumulated between resyncs.
+PSI_TOLERANCE = 1e-9
+
+
+class ICStatistics:
+    """
+    Running statistics of the information content (IC) of the direct annotators of an ontology.
+
+    Keeps Gamma (sum of IC), the sum of squared IC and D (number of direct annotators) so that the mean (Lambda)
+    and standard deviation (Psi) of annotator IC can be evaluated for a candidate rollup from the change it makes
+    to those three quantities alone, rather than from a pass over every annotator.
+
+    The sum of squares is accumulated about a fixed shift (the initial mean IC) to avoid the catastrophic
+    cancellation of the textbook E[x^2] - E[x]^2 formula. Psi values agree with rollup.ic_stdev to within
+    PSI_TOLERANCE; call resync periodically to discard rounding error accumulated by long runs.
+    """
+    def __init__(self, ic_vals):
+        ic_vals = list(ic_vals)
+        self.D = len(ic_vals)
+        self.shift = sum(ic_vals) / float(self.D) if self.D else 0.0
+        self.resync(ic_vals)
+
+    def resync(self, ic_vals):
+        """recompute the running sums from the complete collection of annotator IC values"""
+        ic_vals = list(ic_vals)
+        self.D = len(ic_vals)
+        self.Gamma = sum(ic_vals)
+        self.SumSq = sum([(x - self.shift) ** 2 for x in ic_vals])
+
+    def delta(self, removed_ics, added_ics):
+        """
+        :param removed_ics: IC values of concepts that stop being direct annotators
+        :param added_ics: IC values of concepts that become direct annotators
+        :return: (delta_Gamma, delta_SumSq, delta_D) for the change
+        """
+        d_gamma = 0.0
+        d_sumsq = 0.0
+        for x in added_ics:
+            d_gamma += x
+            d_sumsq += (x - self.shift) ** 2
+        for x in removed_ics:
+            d_gamma -= x
+            d_sumsq -= (x - self.shift) ** 2
+        return d_gamma, d_sumsq, len(added_ics) - len(removed_ics)
+
+    def score(self, d_gamma=0.0, d_sumsq=0.0, d_d=0):
+        """
+        :return: (Gamma, Lambda, Psi, D) that would result from applying the given delta
+        """
+        gamma = self.Gamma + d_gamma
+        d = self.D + d_d
+        lam = gamma / float(d)
+        # mean of the shifted values, E[(x - shift)^2] - E[x - shift]^2 is the population variance
+        m = lam - self.shift
+        var = (self.SumSq + d_sumsq) / float(d) - m * m
+        return gamma, lam, sqrt(var) if var > 0 else 0.0, d
+
+    def apply(self, d_gamma, d_sumsq, d_d):
+        """commit a delta previously produced by delta"""
+        self.Gamma += d_gamma
+        self.SumSq += d_sumsq
+        self.D += d_d
+
+
+class CandidateTable:
+    """
+    Table of the (delta_Gamma, delta_SumSq, delta_D) that rolling each current leaf would apply to an ICStatistics.
+
+    Rows are NumPy arrays indexed by a fixed slot per concept (its position in Ontotology.concepts()), so a row
+    only needs recomputing when the leaf's own delta changes, and the best leaf is found with a single vectorized
+    evaluation of the stdev formula over the whole table. Candidates whose Psi is within PSI_TOLERANCE of the
+    minimum are ties, broken in favour of the lowest slot.
+    """
+    def __init__(self, stats, capacity):
+        self.stats = stats
+        self.d_gamma = np.zeros(capacity)
+        self.d_sumsq = np.zeros(capacity)
+        self.d_d = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.size = 0
+
+    def __contains__(self, slot):
+        return bool(self.active[slot])
+
+    def update(self, slot, delta):
+        """store the delta for the leaf in slot, adding the slot to the table if needed"""
+        if not self.active[slot]:
+            self.active[slot] = True
+            self.size += 1
+        self.d_gamma[slot], self.d_sumsq[slot], self.d_d[slot] = delta
+
+    def remove(self, slot):
+        if self.active[slot]:
+            self.active[slot] = False
+            self.size -= 1
+
+    def delta(self, slot):
+        return float(self.d_gamma[slot]), float(self.d_sumsq[slot]), int(self.d_d[slot])
+
+    def scores(self):
+        """
+        :return: (Lambda, Psi) arrays over all slots for the statistics that would result from rolling the leaf in
+                 each slot. Psi is inf for slots that do not hold a leaf
+        """
+        stats = self.stats
+        d = (stats.D + self.d_d).astype(float)
+        # inactive rows may describe a state with no annotators, which is never selected
+        d[~self.active] = 1.0
+        lam = (stats.Gamma + self.d_gamma) / d
+        m = lam - stats.shift
+        var = (stats.SumSq + self.d_sumsq) / d - m * m
+        psi = np.sqrt(np.maximum(var, 0.0))
+        psi[~self.active] = np.inf
+        return lam, psi
+
+    def ranked(self):
+        """
+        :return: array of the slots holding a leaf ordered by the Psi that rolling the leaf would yield, ties in
+                 slot order
+        """
+        _, psi = self.scores()
+        slots = np.flatnonzero(self.active)
+        return slots[np.argsort(psi[slots], kind='mergesort')]
+
+    def best(self):
+        """
+        :return: (slot, Lambda, Psi) of the leaf whose rollup minimizes Psi, or None if the table is empty
+        """
+        if not self.size:
+            return None
+        lam, psi = self.scores()
+        best_psi = psi.min()
+        slot = int(np.flatnonzero(psi <= best_psi + PSI_TOLERANCE)[0])
+        return slot, float(lam[slot]), float(psi[slot])
@@ -0,0 +1,228 @@
+__author__ = 'Aaron J Masino'
+
+import contextlib
+import itertools
+import multiprocessing
+import os
+import sys
+from multiprocessing import connection
+from rollup.models import ontology
+from rollup.utils import config_helper
+from rollup.utils import parsing
+from rollup.main import run_rollup
+
+# bytes of memory a run is expected to take per ontology concept, used when MEMORY_PER_RUN_MB is not configured. A
+# forked run of a full rollup (candidate table, annotator ICs, rollup dictionaries and its ontology overlay) of
+# benchmarks/generate.py ontologies allocated 1.6 KB per concept at 10k concepts and 1.0 KB at 100k, the fixed
+# interpreter overhead dominating small ontologies; this leaves headroom for checkpoint output on top of that
+RUN_MEMORY_PER_CONCEPT = 2048
+
+# separates the alternative values of an option in a Sweep_Grid section (values such as CHECK_POINTS contain commas)
+GRID_SEP = ';'
+
+
+def main(argv=None):
+    """
+    Runs the rollups of several configurations, building the ontology of each set of input files only once.
+
+    usage: python sweep.py PATH/TO/CONFIG/FILE [PATH/TO/CONFIG/FILE ...]
+
+    Each configuration is a regular main.py configuration. A configuration with a Sweep_Grid section expands to one
+    run per combination of the values listed in it; output file paths should then contain {run}, which is replaced
+    with the run name. The ontology is built (with the compact backend) in this process, and each run is a forked
+    worker process that shares it copy-on-write and records its rollup in its own overlay (see
+    rollup.models.overlay.OntologyOverlay).
+    """
+    if argv is None:
+        argv = sys.argv
+
+    if len(argv) < 2:
+        print("Configuration file paths must be provided.\nExiting now.")
+        print("Usage: python sweep.py PATH/TO/CONFIG/FILE [PATH/TO/CONFIG/FILE ...]")
+        return 1
+
+    runs = []
+    sweep_options = {}
+    for config_path in argv[1:]:
+        config = config_helper.loadConfig(config_path)
+        runs.extend(expand_runs(config, os.path.splitext(os.path.basename(config_path))[0]))
+        if config.has_section("Sweep"):
+            sweep_options.update(config_helper.ConfigSectionMap(config, "Sweep"))
+
+    # runs on the same input files share one ontology
+    groups = {}
+    for run in runs:
+        groups.setdefault(_ontology_key(run), []).append(run)
+
+    failed = []
+    for key, group in groups.items():
+        input_files = group[0]['input_files']
+        rollup_options = group[0]['rollup_options']
+        print("Creating ontology from:\n{0}\n{1}".format(input_files['FILE_ONTOLOGY'], input_files['FILE_ANNOTATIONS']))
+        parse_processes = int(rollup_options.get('PARSE_PROCESSES', 1))
+        direct_annotations = None
+        if any(['FILE_ANNOTATIONS' in run['output_files'] for run in group]):
+            direct_annotations = parsing.DirectAnnotations.from_file(input_files['FILE_ANNOTATIONS'],
+                                                                     processes=parse_processes)
+        sketch_error = float(rollup_options['SKETCH_ERROR']) if 'SKETCH_ERROR' in rollup_options else None
+        ont = ontology.OntologyFactory().build_compact_ontology_from_files(input_files['FILE_ONTOLOGY'],
+                                                                           input_files['FILE_ANNOTATIONS'],
+                                                                           parse_processes, direct_annotations,
+                                                                           sketch_error)
+        if 'MEMORY_PER_RUN_MB' in sweep_options:
+            run_memory = int(float(sweep_options['MEMORY_PER_RUN_MB']) * (1 << 20))
+        else:
+            run_memory = len(ont.concepts()) * RUN_MEMORY_PER_CONCEPT
+        workers = max_concurrency(int(sweep_options['MAX_WORKERS']) if 'MAX_WORKERS' in sweep_options else None,
+                                  run_memory)
+        print("Running {0} rollups, {1} at a time".format(len(group), workers))
+        failed.extend(run_all(ont, group, direct_annotations, workers, sweep_options.get('LOG_DIR')))
+
+    if failed:
+        print("Failed runs: {0}".format(", ".join(failed)))
+        return 1
+    print("Sweep completed.")
+    return 0
+
+
+def expand_runs(config, name):
+    """
+    :param config: configuration, see main
+    :param name: name of the configuration's run, or the prefix of the names of its grid runs
+    :return: list of run dictionaries with the 'name', 'input_files', 'output_files' and 'rollup_options' of each
+             run. A Sweep_Grid option that names an Input_Files option replaces the input file, any other replaces a
+             Rollup_Options option. ValueError is raised if two runs of the grid would write the same output file,
+             i.e. if an Output_Files path does not contain {run}
+    """
+    input_files = config_helper.ConfigSectionMap(config, "Input_Files")
+    output_files = config_helper.ConfigSectionMap(config, "Output_Files")
+    rollup_options = config_helper.ConfigSectionMap(config, "Rollup_Options")
+    if not config.has_section("Sweep_Grid"):
+        return [_run(name, input_files, output_files, rollup_options)]
+
+    grid = config_helper.ConfigSectionMap(config, "Sweep_Grid")
+    keys = sorted(grid)
+    values = [[v.strip() for v in grid[k].split(GRID_SEP)] for k in keys]
+    runs = []
+    for i, combination in enumerate(itertools.product(*values)):
+        run_input_files = dict(input_files)
+        run_rollup_options = dict(rollup_options)
+        for k, v in zip(keys, combination):
+            if k in input_files:
+                run_input_files[k] = v
+            else:
+                run_rollup_options[k] = v
+        run_name = "{0}_{1:03d}".format(name, i)
+        print("Run {0}: {1}".format(run_name, ", ".join(["{0}={1}".format(k, v) for k, v in zip(keys, combination)])))
+        runs.append(_run(run_name, run_input_files, output_files, run_rollup_options))
+
+    # forked runs write their output concurrently, a file written by two runs would be overwritten or interleaved
+    writers = {}
+    for run in runs:
+        for key, path in run['output_files'].items():
+            if path in writers:
+                raise ValueError("Runs {0} and {1} both write {2} = {3}, output file paths of a Sweep_Grid "
+                                 "configuration must contain {{run}}".format(writers[path], run['name'], key, path))
+            writers[path] = run['name']
+    return runs
+
+
+def _run(name, input_files, output_files, rollup_options):
+    # {0} is left for the annotator count of checkpoint output
+    output_files = dict((k, v.replace('{run}', name)) for k, v in output_files.items())
+    return {'name': name, 'input_files': input_files, 'output_files': output_files, 'rollup_options': rollup_options}
+
+
+def _ontology_key(run):
+    """runs with the same key have the same ontology"""
+    return (run['input_files']['FILE_ONTOLOGY'], run['input_files']['FILE_ANNOTATIONS'],
+            run['rollup_options'].get('SKETCH_ERROR'))
+
+
+def available_memory():
+    """:return: bytes of memory available to new processes, or None if it is not known"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def max_concurrency(max_workers, run_memory):
+    """
+    :param max_workers: configured maximum number of concurrent runs, or None
+    :param run_memory: bytes of memory a run is expected to take
+    :return: number of runs to execute at a time, at most the number of cores and the number of runs that fit in
+             the available memory, and at least 1
+    """
+    workers = multiprocessing.cpu_count()
+    if max_workers is not None:
+        workers = min(workers, max_workers)
+    memory = available_memory()
+    if memory is not None and run_memory > 0:
+        workers = min(workers, memory // run_memory)
+    return max(1, int(workers))
+
+
+def run_all(ont, runs, direct_annotations, workers, log_dir=None):
+    """
+    Runs the rollups, at most workers at a time, each in a forked process. Runs do not change ont, a CompactOntology
+    (see run_rollup), so where processes cannot be forked they are executed one at a time in this process.
+    :param log_dir: optional directory in which the output printed by each run is stored as RUN_NAME.log
+    :return: list of the names of runs that failed
+    """
+    if log_dir is not None and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        failed = []
+        for run in runs:
+            try:
+                _execute(ont, run, direct_annotations, log_dir)
+            except Exception as e:
+                print("Run {0} failed: {1}".format(run['name'], e))
+                failed.append(run['name'])
+        return failed
+
+    context = multiprocessing.get_context('fork')
+    pending = list(runs)
+    running = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < workers:
+            run = pending.pop(0)
+            # the forked process inherits ont, so nothing is pickled, and only the overlay of its rollup is written to
+            process = context.Process(target=_execute, args=(ont, run, direct_annotations, log_dir),
+                                      name="rollup-{0}".format(run['name']))
+            process.start()
+            running[process.sentinel] = (process, run)
+        for sentinel in connection.wait(list(running)):
+            process, run = running.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                print("Run {0} failed with exit code {1}".format(run['name'], process.exitcode))
+                failed.append(run['name'])
+            else:
+                print("Run {0} completed".format(run['name']))
+    return failed
+
+
+def _execute(ont, run, direct_annotations, log_dir):
+    with contextlib.ExitStack() as stack:
+        if log_dir is not None:
+            log = stack.enter_context(open(os.path.join(log_dir, "{0}.log".format(run['name'])), 'w'))
+            stack.enter_context(contextlib.redirect_stdout(log))
+        for path in run['output_files'].values():
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+        run_rollup(ont, run['rollup_options'], run['input_files'], run['output_files'], direct_annotations)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+
+# objects are grouped into chunks of 2^16 consecutive indices, as in roaring bitmaps. A chunk holding at most
+# ARRAY_MAX_SIZE objects is stored as a sorted uint16 array, a denser chunk as a 2^16 bit bitmap
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+ARRAY_MAX_SIZE = 4096
+_BITMAP_BYTES = CHUNK_SIZE // 8
+
+# number of set bits in each possible byte
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+class ObjectBitmap:
+    """
+    Compressed set of non-negative integer object indices (e.g. interned object ids) supporting fast unions.
+
+    Each 2^16 index chunk is stored either as a sorted uint16 array (sparse chunks) or as a packed bitmap (dense
+    chunks), so memory is bounded by roughly 2 bytes per object for sparse sets and 1 bit per possible index for
+    dense ones. Unions of dense chunks are word-wise ORs.
+    """
+    def __init__(self):
+        # {chunk key: (container, cardinality)}, container is a uint16 array or a uint8 packed bitmap
+        self._chunks = {}
+
+    @classmethod
+    def from_indices(cls, indices):
+        """
+        :param indices: iterable or array of non-negative integer object indices, duplicates allowed
+        :return: ObjectBitmap containing the indices
+        """
+        bm = cls()
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        if not len(indices):
+            return bm
+        keys = indices >> CHUNK_BITS
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        for chunk in np.split(indices, bounds):
+            low = (chunk & (CHUNK_SIZE - 1)).astype(np.uint16)
+            bm._chunks[int(chunk[0] >> CHUNK_BITS)] = _container(low)
+        return bm
+
+    def __len__(self):
+        return sum([card for _, card in self._chunks.values()])
+
+    def __iter__(self):
+        return iter(self.to_indices().tolist())
+
+    def __ior__(self, other):
+        self.union_update(other)
+        return self
+
+    def __or__(self, other):
+        bm = self.copy()
+        bm.union_update(other)
+        return bm
+
+    def copy(self):
+        bm = ObjectBitmap()
+        bm._chunks = dict((k, (c.copy(), card)) for k, (c, card) in self._chunks.items())
+        return bm
+
+    def union_update(self, other):
+        """adds all objects in other to this bitmap"""
+        for key, (c, card) in other._chunks.items():
+            mine = self._chunks.get(key)
+            if mine is None:
+                self._chunks[key] = (c.copy(), card)
+            else:
+                self._chunks[key] = _union(mine[0], c)
+
+    def to_indices(self):
+        """returns: sorted int64 array of the object indices in the bitmap"""
+        parts = []
+        for key in sorted(self._chunks):
+            c = self._chunks[key][0]
+            low = c if c.dtype == np.uint16 else np.flatnonzero(np.unpackbits(c))
+            parts.append(low.astype(np.int64) + (key << CHUNK_BITS))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+
+def _is_bitmap(c):
+    return c.dtype == np.uint8
+
+
+def _to_bitmap(low):
+    bits = np.zeros(CHUNK_SIZE, dtype=bool)
+    bits[low] = True
+    return np.packbits(bits)
+
+
+def _container(low):
+    """:return: (container, cardinality) for a sorted array of unique uint16 values"""
+    if len(low) > ARRAY_MAX_SIZE:
+        return _to_bitmap(low), len(low)
+    return low, len(low)
+
+
+def _union(a, b):
+    if _is_bitmap(a) or _is_bitmap(b):
+        a = a if _is_bitmap(a) else _to_bitmap(a)
+        b = b if _is_bitmap(b) else _to_bitmap(b)
+        bm = np.bitwise_or(a.view(np.uint64), b.view(np.uint64)).view(np.uint8)
+        return bm, int(_POPCOUNT[bm].sum())
+    return _container(np.union1d(a, b).astype(np.uint16))
@@ -0,0 +1,79 @@
+__author__ = 'Aaron J Masino'
+
+import queue
+import threading
+import traceback
+
+_STOP = object()
+
+
+class CheckpointWriter:
+    """
+    Runs a checkpoint writing function on a background thread so a rollup can continue while checkpoint output is
+    serialized.
+
+    Submitted checkpoints are held in a bounded queue; submit blocks while max_pending checkpoints are waiting, which
+    bounds the memory held by snapshots. Checkpoints are written one at a time in submission order. Arguments must
+    not be modified after they are submitted (rollup.rollup passes snapshots to its checkpoint_hook for this reason).
+    close must be called, directly or by using the writer as a context manager, to flush pending writes; an
+    exception raised by the writing function is re-raised by the next submit, flush or close.
+    """
+    def __init__(self, write, max_pending=2):
+        """
+        :param write: callable that writes one checkpoint, called with the arguments passed to submit
+        :param max_pending: maximum number of submitted checkpoints waiting to be written
+        """
+        self._write = write
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def submit(self, *args, **kwargs):
+        """queues a checkpoint to be written, blocking while the queue is full"""
+        self._raise_error()
+        self._queue.put((args, kwargs))
+
+    def flush(self):
+        """waits for all submitted checkpoints to be written"""
+        if self._thread.is_alive():
+            self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """waits for all submitted checkpoints to be written and stops the background thread"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            try:
+                if self._error is not None:
+                    # stop writing after a failure, the error is reported to the submitting thread
+                    continue
+                args, kwargs = item
+                self._write(*args, **kwargs)
+            except Exception as e:
+                traceback.print_exc()
+                self._error = e
+            finally:
+                self._queue.task_done()
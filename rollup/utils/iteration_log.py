@@ -0,0 +1,121 @@
+__author__ = 'Aaron J Masino'
+
+import hashlib
+import os
+import struct
+from collections import namedtuple
+
+LOG_MAGIC = b'RLOG'
+LOG_FORMAT = 1
+
+# magic, format, number of concepts, sha1 of the concept ids
+_HEADER = struct.Struct('<4sHi20s')
+# leaf slot, leaf count, D, number of promoted parents, Gamma, SumSq, Psi; followed by the promoted parent slots
+_RECORD = struct.Struct('<iiiiddd')
+_SLOT = struct.Struct('<i')
+
+# one rollup iteration. Concepts are identified by slot, their position in Ontotology.concepts() before the rollup
+# started. gamma, sumsq and d are the rollup.models.scoring.ICStatistics values after the iteration
+IterationRecord = namedtuple('IterationRecord', ['leaf', 'promoted', 'leaf_count', 'gamma', 'sumsq', 'psi', 'd'])
+
+
+def concepts_digest(concepts):
+    """:return: sha1 digest of a list of concept ids, used to check a log belongs to an ontology"""
+    return hashlib.sha1("\n".join(concepts).encode("utf-8")).digest()
+
+
+class IterationLogWriter:
+    """
+    Appends a compact binary record of each rollup iteration to a file, so that an interrupted run can be resumed
+    by replaying the log (see read_iteration_log and rollup.models.rollup.rollup).
+
+    Records are buffered and only written to the file by flush. Once flush_freq records are pending they are flushed
+    by the next append, before its record is buffered, so a caller can write what an iteration produced before the
+    iteration reaches the file. A crash loses at most the unflushed iterations, and a partially written final record
+    is ignored when the log is read.
+    """
+    def __init__(self, file_path, concepts, resume=False, flush_freq=100):
+        """
+        :param file_path: log file
+        :param concepts: concept ids of the ontology in Ontotology.concepts() order, before any rollup
+        :param resume: if True and the file exists, append to it after its last complete record, otherwise a new
+               log is started
+        :param flush_freq: number of iterations between flushes of the file
+        """
+        self.flush_freq = flush_freq
+        self._buffer = bytearray()
+        self._pending = 0
+        if resume and os.path.exists(file_path):
+            _, end = _read_log(file_path, concepts)
+            self._f = open(file_path, 'r+b')
+            # drop a partially written record
+            self._f.truncate(end)
+            self._f.seek(end)
+        else:
+            self._f = open(file_path, 'wb')
+            self._f.write(_HEADER.pack(LOG_MAGIC, LOG_FORMAT, len(concepts), concepts_digest(concepts)))
+            self._f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def append(self, record):
+        """buffers an IterationRecord"""
+        if self._pending >= self.flush_freq:
+            self.flush()
+        self._buffer += _RECORD.pack(record.leaf, record.leaf_count, record.d, len(record.promoted),
+                                     record.gamma, record.sumsq, record.psi)
+        for s in record.promoted:
+            self._buffer += _SLOT.pack(s)
+        self._pending += 1
+
+    def flush(self):
+        """writes the buffered records to the file"""
+        self._f.write(self._buffer)
+        self._f.flush()
+        self._buffer = bytearray()
+        self._pending = 0
+
+    def close(self):
+        if not self._f.closed:
+            self.flush()
+            self._f.close()
+
+
+def read_iteration_log(file_path, concepts=None):
+    """
+    :param file_path: log written by IterationLogWriter
+    :param concepts: if given, concept ids of the ontology the log is replayed on; ValueError is raised if the log
+           was written for a different ontology
+    :return: list of IterationRecord in iteration order
+    """
+    records, _ = _read_log(file_path, concepts)
+    return records
+
+
+def _read_log(file_path, concepts):
+    """:return: (records, offset of the end of the last complete record)"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise ValueError("{0} is not a rollup iteration log".format(file_path))
+    magic, fmt, count, digest = _HEADER.unpack_from(data, 0)
+    if magic != LOG_MAGIC or fmt != LOG_FORMAT:
+        raise ValueError("{0} is not a rollup iteration log".format(file_path))
+    if concepts is not None and (count != len(concepts) or digest != concepts_digest(concepts)):
+        raise ValueError("Iteration log {0} was written for a different ontology".format(file_path))
+    records = []
+    pos = _HEADER.size
+    while pos + _RECORD.size <= len(data):
+        leaf, leaf_count, d, n, gamma, sumsq, psi = _RECORD.unpack_from(data, pos)
+        end = pos + _RECORD.size + n * _SLOT.size
+        if end > len(data):
+            break
+        promoted = struct.unpack_from('<{0}i'.format(n), data, pos + _RECORD.size)
+        records.append(IterationRecord(leaf, promoted, leaf_count, gamma, sumsq, psi, d))
+        pos = end
+    return records, pos
@@ -0,0 +1,106 @@
+__author__ = 'Aaron J Masino'
+
+import cProfile
+import json
+import pstats
+from collections import deque, namedtuple
+
+# metrics of one rollup iteration, see rollup.models.rollup.rollup metrics:
+#   iteration - iteration number, starting at 1
+#   d, lambda_, psi - direct annotator count, mean IC and IC stdev after the iteration
+#   leaf_count - size of the leaf frontier the leaf was selected from
+#   rescored - number of candidate leaves whose score was recomputed after the leaf was rolled
+#   scoring_seconds - time selecting the leaf and recomputing the changed candidate scores
+#   mutation_seconds - time promoting parents, removing the leaf from the ontology and updating the IC statistics
+#   mapping_seconds - time updating the rollup and rollup level dictionaries
+#   checkpoint_seconds - time in the checkpoint hook, 0 if no checkpoint was reached
+#   elapsed_seconds - time since the first iteration started
+IterationMetrics = namedtuple('IterationMetrics', ['iteration', 'd', 'lambda_', 'psi', 'leaf_count', 'rescored',
+                                                   'scoring_seconds', 'mutation_seconds', 'mapping_seconds',
+                                                   'checkpoint_seconds', 'elapsed_seconds'])
+
+
+class JsonlMetricsSink:
+    """Appends each IterationMetrics to a file as a JSON object per line, flushed every flush_freq iterations"""
+    def __init__(self, file_path, flush_freq=100):
+        self.flush_freq = flush_freq
+        self._pending = 0
+        self._f = open(file_path, 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def append(self, metrics):
+        self._f.write(json.dumps(metrics._asdict()) + "\n")
+        self._pending += 1
+        if self._pending >= self.flush_freq:
+            self._f.flush()
+            self._pending = 0
+
+    def close(self):
+        if not self._f.closed:
+            self._f.close()
+
+
+class RingBufferSink:
+    """Keeps the IterationMetrics of the last capacity iterations in memory"""
+    def __init__(self, capacity=10000):
+        self.records = deque(maxlen=capacity)
+
+    def append(self, metrics):
+        self.records.append(metrics)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+
+class CallbackSink:
+    """Calls callback with each IterationMetrics"""
+    def __init__(self, callback):
+        self.callback = callback
+
+    def append(self, metrics):
+        self.callback(metrics)
+
+
+class IterationProfiler:
+    """
+    Profiles the first iterations of a rollup with cProfile (see rollup.models.rollup.rollup profiler). The profile
+    covers everything run from the start of the first iteration to the end of the last profiled one, and is written
+    to file_path, if given, and kept in stats
+    """
+    def __init__(self, iterations, file_path=None):
+        """
+        :param iterations: number of iterations profiled
+        :param file_path: optional file the profile is dumped to (readable with pstats)
+        """
+        self.iterations = iterations
+        self.file_path = file_path
+        self.stats = None
+        self._profile = None
+
+    def start(self):
+        if self.iterations > 0 and self.stats is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def iteration_done(self, iteration):
+        """stops the profiler once iteration reaches the number of profiled iterations"""
+        if self._profile is not None and iteration >= self.iterations:
+            self.stop()
+
+    def stop(self):
+        if self._profile is None:
+            return
+        self._profile.disable()
+        self.stats = pstats.Stats(self._profile)
+        if self.file_path is not None:
+            self.stats.dump_stats(self.file_path)
+        self._profile = None
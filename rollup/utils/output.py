@@ -0,0 +1,53 @@
+__author__ = 'Aaron J Masino'
+
+import gzip
+
+# number of characters of output assembled in memory before they are written to the file
+DEFAULT_BUFFER_SIZE = 1 << 22
+
+
+def open_output(file_path):
+    """
+    opens an output file for appending text, gzip compressed if file_path ends with .gz (appending to a gzip file
+    adds a new gzip member, which gzip readers concatenate)
+    """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'at', encoding='utf-8')
+    return open(file_path, 'a+')
+
+
+def write_lines(lines, file_path, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Appends lines to file_path in the layout of all rollup output files: lines are separated by, but not terminated
+    with, a newline. Lines are consumed lazily and written in blocks of about buffer_size characters, so the output
+    never has to be held in memory as a whole.
+    :param lines: iterable of strings without newlines
+    :param file_path: location to store data, gzip compressed if it ends with .gz
+    :param buffer_size: number of characters assembled before a write
+    :return: number of lines written
+    """
+    count = 0
+    with open_output(file_path) as f:
+        block = []
+        size = 0
+        for line in lines:
+            block.append(line)
+            size += len(line) + 1
+            if size >= buffer_size:
+                f.write(("\n" if count else "") + "\n".join(block))
+                count += len(block)
+                block = []
+                size = 0
+        if block:
+            f.write(("\n" if count else "") + "\n".join(block))
+            count += len(block)
+    return count
+
+
+def key_values_line(key, values, sep=','):
+    """
+    :return: line of the form key:value_1,value_2,... or just key if values is empty
+    """
+    if not values:
+        return "{0}".format(key)
+    return "{0}:{1}".format(key, sep.join([str(v) for v in values]))
@@ -0,0 +1,233 @@
+__author__ = 'Aaron J Masino'
+
+import codecs
+import multiprocessing
+import numpy as np
+import os
+from array import array
+
+# bytes read from the annotation file at a time
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+
+class Interner:
+    """Assigns dense integer indices to ids (e.g. object ids) in order of first appearance"""
+    def __init__(self):
+        self.index = {}
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, s):
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.ids)
+            self.ids.append(s)
+        return i
+
+
+class DirectAnnotations:
+    """
+    Immutable, compact capture of the direct annotations in an annotation file.
+
+    Object ids are interned once and the objects of all rows are held in a single read-only int32 array with CSR
+    offsets per row, so the original annotations can be kept for a whole rollup run (e.g. to write rolled
+    annotations at every checkpoint) without re-reading the file or holding lists of strings.
+    """
+    def __init__(self, concept_ids, offsets, indices, object_ids):
+        """
+        :param concept_ids: concept id of each row, in file order
+        :param offsets: int64 array, the objects of row i are indices[offsets[i]:offsets[i+1]]
+        :param indices: int32 array of object indices into object_ids
+        :param object_ids: list of object ids
+        """
+        self.concept_ids = tuple(concept_ids)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.object_ids = tuple(object_ids)
+        self.offsets.flags.writeable = False
+        self.indices.flags.writeable = False
+
+    @classmethod
+    def from_file(cls, filename, chunk_size=DEFAULT_CHUNK_SIZE, processes=1):
+        """:return: DirectAnnotations for the annotation file, parsed with iter_annotations"""
+        interner = Interner()
+        concept_ids = []
+        offsets = [0]
+        indices = array('i')
+        for cid, row in iter_annotations(filename, interner, chunk_size, processes):
+            concept_ids.append(cid)
+            indices.frombytes(row.tobytes())
+            offsets.append(len(indices))
+        return cls(concept_ids, offsets, np.frombuffer(indices, dtype=np.int32), interner.ids)
+
+    def __len__(self):
+        return len(self.concept_ids)
+
+    def __iter__(self):
+        """:return: iterator of (concept_id, int32 array of object indices) in file order, like iter_annotations"""
+        for i, cid in enumerate(self.concept_ids):
+            yield cid, self.row(i)
+
+    def row(self, i):
+        return self.indices[self.offsets[i]:self.offsets[i + 1]]
+
+    def objects(self, indices):
+        """:return: list of the object ids for an array of object indices"""
+        return [self.object_ids[i] for i in indices]
+
+    def merged(self, other):
+        """
+        :param other: DirectAnnotations, e.g. of annotations added since these were read
+        :return: DirectAnnotations whose row for each concept holds the union of its objects in self and other.
+                 Concepts keep their position in self and those only in other follow in the order of other. As for a
+                 file, a concept on several rows of self is taken from its last row
+        """
+        object_ids = list(self.object_ids)
+        index = dict((o, i) for i, o in enumerate(object_ids))
+        for o in other.object_ids:
+            if o not in index:
+                index[o] = len(object_ids)
+                object_ids.append(o)
+        remap = np.array([index[o] for o in other.object_ids], dtype=np.int32)
+        rows = {}
+        for cid, row in self:
+            rows[cid] = row
+        for cid, row in other:
+            row = remap[row]
+            rows[cid] = np.union1d(rows[cid], row).astype(np.int32) if cid in rows else row
+        concept_ids = list(rows)
+        offsets = np.zeros(len(concept_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows[cid]) for cid in concept_ids])
+        indices = np.concatenate([rows[cid] for cid in concept_ids]) if concept_ids else np.zeros(0, dtype=np.int32)
+        return DirectAnnotations(concept_ids, offsets, indices, object_ids)
+
+
+def iter_annotations(filename, interner=None, chunk_size=DEFAULT_CHUNK_SIZE, processes=1):
+    """
+    Streams an annotation file with rows of the form concept_id: object_id_1, object_id_2, ...
+
+    The file is read in fixed size chunks and object ids are interned as they are read, so a row is never held in
+    memory as text and rows with millions of object ids are fine. Rows without a ':' are skipped. Values are parsed
+    as by str.split, i.e. each object id is stripped and text after a second ':' on a row is ignored.
+    :param filename: annotation file
+    :param interner: Interner used to assign object indices, a new one is created if None
+    :param chunk_size: number of bytes read at a time
+    :param processes: if greater than 1 the file is split into byte ranges at row boundaries that are parsed by a
+           pool of this many processes; rows are still yielded in file order
+    :return: generator of (concept_id, int32 array of object indices) tuples
+    """
+    if interner is None:
+        interner = Interner()
+    if processes <= 1:
+        for cid, indices in _parse_range(filename, 0, None, interner, chunk_size):
+            yield cid, indices
+        return
+
+    ranges = _row_aligned_ranges(filename, processes * 4)
+    pool = multiprocessing.Pool(processes)
+    try:
+        args = [(filename, start, end, chunk_size) for start, end in ranges]
+        for cids, offsets, local_indices, local_ids in pool.imap(_parse_range_local, args):
+            # map the range's own object indices to the shared interner
+            remap = np.array([interner.intern(o) for o in local_ids], dtype=np.int32)
+            for i, cid in enumerate(cids):
+                yield cid, remap[local_indices[offsets[i]:offsets[i + 1]]]
+    finally:
+        pool.terminate()
+
+
+def _parse_range(filename, start, end, interner, chunk_size):
+    """:return: generator of (concept_id, int32 array of object indices) for rows starting in [start, end)"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    cid = None          # concept id of the row being read, None while reading a concept id
+    skip_row = False    # True after a second ':' on a row
+    carry = ''          # incomplete concept or object id at the end of the previous chunk
+    indices = array('i')
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while True:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            data = f.read(size) if size else b''
+            if remaining is not None:
+                remaining -= len(data)
+            final = not data
+            buf = carry + decoder.decode(data, final)
+            carry = ''
+            pos = 0
+            n = len(buf)
+            while pos < n:
+                nl = buf.find('\n', pos)
+                if cid is None:
+                    colon = buf.find(':', pos, n if nl < 0 else nl)
+                    if colon < 0:
+                        if nl < 0:
+                            carry = buf[pos:]
+                            break
+                        # row without annotations
+                        pos = nl + 1
+                        continue
+                    cid = buf[pos:colon].strip()
+                    pos = colon + 1
+                    continue
+                row_end = n if nl < 0 else nl
+                if not skip_row:
+                    colon = buf.find(':', pos, row_end)
+                    segment = buf[pos:row_end if colon < 0 else colon]
+                    tokens = segment.split(',')
+                    if colon < 0 and nl < 0:
+                        # the last token may continue in the next chunk
+                        carry = tokens.pop()
+                    indices.extend([interner.intern(t.strip()) for t in tokens])
+                    skip_row = colon >= 0
+                if nl < 0:
+                    if skip_row:
+                        carry = ''
+                    break
+                yield cid, np.frombuffer(indices, dtype=np.int32).copy()
+                cid = None
+                skip_row = False
+                indices = array('i')
+                pos = nl + 1
+            if final:
+                break
+    if cid is not None:
+        if not skip_row:
+            indices.append(interner.intern(carry.strip()))
+        yield cid, np.frombuffer(indices, dtype=np.int32).copy()
+
+
+def _parse_range_local(args):
+    """pool worker: parses a byte range with its own interner"""
+    filename, start, end, chunk_size = args
+    interner = Interner()
+    cids = []
+    parts = []
+    offsets = [0]
+    for cid, indices in _parse_range(filename, start, end, interner, chunk_size):
+        cids.append(cid)
+        parts.append(indices)
+        offsets.append(offsets[-1] + len(indices))
+    local_indices = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+    return cids, offsets, local_indices, interner.ids
+
+
+def _row_aligned_ranges(filename, count):
+    """:return: list of (start, end) byte ranges covering the file, each starting at the beginning of a row"""
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as f:
+        for k in range(1, count):
+            target = max(size * k // count, bounds[-1])
+            f.seek(target)
+            if target:
+                # move to the start of the next row
+                f.seek(target - 1)
+                f.readline()
+            pos = f.tell()
+            if pos > bounds[-1] and pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
@@ -0,0 +1,109 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+from math import ceil, log
+
+# bounds on the number of index bits, 2^precision registers of one byte each
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+# relative standard error of estimated counts when none is given, 2^14 registers
+DEFAULT_SKETCH_ERROR = 0.01
+
+_HASH_BITS = 64
+_M1 = np.uint64(0xbf58476d1ce4e5b9)
+_M2 = np.uint64(0x94d049bb133111eb)
+
+
+def precision_for_error(relative_error):
+    """:return: smallest precision whose sketch has a relative standard error of at most relative_error"""
+    p = int(ceil(2 * log(1.04 / relative_error, 2)))
+    return min(max(p, MIN_PRECISION), MAX_PRECISION)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch estimating the number of unique non-negative integer object indices (e.g. interned object
+    ids) added to it, in 2^precision bytes regardless of the number of objects.
+
+    Sketches are merged with an element-wise maximum, so the sketch of a union is exact and propagation up the
+    ontology DAG is as cheap as for small sets. The relative standard error of an estimate is about
+    1.04 / sqrt(2^precision); small cardinalities are estimated by linear counting and an empty sketch estimates 0.
+    Supports the operations of rollup.utils.bitmap.ObjectBitmap used to build an ontology, with len giving the
+    estimate.
+    """
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @classmethod
+    def from_indices(cls, indices, precision=14):
+        """
+        :param indices: iterable or array of non-negative integer object indices, duplicates allowed
+        :param precision: number of index bits
+        :return: HyperLogLog of the indices
+        """
+        hll = cls(precision)
+        hll.add_indices(indices)
+        return hll
+
+    def add_indices(self, indices):
+        indices = np.asarray(indices, dtype=np.uint64)
+        if not len(indices):
+            return
+        h = _mix64(indices)
+        p = self.precision
+        buckets = (h >> np.uint64(_HASH_BITS - p)).astype(np.int64)
+        rest = h & np.uint64((1 << (_HASH_BITS - p)) - 1)
+        # position of the first set bit in the remaining hash bits, counted from the most significant one
+        ranks = (_HASH_BITS - p + 1 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def __len__(self):
+        m = float(len(self.registers))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[int(m)]
+        estimate = alpha * m * m / float(np.ldexp(1.0, -self.registers.astype(np.int64)).sum())
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * log(m / zeros)
+        return int(round(estimate))
+
+    def __ior__(self, other):
+        self.union_update(other)
+        return self
+
+    def __or__(self, other):
+        hll = self.copy()
+        hll.union_update(other)
+        return hll
+
+    def copy(self):
+        hll = HyperLogLog(self.precision)
+        hll.registers = self.registers.copy()
+        return hll
+
+    def union_update(self, other):
+        """merges the objects in other into this sketch"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+
+def _mix64(x):
+    """splitmix64 finalizer, spreads consecutive indices over all 64 bits"""
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9e3779b97f4a7c15)
+        x = (x ^ (x >> np.uint64(30))) * _M1
+        x = (x ^ (x >> np.uint64(27))) * _M2
+        return x ^ (x >> np.uint64(31))
+
+
+def _bit_length(x):
+    """:return: int64 array of the number of bits needed to represent each value of a uint64 array"""
+    x = x.copy()
+    length = np.zeros(len(x), dtype=np.int64)
+    for s in (32, 16, 8, 4, 2, 1):
+        high = x >= np.uint64(1 << s)
+        x[high] >>= np.uint64(s)
+        length[high] += s
+    return length + (x > 0)
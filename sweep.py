@@ -0,0 +1,7 @@
+__author__ = 'Aaron J Masino'
+
+import sys
+from rollup.sweep import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+__author__ = 'Aaron J Masino'
+
+import configparser
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+# generated inputs shared by the rollup tests, rolled down to DATASET_ANNOTATORS direct annotators
+DATASET_CONCEPTS = 300
+DATASET_ANNOTATORS = 10
+
+# text outputs of main.py configurations written by write_config, at the checkpoint and after the rollup
+OUTPUTS = ['rollup_{0}.txt', 'levels_{0}.txt', 'ontology_{0}.txt', 'annotations_{0}.txt']
+
+
+def write_config(path, input_files, output_dir, output_files=None, sections=None, **options):
+    """
+    Writes a main.py configuration of the input files with all text outputs in output_dir
+    :param output_files: optional further Output_Files options
+    :param sections: optional dictionary {section name: options} of further sections
+    :param options: Rollup_Options options replacing the defaults
+    :return: path of the configuration
+    """
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config['Input_Files'] = {'FILE_ONTOLOGY': input_files[0], 'FILE_ANNOTATIONS': input_files[1]}
+    config['Output_Files'] = dict((key, str(output_dir / name)) for key, name in
+                                  zip(['FILE_ROLLUP', 'FILE_ROLLUP_LEVELS', 'FILE_ONTOLOGY', 'FILE_ANNOTATIONS'],
+                                      OUTPUTS))
+    config['Output_Files'].update(output_files or {})
+    rollup_options = {'TOTAL_ANNOTATORS_AFTER_ROLLUP': str(DATASET_ANNOTATORS), 'MAXIMUM_ITERATIONS': '50000',
+                      'PRINT_STATUS_FREQ': '1000000', 'CHECK_POINTS': '20'}
+    rollup_options.update(options)
+    config['Rollup_Options'] = rollup_options
+    config.read_dict(sections or {})
+    with open(str(path), 'w') as f:
+        config.write(f)
+    return str(path)
+
+
+def read_outputs(output_dir, annotators=DATASET_ANNOTATORS):
+    """:return: dictionary {file name: text} of the outputs at the checkpoint and after the rollup"""
+    return dict((name.format(d), (output_dir / name.format(d)).read_text()) for name in OUTPUTS
+                for d in (20, annotators))
+
+
+@pytest.fixture
+def write_inputs(tmp_path):
+    """:return: function writing ontology and annotation lines to files in tmp_path and returning their paths"""
+    def write(ontology_lines, annotation_lines, prefix=''):
+        ontology_file = tmp_path / (prefix + 'ontology.txt')
+        annotations_file = tmp_path / (prefix + 'annotations.txt')
+        ontology_file.write_text("\n".join(ontology_lines))
+        annotations_file.write_text("\n".join(annotation_lines))
+        return str(ontology_file), str(annotations_file)
+    return write
+
+
+@pytest.fixture
+def quiet():
+    """context manager discarding printed status output"""
+    return lambda: contextlib.redirect_stdout(io.StringIO())
+
+
+@pytest.fixture(scope='session')
+def dataset(tmp_path_factory):
+    """:return: (ontology path, annotation path) of a small generated ontology, see benchmarks/generate.py"""
+    import generate
+    return generate.write_dataset(str(tmp_path_factory.mktemp('dataset')), DATASET_CONCEPTS, seed=1)
+
+
+@pytest.fixture
+def build(quiet):
+    """:return: function building a fresh ontology of input files with the given backend ('networkx', 'bitmap' for
+    networkx with bitmap object sets, or 'compact')"""
+    from rollup.models import ontology
+
+    def build_ontology(paths, backend='networkx'):
+        factory = ontology.OntologyFactory()
+        with quiet():
+            if backend == 'compact':
+                return factory.build_compact_ontology_from_files(*paths)
+            if backend == 'bitmap':
+                return factory.build_ontology_from_files(*paths, object_sets='bitmap')
+            return factory.build_ontology_from_files(*paths)
+    return build_ontology
+
+
+@pytest.fixture
+def run(quiet):
+    """:return: function running rollup.rollup quietly down to DATASET_ANNOTATORS annotators"""
+    from rollup.models import rollup
+
+    def run_rollup(ont, desired_annotators=DATASET_ANNOTATORS, max_iters=50000, **kwargs):
+        with quiet():
+            return rollup.rollup(ont, desired_annotators, max_iters, print_freq=10 ** 9, **kwargs)
+    return run_rollup
@@ -0,0 +1,37 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+
+from rollup.utils.bitmap import ARRAY_MAX_SIZE, CHUNK_SIZE, ObjectBitmap
+
+
+def test_from_indices_round_trip_across_chunks():
+    indices = [5, 3, 3, CHUNK_SIZE + 1, 3 * CHUNK_SIZE]
+    bm = ObjectBitmap.from_indices(indices)
+    assert len(bm) == 4
+    assert bm.to_indices().tolist() == sorted(set(indices))
+    assert list(bm) == sorted(set(indices))
+    assert len(ObjectBitmap.from_indices([])) == 0
+
+
+def test_union_of_sparse_chunks_becomes_dense():
+    rng = np.random.RandomState(0)
+    a = rng.choice(CHUNK_SIZE, ARRAY_MAX_SIZE, replace=False)
+    b = rng.choice(CHUNK_SIZE, ARRAY_MAX_SIZE, replace=False)
+    expected = np.union1d(a, b)
+    union = ObjectBitmap.from_indices(a) | ObjectBitmap.from_indices(b)
+    assert len(union) == len(expected)
+    assert union.to_indices().tolist() == expected.tolist()
+    # dense with sparse
+    union |= ObjectBitmap.from_indices([1, CHUNK_SIZE - 1])
+    assert union.to_indices().tolist() == np.union1d(expected, [1, CHUNK_SIZE - 1]).tolist()
+
+
+def test_or_does_not_change_operands():
+    a = ObjectBitmap.from_indices([1, 2])
+    b = ObjectBitmap.from_indices([2, 3])
+    assert (a | b).to_indices().tolist() == [1, 2, 3]
+    assert a.to_indices().tolist() == [1, 2]
+    c = a.copy()
+    c.union_update(b)
+    assert a.to_indices().tolist() == [1, 2] and len(c) == 3
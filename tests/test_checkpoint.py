@@ -0,0 +1,77 @@
+__author__ = 'Aaron J Masino'
+
+import threading
+
+import pytest
+
+from rollup.main import log_checkpoint, submit_checkpoint
+from rollup.utils.checkpoint import CheckpointWriter
+from rollup.utils.iteration_log import IterationLogWriter, IterationRecord, read_iteration_log
+
+
+def test_checkpoints_are_written_in_submission_order():
+    written = []
+    with CheckpointWriter(lambda *args, **kwargs: written.append((args, kwargs)), max_pending=1) as writer:
+        for d in (400, 200, 100):
+            writer.submit(d, name=str(d))
+    assert written == [((d,), {'name': str(d)}) for d in (400, 200, 100)]
+
+
+def test_write_error_is_raised_by_close():
+    def fail(d):
+        raise IOError("disk full")
+    writer = CheckpointWriter(fail)
+    writer.submit(1)
+    with pytest.raises(IOError):
+        writer.close()
+
+
+def test_flush_waits_for_submitted_checkpoints():
+    release = threading.Event()
+    written = []
+
+    def write(d):
+        release.wait()
+        written.append(d)
+    with CheckpointWriter(write) as writer:
+        writer.submit(1)
+        threading.Timer(0.05, release.set).start()
+        writer.flush()
+        assert written == [1]
+
+
+def test_checkpoint_is_written_before_its_iteration_is_logged(tmp_path):
+    path = str(tmp_path / 'log.bin')
+    logged = []
+
+    def write(d):
+        # the iteration reaching checkpoint d must not be in the log while the checkpoint is written
+        logged.append(len(read_iteration_log(path)))
+    with CheckpointWriter(write) as writer, IterationLogWriter(path, ['A', 'B'], flush_freq=1) as log:
+        for d in (2, 1):
+            log.append(IterationRecord(0, (), 1, 1.0, 1.0, 0.0, d))
+            log_checkpoint(lambda *args: writer.submit(args[0]), writer, log, d)
+            assert len(read_iteration_log(path)) == 3 - d
+    assert logged == [0, 1]
+
+
+class _Ontology:
+    snapshots = 0
+
+    def serialization_snapshot(self):
+        self.snapshots += 1
+        return self
+
+
+@pytest.mark.parametrize('snapshot_ontology', [True, False])
+def test_submit_checkpoint_snapshots_only_a_written_ontology(snapshot_ontology):
+    ont = _Ontology()
+    saved = []
+    trajectories = {'psis': [1.0]}
+    with CheckpointWriter(lambda *args, **kwargs: saved.append((args, kwargs))) as writer:
+        submit_checkpoint(10, {}, {}, [], [], ont, None, writer, trajectories, snapshot_ontology)
+        trajectories['psis'].append(0.5)
+    args, kwargs = saved[0]
+    assert ont.snapshots == int(snapshot_ontology)
+    assert args[5] is (ont if snapshot_ontology else None)
+    assert kwargs['trajectories'] == {'psis': [1.0]}
@@ -0,0 +1,32 @@
+__author__ = 'Aaron J Masino'
+
+import networkx as nx
+import pytest
+
+from rollup.models import closure
+
+
+def test_closure_matches_graph_traversal(dataset, build):
+    ont = build(dataset)
+    index = closure.ClosureIndex.from_ontology(ont)
+    for cid in ont.concepts():
+        assert set(index.ancestors(cid)) == nx.descendants(ont.graph, cid)
+        assert set(index.descendants(cid)) == nx.ancestors(ont.graph, cid)
+    root = ont.root_nodes()[0]
+    leaf = ont.leaf_nodes()[0]
+    assert index.is_ancestor(root, leaf) and index.is_descendant(leaf, root)
+    assert index.longest_path(leaf, root) == index.depth(leaf)
+    assert index.depth(leaf) == max(len(p) - 1 for p in nx.all_simple_paths(ont.graph, leaf, root))
+
+
+@pytest.mark.parametrize('backend', ['networkx', 'compact'])
+def test_closure_levels_and_descendants_during_rollup(dataset, build, run, backend):
+    index = closure.ClosureIndex.from_ontology(build(dataset, backend))
+    ont = build(dataset, backend)
+    rollups, levels, _, _ = run(ont, closure=index)
+    assert levels == index.rollup_levels(rollups)
+    assert all(levels[k] >= 1 for k, targets in rollups.items() if targets != [k])
+    # the index of the original graph answers descendant queries for the concepts that remain
+    traversed = dict((cid, sorted(ont.descendant_concepts(cid))) for cid in ont.concepts())
+    ont.set_closure_index(index)
+    assert dict((cid, sorted(ont.descendant_concepts(cid))) for cid in ont.concepts()) == traversed
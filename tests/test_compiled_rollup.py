@@ -0,0 +1,59 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+import pytest
+
+from rollup.models import rollup
+from rollup.models.compiled_rollup import CompiledRollup, read_rollups
+
+ROLLUPS = {'C': ['A', 'B'], 'D': ['B'], 'B': ['B'], 'A': ['A']}
+
+
+def test_empty_rollup_keeps_every_row():
+    targets, repeats = CompiledRollup({}).apply(['A', 'B', 'A'])
+    assert list(targets) == ['A', 'B', 'A']
+    assert list(repeats) == [1, 1, 1]
+
+
+def test_empty_rollup_drops_every_row():
+    targets, repeats = CompiledRollup({}).apply(['A', 'B'], unknown='drop')
+    assert len(targets) == 0
+    assert list(repeats) == [0, 0]
+
+
+def test_empty_rollup_raises_for_unknown_concept():
+    with pytest.raises(KeyError):
+        CompiledRollup({}).apply(['A'], unknown='error')
+
+
+def test_empty_rollup_with_no_rows():
+    targets, repeats = CompiledRollup({}).apply(np.zeros(0, dtype=str), unknown='error')
+    assert len(targets) == 0 and len(repeats) == 0
+
+
+def test_apply_maps_rows_to_their_targets():
+    compiled = CompiledRollup(ROLLUPS)
+    assert len(compiled) == 4 and 'C' in compiled and 'X' not in compiled
+    targets, repeats = compiled.apply(['D', 'X', 'C', 'A'])
+    assert list(targets) == ['B', 'X', 'A', 'B', 'A']
+    assert list(repeats) == [1, 1, 2, 1]
+    # other columns are aligned with numpy.repeat
+    assert list(np.repeat([1, 2, 3, 4], repeats)) == [1, 2, 3, 3, 4]
+
+    targets, repeats = compiled.apply(['X', 'C'], unknown='drop')
+    assert list(targets) == ['A', 'B'] and list(repeats) == [0, 2]
+    with pytest.raises(KeyError):
+        compiled.apply(['X'], unknown='error')
+    with pytest.raises(ValueError):
+        compiled.apply(['C'], unknown='ignore')
+
+
+@pytest.mark.parametrize('name', ['rollup.txt', 'rollup.txt.gz'])
+def test_compiled_from_rollup_outputs(tmp_path, name):
+    path = str(tmp_path / name)
+    rollup.serialize_rollups(ROLLUPS, path)
+    assert read_rollups(path) == ROLLUPS
+    assert list(CompiledRollup.from_file(path).apply(['C'])[0]) == ['A', 'B']
+
+    rollup.save_rollup_arrays(str(tmp_path / 'arrays'), ROLLUPS, dict((k, 1) for k in ROLLUPS))
+    assert list(CompiledRollup.from_arrays(str(tmp_path / 'arrays')).apply(['C', 'D'])[0]) == ['A', 'B', 'B']
@@ -0,0 +1,30 @@
+__author__ = 'Aaron J Masino'
+
+from conftest import DATASET_ANNOTATORS
+from rollup.models import equivalence
+
+
+def test_registered_engines_match_the_reference(dataset):
+    results = equivalence.check_engines(dataset[0], dataset[1], DATASET_ANNOTATORS)
+    assert sorted(results) == sorted(equivalence.ENGINES)
+    assert results == dict((name, None) for name in equivalence.ENGINES)
+
+
+def test_first_divergence_reports_the_first_difference(dataset):
+    reference = equivalence.reference_engine(dataset[0], dataset[1], DATASET_ANNOTATORS, 50000)
+    assert equivalence.first_divergence(reference, reference) is None
+
+    leaves = list(reference.leaves)
+    leaves[2] = 'X'
+    divergence = equivalence.first_divergence(reference, reference._replace(leaves=leaves))
+    assert (divergence.iteration, divergence.field, divergence.actual) == (3, 'leaf', 'X')
+
+    trajectories = dict((k, list(v)) for k, v in reference.trajectories.items())
+    trajectories['psis'][5] += 1e-3
+    divergence = equivalence.first_divergence(reference, reference._replace(trajectories=trajectories))
+    assert (divergence.iteration, divergence.field, divergence.kind) == (5, 'psi', 'value')
+
+    rollups = dict(reference.rollups)
+    rollups[leaves[0]] = ['X']
+    divergence = equivalence.first_divergence(reference, reference._replace(rollups=rollups))
+    assert divergence.field == 'rollups[{0}]'.format(leaves[0])
@@ -0,0 +1,35 @@
+__author__ = 'Aaron J Masino'
+
+import generate
+
+
+def _read(paths):
+    return [open(path).read() for path in paths]
+
+
+def test_datasets_are_seeded(tmp_path):
+    a = _read(generate.write_dataset(str(tmp_path / 'a'), 200, seed=3))
+    b = _read(generate.write_dataset(str(tmp_path / 'b'), 200, seed=3))
+    c = _read(generate.write_dataset(str(tmp_path / 'c'), 200, seed=4))
+    assert a == b
+    assert a != c
+
+
+def test_parents_are_on_higher_levels():
+    levels, parents = generate.generate_ontology(500, seed=2)
+    assert parents[0] == [] and levels[0] == 0
+    assert all(0 < len(ps) and all(levels[p] < levels[c] for p in ps) for c, ps in enumerate(parents) if c > 0)
+    annotations = generate.generate_annotations(parents, 1000, seed=2)
+    leaves = set(range(500)) - set(p for ps in parents for p in ps)
+    assert leaves <= set(annotations)
+    assert all(0 < len(objects) and objects.max() < 1000 for objects in annotations.values())
+
+
+def test_main_passes_the_shape_options(tmp_path, quiet):
+    with quiet():
+        assert generate.main(['generate.py', str(tmp_path / 'a'), '200', '300', '5', '--depth', '3',
+                              '--multi-parent-rate', '0', '--zipf-exponent', '1.5']) == 0
+    expected = generate.write_dataset(str(tmp_path / 'b'), 200, 300, 5, depth=3, multi_parent_rate=0.0,
+                                      zipf_exponent=1.5)
+    assert _read([str(tmp_path / 'a' / name) for name in ('ontology.txt', 'annotations.txt')]) == _read(expected)
+    assert _read(expected) != _read(generate.write_dataset(str(tmp_path / 'c'), 200, 300, 5))
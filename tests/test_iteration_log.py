@@ -0,0 +1,73 @@
+__author__ = 'Aaron J Masino'
+
+import pytest
+
+from rollup.utils import iteration_log
+from rollup.utils.iteration_log import IterationLogWriter, IterationRecord, read_iteration_log
+
+CONCEPTS = ['A', 'B', 'C', 'D']
+RECORDS = [IterationRecord(3, (1,), 2, 4.5, 0.25, 0.5, 3), IterationRecord(1, (), 1, 3.0, 0.125, 0.25, 2)]
+
+
+def test_log_round_trip(tmp_path):
+    path = str(tmp_path / 'log.bin')
+    with IterationLogWriter(path, CONCEPTS, flush_freq=1) as log:
+        for record in RECORDS:
+            log.append(record)
+    assert read_iteration_log(path, CONCEPTS) == RECORDS
+    with pytest.raises(ValueError):
+        read_iteration_log(path, CONCEPTS[::-1])
+
+
+def test_appended_record_is_written_by_the_next_flush(tmp_path):
+    path = str(tmp_path / 'log.bin')
+    with IterationLogWriter(path, CONCEPTS, flush_freq=1) as log:
+        log.append(RECORDS[0])
+        assert read_iteration_log(path) == []
+        log.append(RECORDS[1])
+        assert read_iteration_log(path) == RECORDS[:1]
+        log.flush()
+        assert read_iteration_log(path) == RECORDS
+
+
+def test_partial_record_is_ignored_and_dropped_on_resume(tmp_path):
+    path = str(tmp_path / 'log.bin')
+    with IterationLogWriter(path, CONCEPTS) as log:
+        for record in RECORDS:
+            log.append(record)
+    with open(path, 'ab') as f:
+        f.write(b'\x01\x02\x03')
+    assert read_iteration_log(path) == RECORDS
+    with IterationLogWriter(path, CONCEPTS, resume=True) as log:
+        log.append(RECORDS[0])
+    assert read_iteration_log(path) == RECORDS + RECORDS[:1]
+
+
+def test_not_a_log(tmp_path):
+    path = tmp_path / 'log.bin'
+    path.write_bytes(b'not a log at all, not a log at all')
+    with pytest.raises(ValueError):
+        read_iteration_log(str(path))
+    assert iteration_log.concepts_digest(CONCEPTS) != iteration_log.concepts_digest(CONCEPTS[:3])
+
+
+@pytest.mark.parametrize('backend', ['networkx', 'compact'])
+def test_resumed_rollup_is_identical(dataset, build, run, tmp_path, backend):
+    expected_trajectories = {}
+    expected = run(build(dataset, backend), trajectories=expected_trajectories)
+
+    path = str(tmp_path / 'log.bin')
+    ont = build(dataset, backend)
+    with IterationLogWriter(path, ont.concepts()) as log:
+        run(ont, max_iters=25, iteration_log=log)
+
+    # a new run replays the log on a freshly built ontology and continues
+    ont = build(dataset, backend)
+    replay = read_iteration_log(path, ont.concepts())
+    assert len(replay) == 25
+    trajectories = {}
+    with IterationLogWriter(path, ont.concepts(), resume=True) as log:
+        resumed = run(ont, iteration_log=log, replay=replay, trajectories=trajectories)
+    assert resumed == expected
+    assert trajectories == expected_trajectories
+    assert len(read_iteration_log(path)) == len(expected_trajectories['annotator_counts'])
@@ -0,0 +1,91 @@
+__author__ = 'Aaron J Masino'
+
+import pytest
+
+from conftest import DATASET_ANNOTATORS, read_outputs, write_config
+from rollup import main
+
+
+@pytest.mark.parametrize('options', [{'ONTOLOGY_BACKEND': 'compact'}, {'OBJECT_SETS': 'bitmap'},
+                                     {'ONTOLOGY_BACKEND': 'compact', 'ASYNC_CHECKPOINTS': 'false'},
+                                     {'COUNT_ONLY': 'true'}, {'CLOSURE_INDEX': 'true'}])
+def test_backends_write_the_same_output(dataset, quiet, tmp_path, options):
+    for name, backend_options in (('expected', {}), ('actual', options)):
+        (tmp_path / name).mkdir()
+        config = write_config(tmp_path / (name + '.ini'), dataset, tmp_path / name, **backend_options)
+        with quiet():
+            main.main(['main.py', config])
+    actual = read_outputs(tmp_path / 'actual')
+    expected = read_outputs(tmp_path / 'expected')
+    if 'CLOSURE_INDEX' in options:
+        # levels are then longest paths in the original ontology rather than counts of rollup moves, see README
+        for outputs in (actual, expected):
+            for d in (20, DATASET_ANNOTATORS):
+                del outputs['levels_{0}.txt'.format(d)]
+    assert actual == expected
+
+
+@pytest.mark.parametrize('backend', ['networkx', 'compact'])
+def test_resume_writes_the_same_output(dataset, quiet, tmp_path, backend):
+    for name in ('expected', 'interrupted', 'actual'):
+        (tmp_path / name).mkdir()
+    with quiet():
+        main.main(['main.py', write_config(tmp_path / 'expected.ini', dataset, tmp_path / 'expected',
+                                           ONTOLOGY_BACKEND=backend)])
+    # an interrupted run stops after 30 iterations, the resumed run replays its log and continues
+    log = {'FILE_ITERATION_LOG': str(tmp_path / 'iterations.bin')}
+    with quiet():
+        main.main(['main.py', write_config(tmp_path / 'interrupted.ini', dataset, tmp_path / 'interrupted', log,
+                                           ONTOLOGY_BACKEND=backend, MAXIMUM_ITERATIONS='30')])
+    with quiet() as out:
+        main.main(['main.py', write_config(tmp_path / 'actual.ini', dataset, tmp_path / 'actual', log,
+                                           ONTOLOGY_BACKEND=backend), '--resume'])
+    assert "Resuming from 30 logged iterations" in out.getvalue()
+    assert read_outputs(tmp_path / 'actual') == read_outputs(tmp_path / 'expected')
+
+
+def test_run_rollup_does_not_change_a_compact_ontology(dataset, build, quiet, tmp_path):
+    ont = build(dataset, 'compact')
+    config = main.config_helper.loadConfig(write_config(tmp_path / 'config.ini', dataset, tmp_path))
+    sections = [main.config_helper.ConfigSectionMap(config, s) for s in ('Rollup_Options', 'Input_Files',
+                                                                         'Output_Files')]
+    for _ in range(2):
+        with quiet():
+            main.run_rollup(ont, *sections)
+        assert len(ont.concepts()) == len(build(dataset, 'compact').concepts())
+        assert ont.total_annotators() == build(dataset, 'compact').total_annotators()
+
+
+def test_run_rollup_rolls_a_networkx_ontology_in_place(dataset, build, quiet, tmp_path):
+    ont = build(dataset)
+    config = main.config_helper.loadConfig(write_config(tmp_path / 'config.ini', dataset, tmp_path))
+    with quiet():
+        main.run_rollup(ont, *[main.config_helper.ConfigSectionMap(config, s) for s in
+                               ('Rollup_Options', 'Input_Files', 'Output_Files')])
+    assert ont.total_annotators() == DATASET_ANNOTATORS
+
+
+def test_warm_start_writes_the_output_of_a_cold_run(dataset, quiet, tmp_path):
+    delta = {'C5': ['N1', 'N2'], 'C17': ['N3', 'V1']}
+    (tmp_path / 'delta.txt').write_text("\n".join(k + ':' + ','.join(v) for k, v in delta.items()))
+    with open(dataset[1]) as f:
+        rows = [line.split(':') for line in f.read().split("\n")]
+    union = dict((cid, objects.split(',')) for cid, objects in rows)
+    for cid, objects in delta.items():
+        union[cid] = sorted(set(union.get(cid, []) + objects))
+    (tmp_path / 'union.txt').write_text("\n".join(k + ':' + ','.join(v) for k, v in union.items()))
+
+    for name in ('cold', 'previous', 'warm'):
+        (tmp_path / name).mkdir()
+    log = str(tmp_path / 'iterations.bin')
+    warm_start = {'SNAPSHOT_DIR': str(tmp_path / 'snapshot'), 'FILE_ANNOTATIONS_DELTA': str(tmp_path / 'delta.txt'),
+                  'PREVIOUS_ANNOTATIONS': dataset[1], 'ITERATION_LOG': log}
+    with quiet():
+        main.main(['main.py', write_config(tmp_path / 'cold.ini', (dataset[0], str(tmp_path / 'union.txt')),
+                                           tmp_path / 'cold')])
+        main.main(['main.py', write_config(tmp_path / 'previous.ini', dataset, tmp_path / 'previous',
+                                           {'FILE_ITERATION_LOG': log}, ONTOLOGY_BACKEND='compact')])
+        main.ontology.OntologyFactory().build_compact_ontology_from_files(*dataset).save(warm_start['SNAPSHOT_DIR'])
+        main.main(['main.py', write_config(tmp_path / 'warm.ini', dataset, tmp_path / 'warm',
+                                           sections={'Warm_Start': warm_start})])
+    assert read_outputs(tmp_path / 'warm') == read_outputs(tmp_path / 'cold')
@@ -0,0 +1,162 @@
+__author__ = 'Aaron J Masino'
+
+import networkx as nx
+import pytest
+
+from rollup.models import compact
+from rollup.models import ontology
+
+DUPLICATE_PARENT_ONTOLOGY = ['A', 'B:A', 'C:A,A', 'D:B,C']
+DUPLICATE_PARENT_ANNOTATIONS = ['C:o1', 'D:o2,o3']
+EXPECTED_COUNTS = {'A': 3, 'B': 2, 'C': 3, 'D': 2}
+
+
+def _counts(ont):
+    return dict((c, ont.annotated_object_count(c)) for c in ont.concepts())
+
+
+def _read(path):
+    with open(path) as f:
+        return dict((line.split(':')[0], line.split(':')[1].split(',') if ':' in line else [])
+                    for line in f.read().split("\n"))
+
+
+def test_annotation_counts_are_unions_over_descendants(dataset, build):
+    ont = build(dataset)
+    direct = _read(dataset[1])
+    graph = nx.DiGraph()
+    for c, parents in _read(dataset[0]).items():
+        graph.add_node(c)
+        graph.add_edges_from((c, p) for p in parents)
+    for c in graph.nodes():
+        objects = set(direct.get(c, []))
+        for d in nx.ancestors(graph, c):
+            objects.update(direct.get(d, []))
+        assert set(ont.graph.node[c][ont.annotated_objects_key]) == objects
+    assert ont.total_annotated_objects() == len(set(o for objects in direct.values() for o in objects))
+
+
+@pytest.mark.parametrize('object_sets', ['list', 'bitmap'])
+def test_networkx_builder_accepts_duplicate_parent(write_inputs, quiet, object_sets):
+    paths = write_inputs(DUPLICATE_PARENT_ONTOLOGY, DUPLICATE_PARENT_ANNOTATIONS)
+    with quiet():
+        ont = ontology.OntologyFactory().build_ontology_from_files(*paths, object_sets=object_sets)
+    assert _counts(ont) == EXPECTED_COUNTS
+    assert ont.parent_concepts('C') == ['A']
+    assert ont.total_annotated_objects() == 3
+
+
+def test_compact_builder_accepts_duplicate_parent(write_inputs, quiet):
+    paths = write_inputs(DUPLICATE_PARENT_ONTOLOGY, DUPLICATE_PARENT_ANNOTATIONS)
+    with quiet():
+        ont = ontology.OntologyFactory().build_compact_ontology_from_files(*paths)
+    assert _counts(ont) == EXPECTED_COUNTS
+    assert ont.parent_concepts('C') == ['A']
+
+
+@pytest.mark.parametrize('backend', ['bitmap', 'compact'])
+def test_backends_build_the_same_ontology(dataset, build, backend):
+    expected = build(dataset)
+    ont = build(dataset, backend)
+    assert ont.concepts() == expected.concepts()
+    assert _counts(ont) == _counts(expected)
+    assert ont.annotators() == expected.annotators()
+    assert ont.total_annotated_objects() == expected.total_annotated_objects()
+    assert sorted(ont.leaf_nodes()) == sorted(expected.leaf_nodes())
+    assert all(ont.parent_concepts(c) == expected.parent_concepts(c) for c in ont.concepts())
+
+
+@pytest.mark.parametrize('sketch_error', [None, 0.01])
+def test_count_only_and_sketch_counts(dataset, build, quiet, sketch_error):
+    expected = _counts(build(dataset))
+    with quiet():
+        ont = ontology.OntologyFactory().build_ontology_from_files(*dataset, count_only=True,
+                                                                   sketch_error=sketch_error)
+    counts = _counts(ont)
+    if sketch_error is None:
+        assert counts == expected
+    else:
+        assert all(abs(counts[c] - n) <= max(2, 5 * sketch_error * n) for c, n in expected.items())
+
+
+def test_compact_sketch_counts(dataset, build, quiet):
+    expected = _counts(build(dataset))
+    with quiet():
+        counts = _counts(ontology.OntologyFactory().build_compact_ontology_from_files(*dataset, sketch_error=0.01))
+    assert all(abs(counts[c] - n) <= max(2, 0.05 * n) for c, n in expected.items())
+
+
+@pytest.mark.parametrize('backend', ['networkx', 'compact'])
+def test_leaf_frontier_follows_removals(dataset, build, backend):
+    ont = build(dataset, backend)
+    frontier = ont.leaf_frontier()
+    for _ in range(50):
+        leaf = sorted(frontier)[0]
+        exposed = ont.remove_concept(leaf)
+        assert leaf not in frontier and set(exposed) <= frontier
+        assert frontier == set(ont.leaf_nodes())
+
+
+def test_snapshot_round_trip(dataset, build, tmp_path):
+    ont = build(dataset, 'compact')
+    ont.save(str(tmp_path / 'snapshot'))
+    loaded = compact.CompactOntology.load(str(tmp_path / 'snapshot'))
+    assert loaded.concepts() == ont.concepts()
+    assert _counts(loaded) == _counts(ont)
+    assert loaded.annotators() == ont.annotators()
+    assert all(loaded.parent_concepts(c) == ont.parent_concepts(c) for c in ont.concepts())
+
+
+def test_snapshot_cache_is_reused_until_an_input_changes(write_inputs, quiet, tmp_path):
+    paths = write_inputs(['A', 'B:A', 'C:B'], ['C:o1', 'B:o2'])
+    cache_dir = str(tmp_path / 'cache')
+    factory = ontology.OntologyFactory()
+    for expected in ('Storing', 'Loading'):
+        with quiet() as out:
+            ont = factory.load_or_build_compact_ontology(paths[0], paths[1], cache_dir)
+        assert expected in out.getvalue()
+        assert _counts(ont) == {'A': 2, 'B': 2, 'C': 1}
+    with quiet() as out:
+        factory.load_or_build_compact_ontology(paths[0], paths[1], cache_dir, force_rebuild=True)
+    assert 'Storing' in out.getvalue()
+
+    with open(paths[1], 'a') as f:
+        f.write("\nA:o3")
+    with quiet() as out:
+        ont = factory.load_or_build_compact_ontology(paths[0], paths[1], cache_dir)
+    assert 'Storing' in out.getvalue()
+    assert _counts(ont) == {'A': 3, 'B': 2, 'C': 1}
+
+
+@pytest.mark.parametrize('backend', ['networkx', 'compact'])
+def test_serialization_snapshot_is_unaffected_by_later_removals(dataset, build, tmp_path, backend):
+    ont = build(dataset, backend)
+    ont.remove_concept(sorted(ont.leaf_frontier())[0])
+    snapshot = ont.serialization_snapshot()
+    ont.serialize_nodes(str(tmp_path / 'expected.txt'))
+    for _ in range(10):
+        ont.remove_concept(sorted(ont.leaf_frontier())[0])
+    snapshot.serialize_nodes(str(tmp_path / 'snapshot.txt'))
+    assert (tmp_path / 'snapshot.txt').read_text() == (tmp_path / 'expected.txt').read_text()
+
+
+def test_warm_start_matches_a_cold_build(write_inputs, quiet, tmp_path):
+    ontology_lines = ['A', 'B:A', 'C:A', 'D:B,C']
+    original = ['D:o1,o2', 'C:o3']
+    delta = ['B:o2,o4', 'C:o5']
+    paths = write_inputs(ontology_lines, original)
+    delta_path = tmp_path / 'delta.txt'
+    delta_path.write_text("\n".join(delta))
+    # a file row replaces earlier rows for its concept, so the union is written out
+    cold_paths = write_inputs(ontology_lines, ['D:o1,o2', 'C:o3,o5', 'B:o2,o4'], prefix='cold_')
+    factory = ontology.OntologyFactory()
+    with quiet():
+        factory.build_compact_ontology_from_files(*paths).save(str(tmp_path / 'snapshot'))
+        warm = factory.warm_start_compact_ontology(str(tmp_path / 'snapshot'), str(delta_path), paths[1])
+        cold = factory.build_compact_ontology_from_files(*cold_paths)
+        # without the previous annotations o2 is counted twice
+        overcounted = factory.warm_start_compact_ontology(str(tmp_path / 'snapshot'), str(delta_path))
+    assert _counts(warm) == _counts(cold)
+    assert warm.annotators() == cold.annotators()
+    assert warm.total_annotated_objects() == cold.total_annotated_objects() == 5
+    assert overcounted.total_annotated_objects() == 6
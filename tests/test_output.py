@@ -0,0 +1,25 @@
+__author__ = 'Aaron J Masino'
+
+import gzip
+
+from rollup.utils import output
+
+
+def test_write_lines_in_blocks(tmp_path):
+    path = str(tmp_path / 'out.txt')
+    lines = ['line{0}'.format(i) for i in range(100)]
+    assert output.write_lines(iter(lines), path, buffer_size=16) == 100
+    assert open(path).read() == "\n".join(lines)
+
+
+def test_gzip_output_appends_members(tmp_path):
+    path = str(tmp_path / 'out.txt.gz')
+    output.write_lines(['a:1,2', 'b'], path)
+    output.write_lines(['c:3'], path)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        assert f.read() == "a:1,2\nbc:3"
+
+
+def test_key_values_line():
+    assert output.key_values_line('C1', ['A', 2]) == 'C1:A,2'
+    assert output.key_values_line('C1', []) == 'C1'
@@ -0,0 +1,87 @@
+__author__ = 'Aaron J Masino'
+
+import pytest
+
+from rollup.models.overlay import OntologyOverlay
+
+
+def _state(ont):
+    return (ont.concepts(), sorted(ont.leaf_nodes()), ont.annotators(),
+            dict((c, ont.parent_concepts(c)) for c in ont.concepts()))
+
+
+def test_overlay_rollup_matches_compact_and_leaves_the_base_unchanged(dataset, build, run):
+    expected_trajectories = {}
+    expected = run(build(dataset, 'compact'), trajectories=expected_trajectories)
+    base = build(dataset, 'compact')
+    original = _state(base)
+    overlay = OntologyOverlay(base)
+    trajectories = {}
+    assert run(overlay, trajectories=trajectories) == expected
+    assert trajectories == expected_trajectories
+    assert _state(base) == original
+    assert overlay.total_annotators() < base.total_annotators()
+
+
+def test_reset_overlay_runs_again_identically(dataset, build, run):
+    overlay = OntologyOverlay(build(dataset, 'compact'))
+    original = _state(overlay)
+    first = run(overlay)
+    overlay.reset()
+    assert _state(overlay) == original
+    assert run(overlay) == first
+
+
+def test_overlays_share_a_base(dataset, build, run):
+    base = build(dataset, 'compact')
+    a, b = OntologyOverlay(base), OntologyOverlay(base)
+    run(a, max_iters=20)
+    assert _state(b) == _state(base)
+    assert len(a.concepts()) == len(base.concepts()) - 20
+
+
+def test_snapshot_is_unaffected_by_later_changes(dataset, build, run, tmp_path):
+    overlay = OntologyOverlay(build(dataset, 'compact'))
+    run(overlay, max_iters=10)
+    snapshot = overlay.serialization_snapshot()
+    overlay.serialize_nodes(str(tmp_path / 'expected.txt'))
+    run(overlay, max_iters=10)
+    snapshot.serialize_nodes(str(tmp_path / 'snapshot.txt'))
+    assert (tmp_path / 'snapshot.txt').read_text() == (tmp_path / 'expected.txt').read_text()
+    assert len(snapshot.concepts()) == len(overlay.concepts()) + 10
+
+
+def test_mask_has_the_bit_of_each_concept(dataset, build):
+    overlay = OntologyOverlay(build(dataset, 'compact'))
+    slots = [0, 7, 8, 63, 64, 65, len(overlay.concept_ids) - 1]
+    for i in slots:
+        overlay._set(overlay.removed_bits, i)
+    mask = overlay._mask(overlay.removed_bits)
+    assert len(mask) == len(overlay.concept_ids)
+    assert list(mask.nonzero()[0]) == slots
+    assert all(mask[i] == overlay._test(overlay.removed_bits, i) for i in range(len(mask)))
+
+
+def test_direct_annotators_of_the_base_cannot_be_cleared(dataset, build):
+    base = build(dataset, 'compact')
+    overlay = OntologyOverlay(base)
+    annotator = base.annotators()[0]
+    other = next(c for c in base.concepts() if not base.is_direct_annotator(c))
+    overlay.set_direct_annotator(other)
+    assert overlay.is_direct_annotator(other) and not base.is_direct_annotator(other)
+    overlay.set_direct_annotator(other, False)
+    assert not overlay.is_direct_annotator(other)
+    with pytest.raises(ValueError):
+        overlay.set_direct_annotator(annotator, False)
+
+
+def test_base_must_not_be_rolled(dataset, build, run):
+    base = build(dataset, 'compact')
+    run(base, max_iters=1)
+    with pytest.raises(ValueError):
+        OntologyOverlay(base)
+
+
+def test_networkx_base_is_converted(dataset, build):
+    overlay = OntologyOverlay(build(dataset))
+    assert _state(overlay) == _state(build(dataset, 'compact'))
@@ -0,0 +1,51 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+
+from rollup.utils import parsing
+
+ANNOTATIONS = ['C1: o1, o2,o3', 'no separator', '', 'C2:o2', 'C3:o4:ignored', 'C1:o5']
+
+
+def _rows(annotations):
+    return [(cid, annotations.objects(row)) for cid, row in annotations]
+
+
+def _parse(path, **kwargs):
+    interner = parsing.Interner()
+    return [(cid, [interner.ids[i] for i in row]) for cid, row in parsing.iter_annotations(path, interner, **kwargs)]
+
+
+def test_iter_annotations_matches_split_parsing(tmp_path):
+    path = tmp_path / 'annotations.txt'
+    path.write_text("\n".join(ANNOTATIONS))
+    expected = [('C1', ['o1', 'o2', 'o3']), ('C2', ['o2']), ('C3', ['o4']), ('C1', ['o5'])]
+    assert _parse(str(path)) == expected
+    # rows and object ids split across chunk boundaries
+    assert _parse(str(path), chunk_size=3) == expected
+
+
+def test_iter_annotations_in_processes_matches_single_process(dataset):
+    assert _parse(dataset[1], processes=2) == _parse(dataset[1])
+
+
+def test_direct_annotations_round_trip(dataset):
+    annotations = parsing.DirectAnnotations.from_file(dataset[1])
+    assert _rows(annotations) == _parse(dataset[1])
+    assert len(annotations) == len(_parse(dataset[1]))
+    assert not annotations.indices.flags.writeable
+
+
+def test_merged_unions_objects_per_concept(tmp_path):
+    (tmp_path / 'a.txt').write_text("\n".join(['C1:o1', 'C2:o2,o3', 'C1:o1,o4']))
+    (tmp_path / 'b.txt').write_text("\n".join(['C3:o5', 'C2:o3,o6']))
+    a = parsing.DirectAnnotations.from_file(str(tmp_path / 'a.txt'))
+    b = parsing.DirectAnnotations.from_file(str(tmp_path / 'b.txt'))
+    merged = a.merged(b)
+    # C1 is taken from its last row in a, as when a file is read into a dictionary
+    assert [(cid, sorted(objects)) for cid, objects in _rows(merged)] == [('C1', ['o1', 'o4']),
+                                                                          ('C2', ['o2', 'o3', 'o6']),
+                                                                          ('C3', ['o5'])]
+    assert merged.indices.dtype == np.int32
+    empty = parsing.DirectAnnotations([], [0], [], [])
+    assert _rows(a.merged(empty)) == [('C1', ['o1', 'o4']), ('C2', ['o2', 'o3'])]
@@ -0,0 +1,157 @@
+__author__ = 'Aaron J Masino'
+
+import json
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from conftest import DATASET_ANNOTATORS
+from rollup.models import rollup
+from rollup.utils import collections
+from rollup.utils import metrics
+from rollup.utils import parsing
+from rollup.utils.iteration_log import IterationRecord
+
+
+def _annotator_ic_stdev(ont):
+    ics = list(ont.annotators_information_content(ont.total_annotated_objects()).values())
+    return rollup.ic_stdev(ics, np.mean(ics), len(ics))
+
+
+@pytest.mark.parametrize('backend', ['bitmap', 'compact'])
+def test_backends_roll_the_same_leaves(dataset, build, run, backend):
+    rollups, levels, lambdas, psis = run(build(dataset))
+    other_rollups, other_levels, other_lambdas, other_psis = run(build(dataset, backend))
+    assert dict((k, sorted(v)) for k, v in rollups.items()) == dict((k, sorted(v)) for k, v in other_rollups.items())
+    assert levels == other_levels
+    assert np.allclose(lambdas, other_lambdas, rtol=0, atol=1e-9)
+    assert np.allclose(psis, other_psis, rtol=0, atol=1e-9)
+
+
+def test_running_statistics_match_the_rolled_ontology(dataset, build, run):
+    ont = build(dataset)
+    initial = _annotator_ic_stdev(ont)
+    _, _, lambdas, psis = run(ont)
+    assert ont.total_annotators() == DATASET_ANNOTATORS
+    assert abs(psis[0] - initial) < 1e-9
+    assert abs(psis[-1] - _annotator_ic_stdev(ont)) < 1e-9
+    ics = list(ont.annotators_information_content(ont.total_annotated_objects()).values())
+    assert abs(lambdas[-1] - np.mean(ics)) < 1e-9
+    assert len(psis) == len(lambdas)
+
+
+def test_rolled_concepts_map_to_remaining_ancestors(dataset, build, run):
+    original = build(dataset)
+    ont = build(dataset)
+    rollups, levels, _, _ = run(ont)
+    annotators = set(ont.annotators())
+    assert set(original.annotators()) <= set(rollups)
+    assert set(t for targets in rollups.values() for t in targets) == annotators
+    for k, targets in rollups.items():
+        if targets == [k]:
+            assert levels[k] == 0
+        else:
+            assert levels[k] >= 1 and len(set(targets)) == len(targets)
+            assert set(targets) <= nx.descendants(original.graph, k)
+
+
+def test_rolled_annotations_match_the_dictionary_mapping(dataset, build, run, tmp_path):
+    rollups, _, _, _ = run(build(dataset))
+    annotations = parsing.DirectAnnotations.from_file(dataset[1])
+    as_dict = dict((cid, annotations.objects(row)) for cid, row in annotations)
+    expected = rollup.map_annotations_with_rollup(rollups, as_dict)
+
+    path = str(tmp_path / 'annotations_rolled.txt')
+    rollup.serialize_rolled_annotations(rollups, annotations, path)
+    text = open(path).read()
+    assert not text.endswith("\n")
+    written = dict((line.split(':')[0], sorted(line.split(':')[1].split(','))) for line in text.split("\n"))
+    assert written == dict((k, sorted(v)) for k, v in expected.items())
+
+
+def test_rollup_serializers(tmp_path):
+    rollups = {'B': ['A'], 'C': ['A', 'B2'], 'A': ['A']}
+    rollup.serialize_rollups(rollups, str(tmp_path / 'rollup.txt'))
+    rollup.serialzie_rollup_levels({'B': 1, 'C': 2, 'A': 0}, str(tmp_path / 'levels.txt'))
+    collections.serialize_list([0.5, 0.25], str(tmp_path / 'psis.txt'))
+    assert open(str(tmp_path / 'rollup.txt')).read() == "B:A\nC:A,B2\nA:A"
+    assert open(str(tmp_path / 'levels.txt')).read() == "B,1\nC,2\nA,0"
+    assert open(str(tmp_path / 'psis.txt')).read() == "0.5,0.25"
+
+
+def test_trajectories_follow_the_rollup(dataset, build, run):
+    ont = build(dataset)
+    trajectories = {}
+    _, _, lambdas, psis = run(ont, trajectories=trajectories)
+    assert trajectories['lambdas'] == lambdas and trajectories['psis'] == psis
+    assert trajectories['annotator_counts'][-1] == ont.total_annotators() == DATASET_ANNOTATORS
+    assert len(trajectories['psis']) == len(trajectories['gammas']) == len(trajectories['annotator_counts']) + 1
+    assert len(trajectories['leaf_counts']) == len(trajectories['annotator_counts'])
+
+
+def test_rollup_arrays_round_trip(dataset, build, run, tmp_path):
+    trajectories = {}
+    rollups, levels, _, _ = run(build(dataset), trajectories=trajectories)
+    rollup.save_rollup_arrays(str(tmp_path / 'arrays'), rollups, levels, trajectories)
+    arrays = rollup.load_rollup_arrays(str(tmp_path / 'arrays'))
+    ids = arrays['concept_ids']
+    offsets = arrays['rollup_offsets']
+    loaded = dict((ids[i], [ids[j] for j in arrays['rollup_indices'][offsets[i]:offsets[i + 1]]])
+                  for i in range(len(offsets) - 1))
+    assert loaded == rollups
+    assert dict(zip(ids, arrays['rollup_levels'].tolist())) == levels
+    assert arrays['psis'].tolist() == trajectories['psis']
+
+
+@pytest.mark.parametrize('batch_size', [4, 'auto'])
+def test_batches_reach_the_target(dataset, build, run, batch_size):
+    ont = build(dataset)
+    greedy = {}
+    trajectories = {}
+    run(build(dataset), trajectories=greedy)
+    rollups, _, _, psis = run(ont, batch_size=batch_size, trajectories=trajectories)
+    assert ont.total_annotators() == DATASET_ANNOTATORS
+    assert set(t for targets in rollups.values() for t in targets) == set(ont.annotators())
+    assert abs(psis[-1] - _annotator_ic_stdev(ont)) < 1e-9
+    divergence = rollup.psi_divergence(trajectories, greedy)
+    assert divergence['counts'] > 0 and divergence['max'] >= abs(divergence['final'])
+    assert rollup.psi_divergence(greedy, greedy)['max'] == 0.0
+
+
+def test_validate_reports_the_first_changed_choice(dataset, build, quiet):
+    records = []
+    with quiet():
+        rollup.rollup(build(dataset), DATASET_ANNOTATORS, 50000, 10 ** 9, iteration_log=records)
+    changed = records[:2] + [records[2]._replace(leaf=records[3].leaf)] + records[3:]
+    for validate, expected in ((records, "unchanged, {0} iterations validated".format(len(records))),
+                               (changed, "changes at iteration 3, 2 iterations validated")):
+        with quiet() as out:
+            result = rollup.rollup(build(dataset), DATASET_ANNOTATORS, 50000, 10 ** 9, validate=validate)
+        assert expected in out.getvalue()
+        assert len(result[3]) == len(records) + 1
+
+
+def test_metrics_and_profiler(dataset, build, run, tmp_path):
+    sink = metrics.RingBufferSink()
+    profiler = metrics.IterationProfiler(3, str(tmp_path / 'profile.out'))
+    trajectories = {}
+    run(build(dataset), metrics=sink, profiler=profiler, trajectories=trajectories)
+    records = list(sink)
+    assert [m.iteration for m in records] == list(range(1, len(trajectories['annotator_counts']) + 1))
+    assert [m.d for m in records] == trajectories['annotator_counts']
+    assert [m.psi for m in records] == trajectories['psis'][1:]
+    assert all(m.scoring_seconds >= 0 and m.elapsed_seconds >= 0 for m in records)
+    assert profiler.stats is not None and (tmp_path / 'profile.out').exists()
+
+    with metrics.JsonlMetricsSink(str(tmp_path / 'metrics.jsonl')) as jsonl:
+        for m in records:
+            jsonl.append(m)
+    with open(str(tmp_path / 'metrics.jsonl')) as f:
+        assert [json.loads(line)['psi'] for line in f] == trajectories['psis'][1:]
+
+
+def test_replay_is_rejected_with_batches(dataset, build, run):
+    record = IterationRecord(0, (), 1, 0.0, 0.0, 0.0, 1)
+    with pytest.raises(ValueError):
+        run(build(dataset), replay=[record], batch_size=4)
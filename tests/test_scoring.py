@@ -0,0 +1,46 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+
+from rollup.models.rollup import ic_stdev
+from rollup.models.scoring import CandidateTable, ICStatistics, PSI_TOLERANCE
+
+ICS = [3.1, 7.4, 2.2, 9.9, 5.0]
+
+
+def test_score_of_a_delta_matches_recomputed_stdev():
+    stats = ICStatistics(ICS)
+    delta = stats.delta([7.4, 2.2], [4.3])
+    _, lam, psi, d = stats.score(*delta)
+    remaining = [3.1, 9.9, 5.0, 4.3]
+    assert d == 4
+    assert abs(lam - np.mean(remaining)) < 1e-12
+    assert abs(psi - ic_stdev(remaining, np.mean(remaining), 4)) < PSI_TOLERANCE
+
+    stats.apply(*delta)
+    assert stats.D == 4
+    assert abs(stats.score()[2] - ic_stdev(remaining, np.mean(remaining), 4)) < PSI_TOLERANCE
+
+
+def test_resync_matches_a_new_statistics():
+    stats = ICStatistics(ICS)
+    for _ in range(1000):
+        stats.apply(*stats.delta([9.9], [9.9]))
+    stats.resync(ICS)
+    assert stats.score() == ICStatistics(ICS).score()
+
+
+def test_best_breaks_ties_by_lowest_slot():
+    stats = ICStatistics(ICS)
+    table = CandidateTable(stats, 5)
+    assert table.best() is None
+    same = stats.delta([9.9], [])
+    table.update(4, same)
+    table.update(1, same)
+    table.update(3, stats.delta([3.1], []))
+    assert table.size == 3 and 1 in table and 0 not in table
+    assert table.best()[0] == 1
+    table.remove(1)
+    assert table.best()[0] == 4
+    assert table.ranked().tolist() == [4, 3]
+
@@ -0,0 +1,34 @@
+__author__ = 'Aaron J Masino'
+
+import numpy as np
+import pytest
+
+from rollup.utils.sketch import HyperLogLog, MAX_PRECISION, MIN_PRECISION, precision_for_error
+
+
+@pytest.mark.parametrize('count', [10, 1000, 50000])
+def test_estimate_is_within_the_standard_error(count):
+    hll = HyperLogLog.from_indices(np.arange(count), precision=precision_for_error(0.02))
+    # four standard errors
+    assert abs(len(hll) - count) <= max(1, 4 * 0.02 * count)
+
+
+def test_empty_and_duplicates():
+    assert len(HyperLogLog()) == 0
+    assert len(HyperLogLog.from_indices([7] * 100)) == 1
+
+
+def test_union_is_the_sketch_of_the_union():
+    a = HyperLogLog.from_indices(np.arange(0, 3000))
+    b = HyperLogLog.from_indices(np.arange(2000, 5000))
+    union = a | b
+    assert (union.registers == HyperLogLog.from_indices(np.arange(5000)).registers).all()
+    assert len(a) == len(HyperLogLog.from_indices(np.arange(0, 3000)))
+    with pytest.raises(ValueError):
+        a.union_update(HyperLogLog(precision=10))
+
+
+def test_precision_for_error():
+    assert precision_for_error(0.01) == 14
+    assert precision_for_error(1.0) == MIN_PRECISION
+    assert precision_for_error(1e-6) == MAX_PRECISION
@@ -0,0 +1,75 @@
+__author__ = 'Aaron J Masino'
+
+import configparser
+
+import pytest
+
+from conftest import DATASET_ANNOTATORS, read_outputs, write_config
+from rollup import main
+from rollup import sweep
+
+
+def _grid_config(path, dataset, output_dir, grid):
+    """writes a configuration with a Sweep_Grid section, storing the output of each run in output_dir/RUN_NAME"""
+    write_config(path, dataset, output_dir / '{run}')
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(str(path))
+    config['Sweep_Grid'] = grid
+    config['Sweep'] = {'MAX_WORKERS': '2'}
+    with open(str(path), 'w') as f:
+        config.write(f)
+    return str(path)
+
+
+def test_expand_runs(dataset, quiet, tmp_path):
+    grid = {'TOTAL_ANNOTATORS_AFTER_ROLLUP': '10; 20', 'FILE_ANNOTATIONS': 'a.txt;b.txt', 'BATCH_SIZE': '1'}
+    config = sweep.config_helper.loadConfig(_grid_config(tmp_path / 'grid.ini', dataset, tmp_path, grid))
+    with quiet():
+        runs = sweep.expand_runs(config, 'grid')
+    assert [run['name'] for run in runs] == ['grid_{0:03d}'.format(i) for i in range(4)]
+    assert [(run['input_files']['FILE_ANNOTATIONS'], run['rollup_options']['TOTAL_ANNOTATORS_AFTER_ROLLUP'])
+            for run in runs] == [('a.txt', '10'), ('a.txt', '20'), ('b.txt', '10'), ('b.txt', '20')]
+    assert all(run['rollup_options']['BATCH_SIZE'] == '1' for run in runs)
+    assert all(run['input_files']['FILE_ONTOLOGY'] == dataset[0] for run in runs)
+    assert runs[1]['output_files']['FILE_ROLLUP'] == str(tmp_path / 'grid_001' / 'rollup_{0}.txt')
+
+    config.remove_section('Sweep_Grid')
+    runs = sweep.expand_runs(config, 'plain')
+    assert len(runs) == 1 and runs[0]['name'] == 'plain'
+
+
+def test_expand_runs_rejects_shared_output_files(dataset, quiet, tmp_path):
+    config = sweep.config_helper.loadConfig(_grid_config(tmp_path / 'grid.ini', dataset, tmp_path,
+                                                         {'BATCH_SIZE': '1;4'}))
+    config['Output_Files']['FILE_ROLLUP'] = str(tmp_path / 'rollup_{0}.txt')
+    with quiet(), pytest.raises(ValueError) as e:
+        sweep.expand_runs(config, 'grid')
+    assert 'FILE_ROLLUP' in str(e.value)
+
+
+def test_max_concurrency():
+    cores = sweep.multiprocessing.cpu_count()
+    assert sweep.max_concurrency(None, 0) == cores
+    assert sweep.max_concurrency(1, 0) == 1
+    assert sweep.max_concurrency(cores + 4, 0) == cores
+    # at least one run even if it does not fit in memory
+    assert sweep.max_concurrency(None, 1 << 60) == 1
+
+
+def test_sweep_runs_match_single_runs(dataset, quiet, tmp_path):
+    grid = {'TOTAL_ANNOTATORS_AFTER_ROLLUP': '{0};20'.format(DATASET_ANNOTATORS), 'BATCH_SIZE': '1;4'}
+    config = _grid_config(tmp_path / 'grid.ini', dataset, tmp_path, grid)
+    with quiet():
+        assert sweep.main(['sweep.py', config]) == 0
+    # grid runs are numbered in the order of the sorted grid keys
+    for i, (batch_size, annotators) in enumerate([(1, DATASET_ANNOTATORS), (1, 20), (4, DATASET_ANNOTATORS),
+                                                  (4, 20)]):
+        name = 'single_{0}'.format(i)
+        (tmp_path / name).mkdir()
+        single = write_config(tmp_path / (name + '.ini'), dataset, tmp_path / name, BATCH_SIZE=str(batch_size),
+                              TOTAL_ANNOTATORS_AFTER_ROLLUP=str(annotators))
+        with quiet():
+            main.main(['main.py', single])
+        assert read_outputs(tmp_path / 'grid_{0:03d}'.format(i), annotators) == read_outputs(tmp_path / name,
+                                                                                            annotators)